@@ -1,16 +1,152 @@
-from flask import Flask, render_template, Response
-import feedgenerator
-from datetime import datetime
+import time
+
+# Startup is measured from here, so it covers importing Flask as well.
+_import_started = time.perf_counter()
+
+from flask import (
+    Flask,
+    before_render_template,
+    g,
+    make_response,
+    render_template,
+    request,
+    send_from_directory,
+    template_rendered,
+    Response,
+)
+import hashlib
+import os
+from collections import namedtuple
+from contextlib import suppress
+from datetime import datetime, timezone
+from functools import lru_cache, wraps
+from typing import Callable, Dict, List, Optional
+from werkzeug.http import is_resource_modified
 
 from utils import *
 
 from opencoder.app import sub_app
+from search import get_search_index
+from cosmo import get_post_bundle
+import timing
+import optimize
+
+# A year, the longest max-age browsers honour.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
 
-app = Flask(__name__)
 
-app.config["FREEZER_DESTINATION_IGNORE"] = [".git*"]
+class BlogFlask(Flask):
+    def send_static_file(self, filename: str) -> Response:
+        original = assets.resolve(filename)
+        if original is None:
+            return super().send_static_file(filename)
+        response = send_from_directory(
+            self.static_folder, original, max_age=IMMUTABLE_MAX_AGE
+        )
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+app = BlogFlask(__name__)
+assets = AssetManifest(app.static_folder)
+
+# Precompressed siblings and the search index are written by generate.py
+# after freezing.
+app.config["FREEZER_DESTINATION_IGNORE"] = [".git*", "*.gz", "*.zst", "search-index/*"]
+# Inline the rendered post body in feed.xml items.
+app.config["FEED_FULL_CONTENT"] = os.environ.get("BLOG_FEED_FULL_CONTENT") == "1"
+app.config["POSTS_PER_PAGE"] = int(os.environ.get("BLOG_POSTS_PER_PAGE", "20"))
+# Cache-Control per route class, see ROUTE_CLASSES.
+app.config["CACHE_CONTROL"] = {
+    "listing": "public, no-cache",
+    "post": "public, max-age=300",
+    "feed": "public, max-age=3600",
+}
+# Per-request phase timings in a Server-Timing header and on /_metrics.
+app.config["TIMING"] = os.environ.get("BLOG_TIMING") == "1"
+# /_metrics is public to whoever reaches the app, only served when asked for.
+app.config["METRICS"] = os.environ.get("BLOG_METRICS") == "1"
 app.register_blueprint(sub_app, url_prefix="/opencoder")
 
+ROUTE_CLASSES = {
+    "index": "listing",
+    "category": "listing",
+    "tag": "listing",
+    "post": "post",
+    "cosmo_bundle": "post",
+    "rss_posts": "feed",
+    "sitemap": "feed",
+    "sitemap_page": "feed",
+    "search": "listing",
+}
+
+
+@app.route("/images/<path:filename>")
+def resized_image(filename):
+    # Variant names carry the source digest, so they never change content.
+    response = send_from_directory(
+        os.path.abspath(IMAGE_DIR), filename, max_age=IMMUTABLE_MAX_AGE
+    )
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
+
+
+@app.template_global()
+def asset_url(filename: str) -> str:
+    return "/static/" + assets.hashed(filename)
+
+
+@app.before_request
+def start_timing():
+    if app.config["TIMING"]:
+        g.timing = timing.start(), time.perf_counter()
+
+
+# Registered before the other after_request hooks, so it runs after them.
+@app.after_request
+def finish_timing(response):
+    recording = g.pop("timing", None)
+    if recording is None:
+        return response
+    phases, started = recording
+    phases = dict(phases)
+    phases["total"] = time.perf_counter() - started
+    response.headers["Server-Timing"] = timing.server_timing(phases)
+    timing.metrics.observe(request.endpoint or "unmatched", phases)
+    if timing.pages is not None:
+        timing.pages[request.path] = phases
+    return response
+
+
+@app.teardown_request
+def stop_timing(exc):
+    timing.stop()
+
+
+def _template_started(sender, **extra):
+    if "timing" in g:
+        g.template_started = time.perf_counter()
+
+
+def _template_finished(sender, **extra):
+    started = g.pop("template_started", None)
+    if started is not None:
+        timing.add("template", time.perf_counter() - started)
+
+
+before_render_template.connect(_template_started, app)
+template_rendered.connect(_template_finished, app)
+
+
+@app.route("/_metrics")
+def metrics():
+    """Prometheus text format, only answered with metrics and timing enabled."""
+    if not (app.config["METRICS"] and app.config["TIMING"]):
+        return "Not found", 404
+    return Response(timing.metrics.prometheus(), mimetype="text/plain")
+
 
 @app.after_request
 def add_coop_coep_headers(response):
@@ -19,56 +155,337 @@ def add_coop_coep_headers(response):
     return response
 
 
-@app.route("/")
-def index():
+app.config["COMPRESS_MIN_SIZE"] = 1024
+_compressed = LRUCache(32 * 1024 * 1024)
+
+
+@app.after_request
+def compress_response(response):
+    """
+    Negotiates Accept-Encoding. Bodies are compressed once and cached by
+    ETag, so repeated hits only pay for the lookup.
+    """
+    if (
+        response.status_code != 200
+        or "Content-Encoding" in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = request.accept_encodings.best_match(available_encodings())
+    if encoding is None:
+        return response
+    # Static files are sent as passthrough file wrappers, read them in.
+    response.direct_passthrough = False
+    data = response.get_data()
+    if len(data) < app.config["COMPRESS_MIN_SIZE"]:
+        return response
+    etag, _ = response.get_etag()
+    key = (etag or hashlib.sha256(data).hexdigest(), encoding)
+    compressed = _compressed.get(key)
+    if compressed is None:
+        with timing.phase("compress"):
+            compressed = compress(data, encoding)
+        _compressed.put(key, compressed)
+    if len(compressed) >= len(data):
+        return response
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    if etag:
+        # Same resource, different bytes, a strong ETag would be wrong.
+        response.set_etag(etag, weak=True)
+    return response
+
+
+@app.after_request
+def add_cache_validators(response):
+    route_class = ROUTE_CLASSES.get(request.endpoint)
+    if route_class is None or request.method not in ("GET", "HEAD"):
+        return response
+    if response.status_code not in (200, 304):
+        return response
+    response.headers.setdefault(
+        "Cache-Control", app.config["CACHE_CONTROL"][route_class]
+    )
+    if response.status_code == 200 and not response.is_streamed:
+        if "ETag" not in response.headers:
+            # Pages without a cheaper validator fall back to hashing the body.
+            response.add_etag()
+        response = response.make_conditional(request)
+    return response
+
+
+# Registered last so it runs first, validators and compression see the result.
+@app.after_request
+def optimize_page(response):
+    """While generate.py freezes, purges, inlines and minifies every HTML page."""
+    if (
+        optimize.active is None
+        or response.status_code != 200
+        or response.mimetype != "text/html"
+        or response.is_streamed
+    ):
+        return response
+    html = response.get_data(as_text=True)
+    response.set_data(optimize.active.optimize(request.path, html))
+    return response
+
+
+# Digest of what pages are rendered from besides posts, and when it last
+# changed in ns.
+SiteVersion = namedtuple("SiteVersion", ["digest", "modified"])
+# (monotonic time it was checked at, SiteVersion), see site_version.
+_site_version = (0.0, None)
+
+
+def site_version() -> SiteVersion:
+    """
+    Version of everything pages are rendered from besides posts: renderer,
+    templates and fingerprinted assets. Like the posts snapshot, it is checked
+    for edits at most every BLOG_POSTS_RELOAD_INTERVAL seconds (negative
+    disables), requests in between reuse it.
+    """
+    global _site_version
+    checked_at, version = _site_version
+    interval = float(os.environ.get("BLOG_POSTS_RELOAD_INTERVAL", "1"))
+    if version and (interval < 0 or time.monotonic() - checked_at < interval):
+        return version
+    mapping = assets.mapping()
+    stamps = [renderer_version(), *mapping.values()]
+    modified = 0
+    for name in sorted(os.listdir(app.template_folder)):
+        st = os.stat(os.path.join(app.template_folder, name))
+        stamps.append(f"{name}:{st.st_mtime_ns}:{st.st_size}")
+        modified = max(modified, st.st_mtime_ns)
+    # renderer_version() changes along with the renderer code or image manifest.
+    sources = [os.path.join(app.root_path, n) for n in ("utils.py", "render.py")]
+    sources.append(os.path.join(IMAGE_DIR, "manifest.json"))
+    for path in sources + [os.path.join(app.static_folder, f) for f in mapping]:
+        with suppress(OSError):
+            modified = max(modified, os.stat(path).st_mtime_ns)
+    version = SiteVersion(
+        hashlib.sha256(",".join(stamps).encode()).hexdigest()[:16], modified
+    )
+    _site_version = time.monotonic(), version
+    return version
+
+
+def http_date(ns: int) -> datetime:
+    """Last-Modified for a change at ns since the epoch, whole seconds."""
+    return datetime.fromtimestamp(ns // 10**9, timezone.utc)
+
+
+def git_modified() -> int:
+    """Commit time of HEAD in ns, 0 outside a git checkout."""
+    return (get_git_metadata().head_time() or 0) * 10**9
+
+
+def posts_modified(**view_args) -> int:
+    return get_all_posts_with_metadata().modified
+
+
+def conditional_page(
+    page_inputs: Callable[..., Optional[str]],
+    page_modified: Callable[..., int] = posts_modified,
+):
+    """
+    page_inputs(**view_args) describes everything the page is rendered from
+    (None if the page doesn't exist). The ETag is derived from it, so a
+    matching If-None-Match is answered with a 304 before rendering.
+    page_modified(**view_args) is when those inputs last changed in ns,
+    Last-Modified is the newest of it and the site's.
+    """
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(**kwargs):
+            inputs = page_inputs(**kwargs)
+            if inputs is None:
+                return view(**kwargs)
+            version = site_version()
+            etag = hashlib.sha256(
+                f"{version.digest}\n{request.path}\n{inputs}".encode()
+            ).hexdigest()[:32]
+            last_modified = http_date(max(version.modified, page_modified(**kwargs)))
+            if is_resource_modified(
+                request.environ, etag=etag, last_modified=last_modified
+            ):
+                response = make_response(view(**kwargs))
+            else:
+                response = Response(status=304)
+            response.set_etag(etag)
+            response.last_modified = last_modified
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+def listing_page(n: int, **listing) -> Optional[Page]:
+    pages = get_all_posts_with_metadata().pages(app.config["POSTS_PER_PAGE"], **listing)
+    return pages[n - 1] if 1 <= n <= len(pages) else None
+
+
+def listing_inputs(n: int, **listing) -> Optional[str]:
+    # Pages past the end don't exist, the view answers those with a 404.
+    if listing_page(n, **listing) is None:
+        return None
+    return get_all_posts_with_metadata().version
+
+
+def index_inputs(n: int) -> Optional[str]:
+    posts_version = listing_inputs(n)
+    if posts_version is None:
+        return None
+    st = os.stat("pages/index.md")
+    commits = ",".join(c.hash for c in get_git_commits(10))
+    return f"{posts_version}:{st.st_mtime_ns}:{commits}"
+
+
+def index_modified(n: int) -> int:
+    # The sidebar lists the latest commits.
+    st = os.stat("pages/index.md")
+    return max(posts_modified(), st.st_mtime_ns, git_modified())
+
+
+def post_inputs(path_title: str) -> Optional[str]:
+    posts = get_all_posts_with_metadata()
+    return posts.version if path_title in posts else None
+
+
+# The first page of each listing keeps its unpaginated URL, /page/1/ redirects there.
+@app.route("/", defaults={"n": 1})
+@app.route("/page/<int:n>/")
+@conditional_page(index_inputs, index_modified)
+def index(n):
+    page = listing_page(n)
+    if page is None:
+        return "Page not found", 404
     all_posts = get_all_posts_with_metadata()
-    index_md = get_local_content("pages", "index")
-    md_factory = get_md_factory()
-    html = md_factory(index_md)
-    tags = get_top_k_tags(all_posts, 25)
+    # Only the first page carries the introduction.
+    html = render_markdown(get_local_content("pages", "index")) if n == 1 else ""
+    tags = all_posts.top_tags[:25]
     return render_template(
         "index.html",
         rendered_content=html,
-        posts=all_posts,
+        features=page_features(html),
+        posts=page.posts,
+        page=page,
         tags=tags,
         commits=get_git_commits(10),
     )
 
 
-@app.route("/blog/category/<category>/")
-def category(category):
-    all_posts = get_all_posts_with_metadata()
-    filtered_posts = [p for p in all_posts if p.category == category]
-    return render_template("category.html", category=category, posts=filtered_posts)
+@app.route("/blog/category/<category>/", defaults={"n": 1})
+@app.route("/blog/category/<category>/page/<int:n>/")
+@conditional_page(lambda category, n: listing_inputs(n, category=category))
+def category(category, n):
+    page = listing_page(n, category=category)
+    if page is None:
+        return "Page not found", 404
+    return render_template(
+        "category.html", category=category, posts=page.posts, page=page
+    )
 
 
-@app.route("/blog/tag/<tag>/")
-def tag(tag):
-    all_posts = get_all_posts_with_metadata()
-    filtered_posts = [p for p in all_posts if tag in p.tags]
-    return render_template("tag.html", tag=tag, posts=filtered_posts)
+@app.route("/blog/tag/<tag>/", defaults={"n": 1})
+@app.route("/blog/tag/<tag>/page/<int:n>/")
+@conditional_page(lambda tag, n: listing_inputs(n, tag=tag))
+def tag(tag, n):
+    page = listing_page(n, tag=tag)
+    if page is None:
+        return "Page not found", 404
+    return render_template("tag.html", tag=tag, posts=page.posts, page=page)
+
+
+@app.route("/search/")
+def search():
+    query = request.args.get("q", "").strip()
+    page = max(1, request.args.get("page", 1, type=int))
+    posts = get_all_posts_with_metadata()
+    results, pages = [], 0
+    if query:
+        hits, pages = get_search_index(posts).page(query, page)
+        results = [posts.cache[doc] for doc, _ in hits]
+    return render_template(
+        "search.html", query=query, results=results, page=page, pages=pages
+    )
 
 
 @app.route("/blog/post/<path_title>/")
+@conditional_page(post_inputs)
 def post(path_title):
     cache = get_all_posts_with_metadata()
-    if path_title not in cache.keys():
+    if path_title not in cache:
         return "Post not found", 404
     parsed_post = cache[path_title]
-    md_factory = get_md_factory()
-    html = md_factory(parsed_post.content)
-    return render_template("post.html", post=parsed_post, rendered_content=html)
+    html = render_markdown(parsed_post.body())
+    features = page_features(html)
+    if parsed_post.enable_cosmo:
+        features |= {"cosmo"}
+    related = [cache[r] for r in parsed_post.related if r in cache]
+    return render_template(
+        "post.html",
+        post=parsed_post,
+        rendered_content=html,
+        features=features,
+        related=related,
+    )
 
 
-@app.route("/feed.xml")
-def rss_posts():
+@app.route("/blog/post/<path_title>/cosmo.bundle")
+def cosmo_bundle(path_title):
+    """Scenes and meshes of every cosmo display in the post, see cosmo.py."""
+    cache = get_all_posts_with_metadata()
+    bundle = get_post_bundle(cache[path_title].body()) if path_title in cache else None
+    if bundle is None:
+        return "Bundle not found", 404
+    return Response(bundle, mimetype="application/octet-stream")
+
+
+FEED_DESCRIPTION = "Hey there, I'm fzxu. I (am hoping to) write about coding, system design and all other technical stuffs that I know (or would like to explore) here. Any comments/discussions are greatly welcomed."
+# Per the sitemaps.org protocol, larger sites need a sitemap index.
+SITEMAP_MAX_URLS = 50000
+
+Document = namedtuple("Document", ["data", "etag"])
+
+
+def make_document(text: str) -> Document:
+    data = text.encode("utf-8")
+    return Document(data, hashlib.sha256(data).hexdigest()[:32])
+
+
+def xml_response(doc: Document) -> Response:
+    response = Response(doc.data, mimetype="application/xml")
+    response.set_etag(doc.etag)
+    # The documents follow the posts, their git history and, for full content
+    # feeds, the renderer.
+    response.last_modified = http_date(
+        max(posts_modified(), git_modified(), site_version().modified)
+    )
+    return response.make_conditional(request)
+
+
+def last_edited(post: ParsedPost, mtimes: Dict[str, datetime]) -> datetime:
+    published = datetime.strptime(post.date, "%Y-%m-%d %H:%M:%S")
+    edited = mtimes.get(post.path_title)
+    return max(published, edited) if edited else published
+
+
+@lru_cache(maxsize=2)
+def build_feed(posts: PostsCache, full_content: bool, git_head: str) -> Document:
+    """Built once per PostsCache snapshot and git HEAD."""
+    mtimes = get_git_metadata().post_mtimes()
+    import feedgenerator
+
     feed = feedgenerator.Rss201rev2Feed(
         title="fzxu.me",
         link="https://site.fzxu.me/",
-        description="Hey there, I'm fzxu. I (am hoping to) write about coding, system design and all other technical stuffs that I know (or would like to explore) here. Any comments/discussions are greatly welcomed.",
+        description=FEED_DESCRIPTION,
         language="en",
     )
-    for post in get_all_posts_with_metadata():
+    for post in posts:
         thumbnail_link = ""
         if post.thumbnail:
             thumbnail_link = (
@@ -77,60 +494,136 @@ def rss_posts():
                 else f"https://site.fzxu.me{post.thumbnail}"
             )
         thumbnail = f'<a href="https://site.fzxu.me/blog/post/{post.path_title}/"><img src="{thumbnail_link}" alt="{post.title}" /></a>'
+        description = (
+            f"{thumbnail}<br>Tags: {', '.join(post.tags)}<br>Category: {post.category}"
+        )
+        if full_content:
+            description += "<br>" + render_markdown(post.body())
         feed.add_item(
             title=post.title.strip() + (" " + post.subtitle if post.subtitle else ""),
             link=f"https://site.fzxu.me/blog/post/{post.path_title}/",
-            description=f"{thumbnail}<br>Tags: {', '.join(post.tags)}<br>Category: {post.category}",
+            description=description,
             pubdate=datetime.strptime(post.date, "%Y-%m-%d %H:%M:%S"),
+            updateddate=last_edited(post, mtimes),
             unique_id=post.path_title,
         )
-    xml = feed.writeString("utf-8")
-    return Response(xml, mimetype="application/xml")
+    return make_document(feed.writeString("utf-8"))
+
+
+@app.route("/feed.xml")
+def rss_posts():
+    posts = get_all_posts_with_metadata()
+    feed = build_feed(
+        posts, app.config["FEED_FULL_CONTENT"], get_git_metadata().version()
+    )
+    return xml_response(feed)
+
+
+def sitemap_url(loc: str, changefreq: str, priority: str, lastmod: str = None) -> str:
+    return "\n".join(
+        ["    <url>", f"        <loc>{loc}</loc>"]
+        + ([f"        <lastmod>{lastmod}</lastmod>"] if lastmod else [])
+        + [
+            f"        <changefreq>{changefreq}</changefreq>",
+            f"        <priority>{priority}</priority>",
+            "    </url>",
+        ]
+    )
+
+
+@lru_cache(maxsize=1)
+def build_sitemaps(posts: PostsCache, git_head: str) -> List[Document]:
+    """
+    Built once per PostsCache snapshot and git HEAD, <lastmod> is the last
+    commit touching the post. The first document is /sitemap.xml,
+    which turns into a sitemap index over /sitemap-<n>.xml once the URL count
+    passes SITEMAP_MAX_URLS.
+    """
+    from urllib.parse import quote
+
+    mtimes = get_git_metadata().post_mtimes()
+    urls = [sitemap_url("https://site.fzxu.me/", "weekly", "1.0")]
+    # Add blog posts
+    for post in posts:
+        urls.append(
+            sitemap_url(
+                f"https://site.fzxu.me/blog/post/{quote(post.path_title)}/",
+                "monthly",
+                "0.8",
+                lastmod=last_edited(post, mtimes).strftime("%Y-%m-%d"),
+            )
+        )
+    # Add category pages
+    for category in posts.by_category:
+        urls.append(
+            sitemap_url(
+                f"https://site.fzxu.me/blog/category/{quote(category)}/",
+                "weekly",
+                "0.6",
+            )
+        )
+    # Add tag pages
+    for tag in posts.tags:
+        urls.append(
+            sitemap_url(f"https://site.fzxu.me/blog/tag/{quote(tag)}/", "weekly", "0.5")
+        )
+
+    def urlset(chunk: List[str]) -> Document:
+        return make_document(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+            + "\n".join(chunk)
+            + "\n</urlset>"
+        )
+
+    if len(urls) <= SITEMAP_MAX_URLS:
+        return [urlset(urls)]
+    chunks = [
+        urlset(urls[i : i + SITEMAP_MAX_URLS])
+        for i in range(0, len(urls), SITEMAP_MAX_URLS)
+    ]
+    index = "".join(f"""
+    <sitemap>
+        <loc>https://site.fzxu.me/sitemap-{n}.xml</loc>
+    </sitemap>""" for n in range(1, len(chunks) + 1))
+    return [
+        make_document(
+            '<?xml version="1.0" encoding="UTF-8"?>\n'
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+            + index
+            + "\n</sitemapindex>"
+        )
+    ] + chunks
 
 
 @app.route("/sitemap.xml")
 def sitemap():
-    from urllib.parse import quote
+    posts = get_all_posts_with_metadata()
+    return xml_response(build_sitemaps(posts, get_git_metadata().version())[0])
 
-    sitemap_xml = """<?xml version="1.0" encoding="UTF-8"?>
-<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
-    <url>
-        <loc>https://site.fzxu.me/</loc>
-        <changefreq>weekly</changefreq>
-        <priority>1.0</priority>
-    </url>"""
 
-    # Add blog posts
-    for post in get_all_posts_with_metadata():
-        sitemap_xml += f"""
-    <url>
-        <loc>https://site.fzxu.me/blog/post/{quote(post.path_title)}/</loc>
-        <lastmod>{datetime.strptime(post.date, "%Y-%m-%d %H:%M:%S").strftime("%Y-%m-%d")}</lastmod>
-        <changefreq>monthly</changefreq>
-        <priority>0.8</priority>
-    </url>"""
+@app.route("/sitemap-<int:n>.xml")
+def sitemap_page(n):
+    posts = get_all_posts_with_metadata()
+    sitemaps = build_sitemaps(posts, get_git_metadata().version())
+    if n < 1 or n >= len(sitemaps):
+        return "Sitemap not found", 404
+    return xml_response(sitemaps[n])
 
-    # Add category pages
-    all_categories = {p.category for p in get_all_posts_with_metadata()}
-    for category in all_categories:
-        sitemap_xml += f"""
-    <url>
-        <loc>https://site.fzxu.me/blog/category/{quote(category)}/</loc>
-        <changefreq>weekly</changefreq>
-        <priority>0.6</priority>
-    </url>"""
 
-    # Add tag pages
-    all_tags = get_all_tags(get_all_posts_with_metadata())
-    for tag in all_tags:
-        sitemap_xml += f"""
-    <url>
-        <loc>https://site.fzxu.me/blog/tag/{quote(tag)}/</loc>
-        <changefreq>weekly</changefreq>
-        <priority>0.5</priority>
-    </url>"""
-
-    sitemap_xml += """
-</urlset>"""
-
-    return Response(sitemap_xml, mimetype="application/xml")
+def startup_report() -> str:
+    posts = get_all_posts_with_metadata()
+    return (
+        f"startup: imports {IMPORT_SECONDS * 1000:.0f} ms, "
+        f"site index {posts.load_seconds * 1000:.1f} ms "
+        f"({len(posts.cache)} posts from {posts.loaded_from})"
+    )
+
+
+@app.cli.command("startup")
+def startup_command():
+    """Print how long importing the app and loading the site index took."""
+    print(startup_report())
+
+
+IMPORT_SECONDS = time.perf_counter() - _import_started
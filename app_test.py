@@ -0,0 +1,354 @@
+import gzip
+import os
+import shutil
+import pytest
+import zstandard
+from urllib.parse import quote
+from unittest.mock import patch
+
+import utils
+import app as blog_app
+from app import app
+import timing
+import optimize
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+def test_feed_conditional_get(client):
+    response = client.get("/feed.xml")
+    assert response.status_code == 200
+    assert response.headers["ETag"]
+    assert response.headers["Last-Modified"]
+
+    cached = client.get(
+        "/feed.xml", headers={"If-None-Match": response.headers["ETag"]}
+    )
+    assert cached.status_code == 304
+    assert cached.data == b""
+
+    cached = client.get(
+        "/feed.xml", headers={"If-Modified-Since": response.headers["Last-Modified"]}
+    )
+    assert cached.status_code == 304
+
+
+def test_feed_built_once_per_snapshot(client):
+    blog_app.build_feed.cache_clear()
+    client.get("/feed.xml")
+    client.get("/feed.xml")
+    assert blog_app.build_feed.cache_info().misses == 1
+
+
+def test_feed_full_content(client, monkeypatch):
+    monkeypatch.setitem(app.config, "FEED_FULL_CONTENT", True)
+    full = client.get("/feed.xml").data
+    monkeypatch.setitem(app.config, "FEED_FULL_CONTENT", False)
+    assert len(full) > len(client.get("/feed.xml").data)
+    assert b"&lt;h3 id=" in full
+
+
+def test_sitemap_split_into_index(client, monkeypatch):
+    assert "<urlset" in client.get("/sitemap.xml").data.decode()
+    monkeypatch.setattr(blog_app, "SITEMAP_MAX_URLS", 10)
+    blog_app.build_sitemaps.cache_clear()
+    try:
+        index = client.get("/sitemap.xml").data.decode()
+        assert "<sitemapindex" in index
+        assert "https://site.fzxu.me/sitemap-1.xml" in index
+        page = client.get("/sitemap-1.xml").data.decode()
+        assert page.count("<url>") == 10
+        assert client.get("/sitemap-999.xml").status_code == 404
+    finally:
+        blog_app.build_sitemaps.cache_clear()
+
+
+@pytest.mark.parametrize(
+    "url, cache_control",
+    [
+        ("/", "public, no-cache"),
+        ("/blog/post/Mini-Rack/", "public, max-age=300"),
+        ("/blog/tag/k8s/", "public, no-cache"),
+        ("/blog/category/Coding/", "public, no-cache"),
+    ],
+)
+def test_html_conditional_get_skips_rendering(client, url, cache_control):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers["Cache-Control"] == cache_control
+    etag = response.headers["ETag"]
+
+    with patch("app.render_template") as render:
+        cached = client.get(url, headers={"If-None-Match": etag})
+        assert cached.status_code == 304
+        assert cached.headers["Cache-Control"] == cache_control
+        render.assert_not_called()
+
+    assert client.get(url, headers={"If-None-Match": '"stale"'}).status_code == 200
+
+
+def test_html_etag_changes_with_posts(client):
+    etag = client.get("/blog/post/Mini-Rack/").headers["ETag"]
+    posts = utils.get_all_posts_with_metadata()
+    with patch.object(posts, "version", "changed"):
+        assert client.get("/blog/post/Mini-Rack/").headers["ETag"] != etag
+
+
+def test_site_version_is_checked_once_per_interval(client, monkeypatch):
+    monkeypatch.setattr(blog_app, "_site_version", (0.0, ""))
+    monkeypatch.setenv("BLOG_POSTS_RELOAD_INTERVAL", "60")
+    mapping = blog_app.assets.mapping()
+    with patch.object(blog_app.assets, "mapping", return_value=mapping) as walk:
+        etag = client.get("/blog/post/Mini-Rack/").headers["ETag"]
+        cached = {"If-None-Match": etag}
+        assert client.get("/blog/post/Mini-Rack/", headers=cached).status_code == 304
+        assert walk.call_count == 1
+
+        # An edited asset shows once the interval has passed.
+        walk.return_value = {**mapping, "style/custom.css": "style/custom.0.css"}
+        assert client.get("/blog/post/Mini-Rack/").headers["ETag"] == etag
+        monkeypatch.setenv("BLOG_POSTS_RELOAD_INTERVAL", "0")
+        assert client.get("/blog/post/Mini-Rack/").headers["ETag"] != etag
+        assert walk.call_count == 2
+
+
+@pytest.fixture
+def posts_copy(tmp_path, monkeypatch):
+    """A copy of posts/ and pages/ to delete posts from, reloaded on every request."""
+    shutil.copytree("posts", tmp_path / "posts")
+    shutil.copytree("pages", tmp_path / "pages")
+    # Older than the templates, so Last-Modified moves only with the posts.
+    for path in [tmp_path / "posts", *(tmp_path / "posts").iterdir()]:
+        os.utime(path, (1e9, 1e9))
+    (tmp_path / "templates").symlink_to(os.path.abspath("templates"))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("BLOG_POSTS_RELOAD_INTERVAL", "0")
+    monkeypatch.setattr(utils, "_all_post_metadata_cache", None)
+    newest = next(iter(utils.get_all_posts_with_metadata()))
+    return tmp_path / "posts" / f"{newest.path_title}.md", newest.title
+
+
+def test_last_modified_follows_deleted_posts(client, posts_copy):
+    path, title = posts_copy
+    response = client.get("/")
+    assert title in response.data.decode()
+    last_modified = response.headers["Last-Modified"]
+    since = {"If-Modified-Since": last_modified}
+    assert client.get("/", headers=since).status_code == 304
+
+    path.unlink()
+    response = client.get("/", headers=since)
+    assert response.status_code == 200
+    assert title not in response.data.decode()
+    assert response.headers["Last-Modified"] != last_modified
+
+
+@pytest.mark.parametrize("url", ["/", "/blog/post/Mini-Rack/", "/feed.xml"])
+def test_last_modified_is_the_same_across_processes(client, posts_copy, url):
+    last_modified = client.get(url).headers["Last-Modified"]
+    # What a restarted or another worker process starts from.
+    utils._all_post_metadata_cache = None
+    blog_app._site_version = (0.0, None)
+    assert client.get(url).headers["Last-Modified"] == last_modified
+
+
+@pytest.mark.parametrize("url", ["/feed.xml", "/sitemap.xml"])
+def test_xml_last_modified_follows_deleted_posts(client, posts_copy, url):
+    path, _ = posts_copy
+    response = client.get(url)
+    since = {"If-Modified-Since": response.headers["Last-Modified"]}
+    assert client.get(url, headers=since).status_code == 304
+
+    path.unlink()
+    response = client.get(url, headers=since)
+    assert response.status_code == 200
+    assert path.stem not in response.data.decode()
+
+
+def test_missing_post_has_no_validators(client):
+    response = client.get("/blog/post/does-not-exist/")
+    assert response.status_code == 404
+    assert "ETag" not in response.headers
+    assert "Cache-Control" not in response.headers
+
+
+@pytest.mark.parametrize("encoding", utils.available_encodings())
+def test_response_compression_negotiation(client, encoding):
+    plain = client.get("/blog/post/Mini-Rack/")
+    assert "Content-Encoding" not in plain.headers
+    response = client.get(
+        "/blog/post/Mini-Rack/", headers={"Accept-Encoding": encoding}
+    )
+    assert response.headers["Content-Encoding"] == encoding
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.headers["ETag"] == "W/" + plain.headers["ETag"]
+    assert len(response.data) < len(plain.data)
+    decompress = {"gzip": gzip.decompress, "zstd": zstandard.decompress}[encoding]
+    assert decompress(response.data) == plain.data
+    cached = client.get(
+        "/blog/post/Mini-Rack/",
+        headers={
+            "Accept-Encoding": encoding,
+            "If-None-Match": response.headers["ETag"],
+        },
+    )
+    assert cached.status_code == 304
+
+
+def test_response_compression_compresses_once(client, monkeypatch):
+    monkeypatch.setattr(blog_app, "_compressed", utils.LRUCache(1024 * 1024))
+    with patch("app.compress", wraps=blog_app.compress) as mock_compress:
+        for _ in range(3):
+            client.get("/static/style/custom.css", headers={"Accept-Encoding": "gzip"})
+        assert mock_compress.call_count == 1
+
+
+def test_response_compression_skips_images(client):
+    response = client.get(
+        "/static/favicon_io/favicon.ico", headers={"Accept-Encoding": "gzip"}
+    )
+    assert "Content-Encoding" not in response.headers
+
+
+def test_fingerprinted_assets_are_immutable(client):
+    html = client.get("/").data.decode()
+    hashed = "/static/" + blog_app.assets.hashed("style/spectre.css")
+    assert f'href="{hashed}"' in html
+
+    response = client.get(hashed)
+    assert response.status_code == 200
+    assert response.cache_control.immutable
+    assert response.cache_control.max_age == blog_app.IMMUTABLE_MAX_AGE
+    assert response.data == client.get("/static/style/spectre.css").data
+
+    assert client.get("/static/style/spectre.0123456789.css").status_code == 404
+
+
+def test_search_page(client, monkeypatch):
+    posts = utils.get_all_posts_with_metadata()
+    first = posts.cache[0]
+    response = client.get("/search/", query_string={"q": first.title})
+    assert response.status_code == 200
+    assert f"/blog/post/{first.path_title}/".encode() in response.data
+    assert b'data-served="1"' in response.data
+
+    monkeypatch.setattr("search.RESULTS_PER_PAGE", 1)
+    response = client.get("/search/", query_string={"q": "the", "page": 2})
+    assert b"page 2 of" in response.data
+    assert b'rel="prev"' in response.data
+
+    # The static shell, search.js answers the query from the shards.
+    response = client.get("/search/")
+    assert response.status_code == 200
+    assert b'data-served=""' in response.data
+
+
+def test_listing_pagination(client, monkeypatch):
+    monkeypatch.setitem(app.config, "POSTS_PER_PAGE", 2)
+    posts = utils.get_all_posts_with_metadata()
+    first = client.get("/")
+    assert posts.cache[0].path_title.encode() in first.data
+    assert posts.cache[2].path_title.encode() not in first.data
+    assert b'<link rel="next" href="/page/2/">' in first.data
+    assert b'rel="prev"' not in first.data
+
+    second = client.get("/page/2/")
+    assert second.status_code == 200
+    assert f"/blog/post/{posts.cache[2].path_title}/".encode() in second.data
+    assert b'<link rel="prev" href="/">' in second.data
+
+    assert client.get("/page/1/").headers["Location"].endswith("/")
+    assert client.get(f"/page/{len(posts.cache)}/").status_code == 404
+
+    tag = posts.top_tags[0]
+    response = client.get(f"/blog/tag/{tag}/page/2/")
+    assert response.status_code == 200
+    assert f'<link rel="prev" href="/blog/tag/{quote(tag)}/">'.encode() in response.data
+
+
+def test_server_timing_is_opt_in(client, monkeypatch):
+    assert "Server-Timing" not in client.get("/").headers
+    assert client.get("/_metrics").status_code == 404
+
+    monkeypatch.setitem(app.config, "TIMING", True)
+    timing.metrics.clear()
+    utils.get_render_cache().lru.clear()
+    header = client.get("/blog/post/Mini-Rack/").headers["Server-Timing"]
+    phases = dict(part.split(";dur=") for part in header.split(", "))
+    assert {"posts", "markdown", "template", "total"} <= set(phases)
+    assert float(phases["total"]) >= float(phases["markdown"])
+
+    # Loopback isn't enough, a reverse proxy on the same host is loopback too.
+    assert client.get("/_metrics").status_code == 404
+    monkeypatch.setitem(app.config, "METRICS", True)
+    metrics = client.get("/_metrics").data.decode()
+    assert 'blog_phase_seconds_count{route="post",phase="total"} 1' in metrics
+    assert 'route="post",phase="template",le="+Inf"} 1' in metrics
+
+
+def test_pages_only_load_assets_they_use(client):
+    plain = client.get("/blog/post/Mini-Rack/").data.decode()
+    assert "MathJax-script" not in plain
+    assert "pygments_style" not in plain
+    assert "cosmo_load" not in plain
+
+    cosmo = client.get("/blog/post/cosmo:-3D-Graphics-Engine-in-Terminal/")
+    html = cosmo.data.decode()
+    assert "MathJax-script" in html
+    assert "pygments_style" in html
+    assert html.count("cosmo_load") == 2
+    assert 'rel="modulepreload"' in html
+
+    assert "pygments_style" not in client.get("/blog/tag/k8s/").data.decode()
+
+
+def test_cosmo_bundle(client):
+    html = client.get("/blog/post/cosmo:-3D-Graphics-Engine-in-Terminal/").data
+    assert b'id="cosmo-bundle"' in html
+    response = client.get(
+        "/blog/post/cosmo:-3D-Graphics-Engine-in-Terminal/cosmo.bundle"
+    )
+    assert response.status_code == 200
+    assert response.data[:2] == b"\x1f\x8b"
+    assert response.headers["ETag"]
+    assert client.get("/blog/post/Mini-Rack/cosmo.bundle").status_code == 404
+    assert client.get("/blog/post/missing/cosmo.bundle").status_code == 404
+
+
+def test_post_links_related_posts(client):
+    post = utils.get_all_posts_with_metadata()["Mini-Rack"]
+    assert post.related
+    html = client.get("/blog/post/Mini-Rack/").data.decode()
+    assert "Related posts" in html
+    for path_title in post.related:
+        assert f'<a href="/blog/post/{path_title}/">' in html
+
+
+def test_optimized_pages_link_purged_stylesheets(client, monkeypatch):
+    url = "/blog/post/building_private_cloud_basic_setup/"
+    plain = client.get(url).data.decode()
+    posts = utils.get_all_posts_with_metadata()
+    content = [utils.render_markdown(p.body()) for p in posts]
+    optimizer = optimize.build_optimizer(
+        app.static_folder, "templates", blog_app.assets.hashed, content, ["app.py"]
+    )
+    monkeypatch.setattr(optimize, "active", optimizer)
+    html = client.get(url).data.decode()
+    spectre = blog_app.assets.hashed("style/spectre.css")
+    assert spectre in plain and spectre not in html
+    purged = optimizer.files["style/spectre.css"][0]
+    assert f'<link id="spectre" rel="stylesheet" href="/static/{purged}">' in html
+    assert '<main class="content columns"><div' in html
+    # The rules the post matches are most of the purged sheets, inlining them
+    # would ship them twice.
+    assert 'rel="preload" href="/static/style/' not in html
+    saved = optimizer.pages[url]
+    assert saved.html_before == len(plain.encode())
+    sheets = ["style/spectre.css", "style/pygments_style.css", "style/custom.css"]
+    sheets.append("style/collapsible_code_block.css")
+    assert saved.css_before > saved.css_after
+    assert saved.css_after == sum(len(optimizer.files[n][1]) for n in sheets)
+    assert saved.preloaded_css == saved.inline_css == 0
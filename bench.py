@@ -0,0 +1,339 @@
+"""
+Microbenchmarks for the parse/render/freeze pipeline on a synthetic corpus.
+
+    python bench.py --posts 2000                 # run and write bench_results.json
+    python bench.py --posts 2000 --save-baseline # also store it as the baseline
+    python bench.py --posts 2000 --compare       # exit 1 on regressions
+
+Every stage is timed over --repeat runs (median reported), then run once
+more under tracemalloc for its peak Python heap usage.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import suppress
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional
+
+# Benchmarks measure cold work, keep the persistent render cache out of it.
+os.environ.setdefault("BLOG_RENDER_CACHE_DIR", "")
+os.environ.setdefault("BLOG_POSTS_RELOAD_INTERVAL", "-1")
+
+import utils
+
+CODE_LANGS = ("python", "go", "rust", "shell", "javascript", "yaml")
+# Slower than baseline by more than this fraction counts as a regression.
+TIME_THRESHOLD = 0.25
+MEMORY_THRESHOLD = 0.10
+
+
+def make_corpus(
+    root: str,
+    posts: int,
+    paragraphs: int = 12,
+    code_density: float = 0.2,
+    tags: int = 50,
+    seed: int = 0,
+) -> str:
+    """
+    Writes posts/ and pages/index.md under root. code_density is the share of
+    paragraphs that are fenced code blocks, tags the size of the tag pool.
+    """
+    rng = random.Random(seed)
+    vocab = [
+        "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(2, 10)))
+        for _ in range(5000)
+    ]
+    weights = [1 / (i + 1) for i in range(len(vocab))]
+    tag_pool = [f"tag{i}" for i in range(tags)]
+    categories = ["tech", "life", "misc", "notes", "travel"]
+    os.makedirs(os.path.join(root, "posts"), exist_ok=True)
+    os.makedirs(os.path.join(root, "pages"), exist_ok=True)
+    with open(os.path.join(root, "pages", "index.md"), "w") as f:
+        f.write("# Synthetic corpus\n\nGenerated by bench.py.\n")
+
+    def sentence(n: int) -> str:
+        return " ".join(rng.choices(vocab, weights, k=n)).capitalize() + "."
+
+    start = datetime(2015, 1, 1)
+    for i in range(posts):
+        body = []
+        for j in range(paragraphs):
+            if j % 4 == 0:
+                body.append(f"##### {sentence(4)[:-1]}")
+            if rng.random() < code_density:
+                lang = rng.choice(CODE_LANGS)
+                summary = ",Show code" if rng.random() < 0.3 else ""
+                lines = [
+                    f"x_{k} = compute({k}, '{rng.choice(vocab)}')  # {sentence(3)}"
+                    for k in range(rng.randint(3, 20))
+                ]
+                body.append(f"```{lang}{summary}\n" + "\n".join(lines) + "\n```")
+            else:
+                body.append(" ".join(sentence(rng.randint(6, 20)) for _ in range(4)))
+        post_tags = rng.sample(tag_pool, min(len(tag_pool), rng.randint(1, 5)))
+        date = start + timedelta(hours=7 * i)
+        with open(os.path.join(root, "posts", f"post-{i:05d}.md"), "w") as f:
+            f.write(
+                "---\n"
+                f"title: {sentence(5)[:-1]}\n"
+                f"date: {date:%Y-%m-%d %H:%M:%S}\n"
+                f"tags: {json.dumps(post_tags)}\n"
+                f"category: {rng.choice(categories)}\n"
+                "---\n" + "\n\n".join(body) + "\n"
+            )
+    return root
+
+
+def reset_caches():
+    """Drops every in-process cache the stages fill, so each run starts cold."""
+    import app
+    import render
+    import search
+
+    utils._all_post_metadata_cache = None
+    utils._render_cache = None
+    render._highlight_cache.clear()
+    app.build_feed.cache_clear()
+    app.build_sitemaps.cache_clear()
+    search.get_search_index.cache_clear()
+    with suppress(OSError):
+        os.remove(utils.POSTS_INDEX)
+
+
+def stages(root: str, render_sample: int) -> Dict[str, Callable[[], None]]:
+    """name -> function, each run with the corpus as the working directory."""
+    import app
+    import render
+    import search
+
+    paths = sorted(os.listdir("posts"))
+    sources = {}
+    for path in paths:
+        with open(f"posts/{path}") as f:
+            sources[path[:-3]] = f.read()
+    sample = list(sources.values())[:render_sample]
+    blocks = []
+    for md in sample:
+        for block in md.split("```")[1::2]:
+            info, code = block.split("\n", 1)
+            lang, _, summary = info.partition(",")
+            blocks.append((code, lang, summary or None))
+
+    def parse():
+        for path_title, md in sources.items():
+            utils.parse_post_metadata(path_title, md)
+
+    def load_headers():
+        for path in paths:
+            utils.load_post_header(path[:-3], f"posts/{path}")
+
+    def posts_cache_scan():
+        utils.PostsCache()
+
+    def posts_cache_update():
+        # One post edited since the current snapshot, as when hot-reloading.
+        previous = utils.get_all_posts_with_metadata()
+        stamps = dict(previous.stamps)
+        stamps[paths[0][:-3]] = (0, 0)
+        utils.PostsCache(previous, stamps)
+
+    def posts_cache_snapshot():
+        assert utils.load_posts_cache().loaded_from == "snapshot"
+
+    def render_markdown():
+        md = render.get_md_factory()
+        for source in sample:
+            md(source)
+
+    def highlight():
+        renderer = render.HighlightRenderer()
+        for code, lang, summary in blocks:
+            renderer.decorated_highlight(code, lang, summary)
+
+    def feed():
+        app.build_feed(utils.get_all_posts_with_metadata(), False, None)
+
+    def sitemap():
+        app.build_sitemaps(utils.get_all_posts_with_metadata(), None)
+
+    def search_index():
+        search.SearchIndex(search.post_documents(utils.get_all_posts_with_metadata()))
+
+    def freeze():
+        import generate
+
+        generate.freeze()
+
+    return {
+        "parse_post_metadata": parse,
+        "load_post_header": load_headers,
+        "posts_cache_scan": posts_cache_scan,
+        "posts_cache_update": posts_cache_update,
+        "posts_cache_snapshot": posts_cache_snapshot,
+        "render_markdown": render_markdown,
+        "decorated_highlight": highlight,
+        "feed": feed,
+        "sitemap": sitemap,
+        "search_index": search_index,
+        "freeze": freeze,
+    }
+
+
+# Stages that need a warm PostsCache or a written snapshot before they run.
+_NEEDS_POSTS = {
+    "posts_cache_snapshot",
+    "posts_cache_update",
+    "feed",
+    "sitemap",
+    "search_index",
+}
+
+
+def measure(run: Callable[[], None], prepare: Callable[[], None], repeat: int) -> dict:
+    times = []
+    for _ in range(repeat):
+        prepare()
+        started = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - started)
+    prepare()
+    tracemalloc.start()
+    run()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": statistics.median(times),
+        "min_seconds": min(times),
+        "peak_bytes": peak,
+    }
+
+
+def run_suite(
+    root: str,
+    repeat: int = 3,
+    only: Optional[List[str]] = None,
+    render_sample: int = 500,
+) -> dict:
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import app
+
+        app.app.config["FREEZER_DESTINATION"] = os.path.join(root, "build")
+        # generate.BuildManifest digests these relative to the working directory.
+        for name in ("app.py", "templates"):
+            if not os.path.exists(name):
+                os.symlink(os.path.join(app.app.root_path, name), name)
+        results = {}
+        for name, run in stages(root, render_sample).items():
+            if only and name not in only:
+                continue
+
+            def prepare(name=name):
+                reset_caches()
+                if name in _NEEDS_POSTS:
+                    utils.load_posts_cache()
+                    utils.get_all_posts_with_metadata()
+
+            results[name] = measure(run, prepare, repeat)
+            print(
+                f"{name:>22}: {results[name]['seconds'] * 1000:10.1f} ms"
+                f"  peak {results[name]['peak_bytes'] / 2**20:8.1f} MiB",
+                flush=True,
+            )
+        return results
+    finally:
+        os.chdir(cwd)
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """Regressions of results against baseline beyond the thresholds."""
+    regressions = []
+    for name, current in results["stages"].items():
+        previous = baseline["stages"].get(name)
+        if previous is None:
+            continue
+        for key, threshold in (
+            ("seconds", TIME_THRESHOLD),
+            ("peak_bytes", MEMORY_THRESHOLD),
+        ):
+            if previous[key] and current[key] > previous[key] * (1 + threshold):
+                change = current[key] / previous[key] - 1
+                regressions.append(
+                    f"{name} {key}: {previous[key]:.4g} -> {current[key]:.4g} "
+                    f"(+{change:.0%}, limit +{threshold:.0%})"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--posts", type=int, default=1000)
+    parser.add_argument("--paragraphs", type=int, default=12)
+    parser.add_argument("--code-density", type=float, default=0.2)
+    parser.add_argument("--tags", type=int, default=50, help="size of the tag pool")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--render-sample",
+        type=int,
+        default=500,
+        help="posts rendered by the render and highlight stages",
+    )
+    parser.add_argument(
+        "--stage", action="append", help="only run this stage, can be repeated"
+    )
+    parser.add_argument("--output", default="bench_results.json")
+    parser.add_argument("--baseline", default="bench_baseline.json")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store the results as baseline"
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="exit 1 on regressions vs baseline"
+    )
+    args = parser.parse_args()
+
+    corpus = {
+        "posts": args.posts,
+        "paragraphs": args.paragraphs,
+        "code_density": args.code_density,
+        "tags": args.tags,
+        "seed": args.seed,
+    }
+    with tempfile.TemporaryDirectory(prefix="blog-bench-") as root:
+        started = time.perf_counter()
+        make_corpus(root, **corpus)
+        print(f"corpus: {args.posts} posts in {time.perf_counter() - started:.1f}s")
+        stage_results = run_suite(root, args.repeat, args.stage, args.render_sample)
+    results = {
+        "corpus": corpus,
+        "repeat": args.repeat,
+        "render_sample": args.render_sample,
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "stages": stage_results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline["corpus"] != corpus:
+            print("warning: baseline was measured on a different corpus")
+        regressions = compare(results, baseline)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,54 @@
+import os
+
+import utils
+import bench
+
+
+def test_make_corpus_shape(tmp_path):
+    bench.make_corpus(str(tmp_path), posts=12, paragraphs=4, code_density=1, tags=3)
+    names = sorted(os.listdir(tmp_path / "posts"))
+    assert len(names) == 12
+    tags = set()
+    for name in names:
+        post = utils.load_post_header(name[:-3], str(tmp_path / "posts" / name))
+        assert "```" in post.body()
+        tags.update(post.tags)
+    assert tags <= {"tag0", "tag1", "tag2"}
+
+
+def test_make_corpus_is_deterministic(tmp_path):
+    bench.make_corpus(str(tmp_path / "a"), posts=3, seed=7)
+    bench.make_corpus(str(tmp_path / "b"), posts=3, seed=7)
+    for name in os.listdir(tmp_path / "a" / "posts"):
+        a = (tmp_path / "a" / "posts" / name).read_text()
+        assert a == (tmp_path / "b" / "posts" / name).read_text()
+
+
+def test_compare_flags_regressions_beyond_thresholds():
+    baseline = {
+        "stages": {
+            "feed": {"seconds": 1.0, "peak_bytes": 1000},
+            "sitemap": {"seconds": 1.0, "peak_bytes": 1000},
+        }
+    }
+    results = {
+        "stages": {
+            "feed": {"seconds": 1.2, "peak_bytes": 1050},
+            "sitemap": {"seconds": 1.3, "peak_bytes": 1200},
+            "freeze": {"seconds": 9.0, "peak_bytes": 9000},
+        }
+    }
+    regressions = bench.compare(results, baseline)
+    assert len(regressions) == 2
+    assert all(r.startswith("sitemap") for r in regressions)
+
+
+def test_run_suite(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_all_post_metadata_cache", None)
+    monkeypatch.setattr(utils, "POSTS_INDEX", "posts/.index.json")
+    bench.make_corpus(str(tmp_path), posts=5, paragraphs=3)
+    results = bench.run_suite(
+        str(tmp_path), repeat=1, only=["parse_post_metadata", "feed"]
+    )
+    assert set(results) == {"parse_post_metadata", "feed"}
+    assert all(r["seconds"] > 0 and r["peak_bytes"] > 0 for r in results.values())
@@ -1,11 +1,20 @@
-while getopts sgpdnv flag
+# Worker count for -g/-i, e.g. `./blog.sh -g 8`, defaults to a serial build.
+workers=1
+[[ "$2" =~ ^[0-9]+$ ]] && workers=$2
+# `-w <port>` serves pre-rendered pages with serve.py, `-r` re-renders them after posts change.
+# `-p` commits and pushes only the build files that changed, `-d` lists them.
+
+while getopts sgipdnvwr flag
 do
     case "$flag" in
         v) pushd build && uv run python3 -m http.server $2 && popd;;
         s) OPENCODER_URL_PREFIX='/opencoder' uv run flask run -h 0.0.0.0 -p $2;;
-        g) OPENCODER_URL_PREFIX='/opencoder' uv run python3 generate.py;;
-        p) pushd build && git add . && git commit -am "update" && git push && popd;;
-        d) pushd build && git status && git diff && popd;;
+        w) OPENCODER_URL_PREFIX='/opencoder' uv run python3 serve.py -p $2;;
+        r) kill -HUP "$(cat .serve.pid)";;
+        g) OPENCODER_URL_PREFIX='/opencoder' uv run python3 generate.py --workers $workers;;
+        i) OPENCODER_URL_PREFIX='/opencoder' uv run python3 generate.py --incremental --workers $workers;;
+        p) uv run python3 publish.py;;
+        d) uv run python3 publish.py --dry-run;;
         n) uv run python3 utils.py new "$2"
     esac
 done
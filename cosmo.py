@@ -0,0 +1,154 @@
+"""
+Per-post cosmo bundles. Everything the cosmo-display elements of a post need,
+its .cos scenes and STL meshes, packed into one gzip file so
+static/script/cosmo_load.js makes a single request.
+
+Layout before compression: u32 header length, JSON header padded to 4 bytes,
+then the mesh data. Meshes are stored indexed: unique float32 vertices, one
+float32 normal per triangle and uint16 (uint32 past 65535 vertices) vertex
+indices, every section padded to 4 bytes. Identical meshes are stored once.
+cosmo_load.js turns them back into the binary STL cosmo expects.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import struct
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+SCENE_DIR = "static/cosmo_scenes"
+BUNDLE_VERSION = 1
+
+_display = re.compile(r"<code\s[^>]*\bclass=\"cosmo-display\"[^>]*>")
+_attribute = re.compile(r'([\w-]+)=(?:"([^"]*)"|([^\s>]+))')
+_stl_triangle = struct.Struct("<12f2x")
+
+
+def find_displays(md: str) -> List[Dict[str, str]]:
+    """Attributes of every cosmo-display element in a post's markdown."""
+    return [
+        {name: quoted or bare for name, quoted, bare in _attribute.findall(tag)}
+        for tag in _display.findall(md)
+    ]
+
+
+def bundle_contents(md: str) -> Tuple[Tuple[str, ...], Tuple[str, ...]]:
+    """Scene and STL names a post's displays reference, in first-use order."""
+    scenes, stls = {}, {}
+    for display in find_displays(md):
+        scenes[display["scene"]] = None
+        for name in filter(None, display.get("stl-names", "").split(",")):
+            stls[name] = None
+    return tuple(scenes), tuple(stls)
+
+
+def read_stl(data: bytes) -> List[tuple]:
+    """(normal x, y, z, then x, y, z of three vertices) per triangle of a binary STL."""
+    (count,) = struct.unpack_from("<I", data, 80)
+    if len(data) != 84 + count * _stl_triangle.size:
+        raise ValueError("not a binary STL")
+    return list(_stl_triangle.iter_unpack(data[84:]))
+
+
+def pack_mesh(data: bytes) -> Tuple[dict, bytes]:
+    """Header entry (offsets relative to the returned bytes) and packed mesh."""
+    vertices = {}
+    normals = bytearray()
+    indices = []
+    for triangle in read_stl(data):
+        normals += struct.pack("<3f", *triangle[:3])
+        for i in range(3, 12, 3):
+            vertex = struct.pack("<3f", *triangle[i : i + 3])
+            indices.append(vertices.setdefault(vertex, len(vertices)))
+    index_format = "H" if len(vertices) <= 0xFFFF else "I"
+    sections = [
+        b"".join(vertices),
+        bytes(normals),
+        struct.pack(f"<{len(indices)}{index_format}", *indices),
+    ]
+    entry = {
+        "vertex_count": len(vertices),
+        "triangle_count": len(indices) // 3,
+        "index_size": struct.calcsize(index_format),
+    }
+    packed = bytearray()
+    for name, section in zip(("vertices", "normals", "indices"), sections):
+        entry[name] = len(packed)
+        packed += section + bytes(-len(section) % 4)
+    return entry, bytes(packed)
+
+
+def unpack_mesh(entry: dict, data: bytes, offset: int = 0) -> bytes:
+    """The binary STL a packed mesh came from, minus its 80 byte header."""
+
+    def section(name: str, fmt: str, count: int) -> tuple:
+        return struct.unpack_from(f"<{count}{fmt}", data, offset + entry[name])
+
+    n = entry["triangle_count"]
+    vertices = section("vertices", "f", entry["vertex_count"] * 3)
+    normals = section("normals", "f", n * 3)
+    indices = section("indices", "H" if entry["index_size"] == 2 else "I", n * 3)
+    out = bytearray(80) + struct.pack("<I", n)
+    for t in range(n):
+        values = list(normals[t * 3 : t * 3 + 3])
+        for i in indices[t * 3 : t * 3 + 3]:
+            values += vertices[i * 3 : i * 3 + 3]
+        out += _stl_triangle.pack(*values)
+    return bytes(out)
+
+
+def build_bundle(
+    scenes: Tuple[str, ...], stls: Tuple[str, ...], directory: str = SCENE_DIR
+) -> bytes:
+    header = {"version": BUNDLE_VERSION, "scenes": {}, "meshes": {}}
+    for name in scenes:
+        with open(os.path.join(directory, f"{name}.cos"), "r") as f:
+            header["scenes"][name] = f.read()
+    data = bytearray()
+    by_digest = {}
+    for name in stls:
+        with open(os.path.join(directory, f"{name}.stl"), "rb") as f:
+            stl = f.read()
+        digest = hashlib.sha256(stl[80:]).hexdigest()
+        if digest not in by_digest:
+            entry, packed = pack_mesh(stl)
+            entry["offset"] = len(data)
+            data += packed
+            by_digest[digest] = entry
+        header["meshes"][name] = by_digest[digest]
+    encoded = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    encoded += b" " * (-len(encoded) % 4)
+    raw = struct.pack("<I", len(encoded)) + encoded + data
+    # mtime=0 keeps bundles byte-identical across builds.
+    return gzip.compress(raw, 9, mtime=0)
+
+
+def read_bundle(bundle: bytes) -> Tuple[dict, bytes]:
+    """Header and the mesh data it points into."""
+    raw = gzip.decompress(bundle)
+    (length,) = struct.unpack_from("<I", raw)
+    return json.loads(raw[4 : 4 + length]), raw[4 + length :]
+
+
+def scene_stamps(directory: str = SCENE_DIR) -> Tuple[Tuple[str, int, int], ...]:
+    stamps = []
+    for name in sorted(os.listdir(directory)):
+        st = os.stat(os.path.join(directory, name))
+        stamps.append((name, st.st_mtime_ns, st.st_size))
+    return tuple(stamps)
+
+
+@lru_cache(maxsize=16)
+def _cached_bundle(scenes: tuple, stls: tuple, stamps: tuple) -> bytes:
+    return build_bundle(scenes, stls)
+
+
+def get_post_bundle(md: str) -> Optional[bytes]:
+    """A post's bundle, None if it has no cosmo displays."""
+    scenes, stls = bundle_contents(md)
+    if not scenes:
+        return None
+    return _cached_bundle(scenes, stls, scene_stamps())
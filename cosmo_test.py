@@ -0,0 +1,57 @@
+import struct
+
+import cosmo
+
+MD = """
+<pre><code class="cosmo-display" scene="a" stl-names="m,m2" dimension="60,30" enable-aabb=true>x</code></pre>
+<pre><code class="cosmo-display" scene="b" dimension="60,30">x</code></pre>
+<pre><code class="cosmo-display" scene="a" stl-names="m">x</code></pre>
+"""
+
+
+def write_stl(path, triangles):
+    data = bytearray(80) + struct.pack("<I", len(triangles))
+    for t in triangles:
+        data += struct.pack("<12f2x", *t)
+    path.write_bytes(bytes(data))
+    return bytes(data)
+
+
+def test_bundle_contents():
+    assert cosmo.find_displays(MD)[0]["enable-aabb"] == "true"
+    assert cosmo.bundle_contents(MD) == (("a", "b"), ("m", "m2"))
+    assert cosmo.bundle_contents("no displays") == ((), ())
+
+
+def test_bundle_round_trip(tmp_path):
+    (tmp_path / "a.cos").write_text("L D 0 -1 0 1 -\nSTL m")
+    (tmp_path / "b.cos").write_text("C P -1 0 0")
+    # Two triangles sharing an edge, four unique vertices.
+    stl = write_stl(
+        tmp_path / "m.stl",
+        [
+            (0, 0, 1, 0, 0, 0, 1, 0, 0, 0, 1, 0),
+            (0, 0, 1, 1, 0, 0, 1, 1, 0, 0, 1, 0),
+        ],
+    )
+    (tmp_path / "m2.stl").write_bytes(b"another header".ljust(80) + stl[80:])
+    bundle = cosmo.build_bundle(("a", "b"), ("m", "m2"), str(tmp_path))
+    header, data = cosmo.read_bundle(bundle)
+    assert header["scenes"] == {"a": "L D 0 -1 0 1 -\nSTL m", "b": "C P -1 0 0"}
+    mesh = header["meshes"]["m"]
+    assert mesh["vertex_count"] == 4 and mesh["triangle_count"] == 2
+    # Same triangles under another name are stored once.
+    assert header["meshes"]["m2"] == mesh
+    assert len(data) == 4 * 12 + 2 * 12 + 12
+    assert cosmo.unpack_mesh(mesh, data, mesh["offset"]) == stl
+    assert cosmo.build_bundle(("a", "b"), ("m", "m2"), str(tmp_path)) == bundle
+
+
+def test_scene_files_round_trip():
+    bundle = cosmo.build_bundle(("david",), ("david_oriented",))
+    header, data = cosmo.read_bundle(bundle)
+    mesh = header["meshes"]["david_oriented"]
+    with open("static/cosmo_scenes/david_oriented.stl", "rb") as f:
+        stl = f.read()
+    assert cosmo.unpack_mesh(mesh, data, mesh["offset"])[80:] == stl[80:]
+    assert len(bundle) < len(stl) / 2
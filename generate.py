@@ -1,10 +1,63 @@
-from flask_frozen import Freezer
-from shutil import copyfile
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import warnings
+from contextlib import suppress
+from flask_frozen import Freezer, MissingURLGeneratorWarning, walk_directory
+from pathlib import Path
 
-from app import app
-from utils import get_all_posts_with_metadata, get_all_tags
+from app import app, assets, build_sitemaps, startup_report
+from utils import (
+    available_encodings,
+    compress,
+    get_all_posts_with_metadata,
+    get_git_commits,
+    get_git_metadata,
+    get_image_manifest,
+    get_local_content,
+    get_render_cache,
+    render_markdown,
+    renderer_version,
+    write_if_changed,
+    COMPRESSIBLE_EXTENSIONS,
+    ENCODING_SUFFIXES,
+)
+from images import build_images
+from search import get_search_index
+from cosmo import SCENE_DIR, bundle_contents
+from publish import OutputManifest
+import optimize
+import timing
 
-freezer = Freezer(app)
+# Endpoints that only make sense on a live server.
+UNFROZEN_ENDPOINTS = ("metrics",)
+
+
+class BlogFreezer(Freezer):
+    def no_argument_rules_urls(self):
+        for endpoint, values in super().no_argument_rules_urls():
+            if endpoint not in UNFROZEN_ENDPOINTS:
+                yield endpoint, values
+
+
+freezer = BlogFreezer(app)
+# Copied or written into the build after freezing. The freezer leaves them
+# alone instead of deleting them as extra files, so their mtimes only change
+# along with their content.
+COPIED_FILES = ["CNAME", "robots.txt", "google0379832c2a35e2d0.html"]
+POST_FREEZE_FILES = COPIED_FILES + [
+    "asset-manifest.json",
+    f"static/style/*.{optimize.PURGED_SUFFIX}.*",
+]
+app.config["FREEZER_DESTINATION_IGNORE"] = (
+    app.config["FREEZER_DESTINATION_IGNORE"] + POST_FREEZE_FILES
+)
+# Endpoints that legitimately have nothing to freeze: sitemap pages only exist
+# once the sitemap is split, resized images only once images.py has run, cosmo
+# bundles only for posts with cosmo scenes.
+OPTIONAL_ENDPOINTS = ("sitemap_page", "resized_image", "cosmo_bundle")
 
 
 @freezer.register_generator
@@ -13,25 +66,438 @@ def post():
         yield {"path_title": post.path_title}
 
 
+def listing_pages(**listing):
+    posts = get_all_posts_with_metadata()
+    return posts.pages(app.config["POSTS_PER_PAGE"], **listing)
+
+
+@freezer.register_generator
+def index():
+    for page in listing_pages():
+        yield {"n": page.number}
+
+
 @freezer.register_generator
 def category():
-    all_categories = {p.category for p in get_all_posts_with_metadata()}
-    for category in all_categories:
-        yield {"category": category}
+    for category in get_all_posts_with_metadata().by_category:
+        for page in listing_pages(category=category):
+            yield {"category": category, "n": page.number}
 
 
 @freezer.register_generator
 def tag():
-    all_tags = get_all_tags(get_all_posts_with_metadata())
-    for tag in all_tags:
-        yield {"tag": tag}
+    for tag in get_all_posts_with_metadata().tags:
+        for page in listing_pages(tag=tag):
+            yield {"tag": tag, "n": page.number}
+
+
+@freezer.register_generator
+def cosmo_bundle():
+    for post in get_all_posts_with_metadata():
+        if bundle_contents(post.body())[0]:
+            yield {"path_title": post.path_title}
+
+
+@freezer.register_generator
+def sitemap_page():
+    sitemaps = build_sitemaps(
+        get_all_posts_with_metadata(), get_git_metadata().version()
+    )
+    for n in range(1, len(sitemaps)):
+        yield {"n": n}
+
+
+@freezer.register_generator
+def static():
+    for hashed in assets.mapping().values():
+        yield {"filename": hashed}
+
+
+@freezer.register_generator
+def resized_image():
+    for entry in get_image_manifest()[0].values():
+        for variant in entry["variants"]:
+            yield {"filename": variant["url"].split("/")[-1]}
+
+
+def file_digest(path: str) -> str:
+    with open(path, "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def combine(*parts: str) -> str:
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+
+class BuildManifest:
+    """
+    Input digests of every frozen URL from the previous build. A URL is only
+    re-rendered when the digest of its dependency set differs, URLs without a
+    known dependency set are always rebuilt.
+    """
+
+    def __init__(self, path: str = ".build_manifest.json"):
+        self.path = path
+        self.previous = {}
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.previous = json.load(f)
+        self.current = self.compute()
+        self.skipped = set()
+
+    def compute(self) -> dict:
+        cache = get_all_posts_with_metadata()
+        posts = list(cache)
+        post_digest = {
+            p.path_title: file_digest(f"posts/{p.path_title}.md") for p in posts
+        }
+        site = combine(
+            renderer_version(),
+            file_digest("app.py"),
+            *(file_digest(f"templates/{t}") for t in sorted(os.listdir("templates"))),
+            optimize.active.digest if optimize.active is not None else "",
+            # Pages link assets by their content-hashed names.
+            *(f"{name} {hashed}" for name, hashed in assets.mapping().items()),
+        )
+        all_posts = combine(site, *(post_digest[p.path_title] for p in posts))
+
+        def listing(page) -> str:
+            # The page count is in there for the "page n of m" footer.
+            return combine(
+                site, str(page.count), *(post_digest[p.path_title] for p in page.posts)
+            )
+
+        def page_url(root: str, page) -> str:
+            return root if page.number == 1 else f"{root}page/{page.number}/"
+
+        sidebar = combine(
+            file_digest("pages/index.md"),
+            *cache.top_tags[:25],
+            *(c.hash for c in get_git_commits(10)),
+        )
+        rtn = {
+            # Both carry last-edit times from git history.
+            "/feed.xml": combine(all_posts, str(get_git_metadata().version())),
+            "/sitemap.xml": combine(all_posts, str(get_git_metadata().version())),
+        }
+        for n in range(1, len(build_sitemaps(cache, get_git_metadata().version()))):
+            rtn[f"/sitemap-{n}.xml"] = rtn["/sitemap.xml"]
+        for p in posts:
+            rtn[f"/blog/post/{p.path_title}/"] = combine(
+                site,
+                post_digest[p.path_title],
+                post_digest.get(p.prev, ""),
+                post_digest.get(p.next, ""),
+                # Related links show those posts' titles and dates.
+                *(post_digest.get(r, "") for r in p.related),
+            )
+        # Without a query the search page is the same shell for every build.
+        rtn["/search/"] = site
+        for page in listing_pages():
+            rtn[page_url("/", page)] = combine(listing(page), sidebar)
+        for c in cache.by_category:
+            for page in listing_pages(category=c):
+                rtn[page_url(f"/blog/category/{c}/", page)] = listing(page)
+        for t in cache.by_tag:
+            for page in listing_pages(tag=t):
+                rtn[page_url(f"/blog/tag/{t}/", page)] = listing(page)
+        for root, _, files in os.walk(app.static_folder):
+            for name in files:
+                path = os.path.join(root, name)
+                filename = os.path.relpath(path, app.static_folder).replace(os.sep, "/")
+                rtn["/static/" + filename] = file_digest(path)
+                rtn["/static/" + assets.hashed(filename)] = rtn["/static/" + filename]
+        scenes = combine(
+            *(d for url, d in sorted(rtn.items()) if url.startswith(f"/{SCENE_DIR}/"))
+        )
+        for post in cosmo_bundle():
+            path_title = post["path_title"]
+            rtn[f"/blog/post/{path_title}/cosmo.bundle"] = combine(
+                post_digest[path_title], scenes
+            )
+        for entry in get_image_manifest()[0].values():
+            for variant in entry["variants"]:
+                # Content-addressed by name.
+                rtn[variant["url"]] = variant["url"]
+        return rtn
+
+    def is_unchanged(self, url: str, path: str) -> bool:
+        digest = self.current.get(url)
+        unchanged = (
+            digest is not None
+            and self.previous.get(url) == digest
+            and os.path.isfile(path)
+        )
+        if unchanged:
+            self.skipped.add(url)
+        return unchanged
+
+    def save(self, urls):
+        manifest = {u: self.current[u] for u in sorted(urls) if u in self.current}
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(self.path + ".tmp", self.path)
+
+
+_manifest = None
+
+
+def _build_url(url: str):
+    # Runs in a forked worker that inherited the app and the warm PostsCache.
+    path = freezer._build_one(url)
+    skipped = _manifest is not None and url in _manifest.skipped
+    phases = timing.pages.pop(url, None) if timing.pages is not None else None
+    optimized = {}
+    if optimize.active is not None:
+        optimized, optimize.active.pages = optimize.active.pages, {}
+    return url, str(path), skipped, phases, optimized
+
+
+def freeze_parallel(workers: int):
+    """
+    Same output as freezer.freeze(), but the URL set is rendered by a pool of
+    forked workers. Only URLs from the registered generators are frozen, the
+    templates don't link anything through url_for that they'd miss.
+    """
+    get_all_posts_with_metadata()
+    urls = list(dict.fromkeys(freezer.all_urls()))
+    freezer.root.mkdir(parents=True, exist_ok=True)
+    ctx = multiprocessing.get_context("fork")
+    with ctx.Pool(workers) as pool:
+        chunksize = max(1, len(urls) // (workers * 4))
+        results = pool.map(_build_url, urls, chunksize=chunksize)
+    if app.config["FREEZER_REMOVE_EXTRA_FILES"]:
+        built = {Path(path) for _, path, *_ in results}
+        ignore = app.config["FREEZER_DESTINATION_IGNORE"]
+        for name in walk_directory(freezer.root, ignore=ignore):
+            extra = freezer.root / name
+            if extra not in built:
+                extra.unlink()
+                with suppress(OSError):
+                    extra.parent.rmdir()
+    return results
+
+
+def freeze(incremental: bool = False, workers: int = 1):
+    global _manifest
+    _manifest = BuildManifest()
+    if incremental:
+        app.config["FREEZER_SKIP_EXISTING"] = _manifest.is_unchanged
+    if workers > 1:
+        results = freeze_parallel(workers)
+        urls = {url for url, *_ in results}
+        skipped = {url for url, _, skip, *_ in results if skip}
+        if timing.pages is not None:
+            timing.pages.update((url, p) for url, _, _, p, _ in results if p)
+        if optimize.active is not None:
+            for *_, optimized in results:
+                optimize.active.pages.update(optimized)
+    else:
+        with warnings.catch_warnings():
+            optional = "|".join(OPTIONAL_ENDPOINTS + UNFROZEN_ENDPOINTS)
+            warnings.filterwarnings(
+                "ignore",
+                rf"Nothing frozen for endpoints (({optional})(, |\. ))+Did",
+                MissingURLGeneratorWarning,
+            )
+            urls = {page.url for page in freezer.freeze_yield()}
+        skipped = _manifest.skipped
+    _manifest.save(urls)
+    if incremental:
+        print(f"incremental build: {len(urls - skipped)}/{len(urls)} pages re-rendered")
+
+
+def timings_report(path: str = ".build_timings.json", top: int = 10):
+    """Writes the phase timings of every rendered page, slowest first."""
+    pages = sorted(timing.pages.items(), key=lambda item: -item[1]["total"])
+    with open(path, "w") as f:
+        json.dump(dict(pages), f, indent=1)
+    print(f"timings: {len(pages)} pages rendered, slowest:")
+    for url, phases in pages[:top]:
+        print(
+            f"  {phases['total'] * 1000:8.1f} ms  {url}  ({timing.server_timing(phases)})"
+        )
+
+
+# Besides the templates, where the markup of pages comes from.
+OPTIMIZE_SOURCES = ["app.py", "render.py", "utils.py"]
+
+
+def start_optimizer():
+    """Pages frozen from now on are optimized, see optimize.py."""
+    posts = get_all_posts_with_metadata()
+    content = [render_markdown(get_local_content("pages", "index"))]
+    content += [render_markdown(p.body()) for p in posts]
+    scripts = sorted(Path(app.static_folder, "script").glob("*.js"))
+    optimize.active = optimize.build_optimizer(
+        app.static_folder,
+        "templates",
+        assets.hashed,
+        content,
+        OPTIMIZE_SOURCES,
+        [str(s) for s in scripts],
+    )
+
+
+def optimize_report(path: str = ".build_optimize.json", top: int = 10):
+    """
+    Writes the bytes saved on every optimized page, most first, and how much
+    the HTML grew or shrank with the critical CSS inlined.
+    """
+    active = optimize.active
+    static = os.path.join(str(freezer.root), "static")
+    written = active.write(static)
+    for name, (filename, data) in active.files.items():
+        print(f"purged {name}: {active.original_sizes[name]:,} -> {len(data):,} bytes")
+    pages = sorted(active.pages.items(), key=lambda item: -bytes_saved(item[1]))
+    with open(path, "w") as f:
+        json.dump(
+            {url: {**s._asdict(), "saved": bytes_saved(s)} for url, s in pages},
+            f,
+            indent=1,
+        )
+    html_before = sum(s.html_before for s in active.pages.values())
+    html_after = sum(s.html_after for s in active.pages.values())
+    inline_css = sum(s.inline_css for s in active.pages.values())
+    inlined = sum(1 for s in active.pages.values() if s.inline_css)
+    print(
+        f"optimized: {len(pages)} pages, {html_before:,} -> {html_after:,} bytes of "
+        f"HTML ({html_after - html_before:+,}, {inline_css:,} of inline CSS on "
+        f"{inlined} pages), {sum(map(bytes_saved, active.pages.values())):,} bytes "
+        f"saved, {written} stylesheets written, most saved:"
+    )
+    for url, s in pages[:top]:
+        print(
+            f"  {bytes_saved(s):8,} bytes  {url}  (HTML {s.html_before:,} -> "
+            f"{s.html_after:,} ({s.html_after - s.html_before:+,}, "
+            f"{s.inline_css:,} of inline CSS), blocking CSS {s.css_before:,} -> "
+            f"{s.css_after:,}, preloaded CSS {s.preloaded_css:,})"
+        )
+
+
+def bytes_saved(saved: optimize.Saved) -> int:
+    """Fewer bytes a browser downloads for the page and its stylesheets."""
+    before = saved.html_before + saved.css_before
+    return before - saved.html_after - saved.css_after - saved.preloaded_css
+
+
+def copy_if_changed(source: str, target: str):
+    with open(source, "rb") as f:
+        write_if_changed(target, f.read())
+
+
+def _compress_file(path: str) -> int:
+    raw = None
+    written = 0
+    for encoding in available_encodings():
+        target = path + ENCODING_SUFFIXES[encoding]
+        if (
+            os.path.exists(target)
+            and os.stat(target).st_mtime_ns >= os.stat(path).st_mtime_ns
+        ):
+            # Frozen-Flask leaves unchanged pages untouched, so is this sibling.
+            continue
+        if raw is None:
+            with open(path, "rb") as f:
+                raw = f.read()
+        data = compress(raw, encoding, prebuilt=True)
+        if len(data) < len(raw):
+            written += write_if_changed(target, data)
+        elif os.path.exists(target):
+            os.remove(target)
+    return written
+
+
+def compress_build(workers: int = 1):
+    """Writes .gz/.zst siblings next to every compressible file in the build."""
+    root = str(freezer.root)
+    ignore = [
+        pattern
+        for pattern in app.config["FREEZER_DESTINATION_IGNORE"]
+        if pattern not in POST_FREEZE_FILES
+    ]
+    paths = [
+        os.path.join(root, name)
+        for name in walk_directory(root, ignore=ignore)
+        if os.path.splitext(name)[1] in COMPRESSIBLE_EXTENSIONS
+    ]
+    # The freezer ignores siblings, drop the ones whose page is gone.
+    for suffix in ENCODING_SUFFIXES.values():
+        for sibling in Path(root).rglob("*" + suffix):
+            original = str(sibling)[: -len(suffix)]
+            if ".git" not in sibling.parts and not os.path.exists(original):
+                sibling.unlink()
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            written = sum(pool.map(_compress_file, paths))
+    else:
+        written = sum(map(_compress_file, paths))
+    print(f"compressed: {written} artifacts written for {len(paths)} files")
 
 
 if __name__ == "__main__":
-    freezer.freeze()
-    # Copy CNAME file to the build dir.
-    copyfile("CNAME", "build/CNAME")
-    # Copy robots.txt file to the build dir.
-    copyfile("robots.txt", "build/robots.txt")
-    # Copy google0379832c2a35e2d0.html file to the build dir.
-    copyfile("google0379832c2a35e2d0.html", "build/google0379832c2a35e2d0.html")
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "-i",
+        "--incremental",
+        action="store_true",
+        help="only re-render pages whose inputs changed since the last build",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="number of processes rendering pages in parallel",
+    )
+    parser.add_argument(
+        "--no-compress",
+        action="store_true",
+        help="skip writing precompressed .gz/.zst siblings",
+    )
+    parser.add_argument(
+        "--no-images",
+        action="store_true",
+        help="skip generating responsive image variants",
+    )
+    parser.add_argument(
+        "--no-optimize",
+        action="store_true",
+        help="skip purging stylesheets, inlining critical CSS and minifying pages",
+    )
+    parser.add_argument(
+        "--timings",
+        action="store_true",
+        help="record phase timings per page, write .build_timings.json",
+    )
+    args = parser.parse_args()
+    if args.timings:
+        app.config["TIMING"] = True
+        timing.pages = {}
+    print(startup_report())
+    if not args.no_images:
+        build_images(args.workers)
+    if not args.no_optimize:
+        start_optimizer()
+    freeze(args.incremental, args.workers)
+    if args.timings:
+        timings_report()
+    if optimize.active is not None:
+        optimize_report()
+    else:
+        optimize.remove_purged("build/static")
+    if args.workers == 1:
+        print("render cache:", get_render_cache().stats())
+    for name in COPIED_FILES:
+        copy_if_changed(name, f"build/{name}")
+    search_index = get_search_index(get_all_posts_with_metadata())
+    shards = search_index.write("build/search-index")
+    print(f"search index: {len(search_index.postings)} terms in {shards} shards")
+    write_if_changed(
+        "build/asset-manifest.json", json.dumps(assets.mapping(), indent=1).encode()
+    )
+    if not args.no_compress:
+        compress_build(args.workers)
+    output = OutputManifest()
+    print("output:", output.update(str(freezer.root)).summary())
+    output.save()
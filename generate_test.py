@@ -0,0 +1,122 @@
+import gzip
+import pytest
+from unittest.mock import patch
+
+import utils
+import generate
+
+
+def write_post(root, path_title, date, tags, category, body="content"):
+    (root / "posts" / f"{path_title}.md").write_text(f"""---
+title: {path_title}
+date: {date}
+tags: {tags}
+category: {category}
+---
+{body}
+""")
+
+
+@pytest.fixture
+def site(tmp_path, monkeypatch):
+    for d in ["posts", "templates", "pages"]:
+        (tmp_path / d).mkdir()
+    (tmp_path / "templates" / "layout.html").write_text("layout")
+    (tmp_path / "pages" / "index.md").write_text("index")
+    (tmp_path / "app.py").write_text("app")
+    write_post(tmp_path, "a", "2024-01-01 00:00:00", '["x"]', "tech", "alpha")
+    write_post(tmp_path, "b", "2024-01-02 00:00:00", '["y"]', "life", "bravo")
+    write_post(tmp_path, "c", "2024-01-03 00:00:00", '["y"]', "life", "charlie")
+    write_post(tmp_path, "d", "2024-01-04 00:00:00", '["z"]', "misc", "delta")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "_all_post_metadata_cache", None)
+    with patch("generate.get_git_commits", return_value=[]):
+        yield tmp_path
+
+
+def test_manifest_unchanged_build_skips_everything(site):
+    generate.BuildManifest().save(["/", "/blog/post/a/", "/blog/tag/x/"])
+    manifest = generate.BuildManifest()
+    output = site / "out.html"
+    output.write_text("")
+    assert manifest.is_unchanged("/blog/post/a/", str(output))
+    assert not manifest.is_unchanged("/blog/post/b/", str(output))
+    assert not manifest.is_unchanged("/opencoder/", str(output))
+
+
+def test_manifest_post_edit_touches_only_dependents(site):
+    before = generate.BuildManifest().current
+    write_post(site, "b", "2024-01-02 00:00:00", '["y"]', "life", body="edited")
+    utils._all_post_metadata_cache = None
+    after = generate.BuildManifest().current
+    changed = {url for url in after if after[url] != before[url]}
+    assert changed == {
+        "/",
+        "/feed.xml",
+        "/sitemap.xml",
+        "/blog/post/a/",
+        "/blog/post/b/",
+        "/blog/post/c/",
+        "/blog/tag/y/",
+        "/blog/category/life/",
+    }
+
+
+def test_manifest_asset_edit_touches_every_page(site, monkeypatch):
+    (site / "static" / "style").mkdir(parents=True)
+    (site / "static" / "style" / "custom.css").write_text("a{}")
+    monkeypatch.setattr(generate, "assets", utils.AssetManifest(str(site / "static")))
+    before = generate.BuildManifest().current
+    (site / "static" / "style" / "custom.css").write_text("a{color:red}")
+    after = generate.BuildManifest().current
+    pages = [url for url in before if not url.startswith("/static/")]
+    assert "/blog/post/a/" in pages and "/blog/tag/x/" in pages
+    # Every page links the stylesheet by its new name.
+    assert [url for url in pages if after[url] == before[url]] == []
+
+
+def test_manifest_covers_every_listing_page(site, monkeypatch):
+    monkeypatch.setitem(generate.app.config, "POSTS_PER_PAGE", 2)
+    before = generate.BuildManifest().current
+    assert {"/", "/page/2/", "/blog/category/life/"} <= before.keys()
+    assert "/page/3/" not in before
+    assert "/blog/category/life/page/2/" not in before
+    assert {p["n"] for p in generate.index()} == {1, 2}
+
+    # a is alone on the second page, editing it leaves the first page be.
+    write_post(site, "a", "2024-01-01 00:00:00", '["x"]', "tech", body="edited")
+    utils._all_post_metadata_cache = None
+    after = generate.BuildManifest().current
+    assert after["/page/2/"] != before["/page/2/"]
+    assert after["/"] == before["/"]
+
+
+def test_parallel_freeze_matches_serial(tmp_path, monkeypatch):
+    monkeypatch.setattr(utils, "_all_post_metadata_cache", None)
+    monkeypatch.setattr(generate.BuildManifest, "save", lambda self, urls: None)
+    outputs = {}
+    for workers in [1, 3]:
+        dest = tmp_path / str(workers)
+        monkeypatch.setitem(generate.app.config, "FREEZER_DESTINATION", str(dest))
+        generate.freeze(workers=workers)
+        outputs[workers] = {
+            p.relative_to(dest): p.read_bytes() for p in dest.rglob("*") if p.is_file()
+        }
+    assert outputs[1] == outputs[3]
+
+
+def test_compress_file_writes_only_shrinking_siblings(tmp_path):
+    page = tmp_path / "index.html"
+    page.write_text("<p>hello</p>" * 100)
+    tiny = tmp_path / "tiny.txt"
+    tiny.write_text("x")
+    with patch("generate.compress", wraps=utils.compress) as compress:
+        assert generate._compress_file(str(page)) == len(utils.available_encodings())
+    assert all(c.kwargs == {"prebuilt": True} for c in compress.call_args_list)
+    assert (
+        gzip.decompress((tmp_path / "index.html.gz").read_bytes()) == page.read_bytes()
+    )
+    # Up to date siblings are left alone.
+    assert generate._compress_file(str(page)) == 0
+    assert generate._compress_file(str(tiny)) == 0
+    assert not (tmp_path / "tiny.txt.gz").exists()
@@ -0,0 +1,94 @@
+"""
+Freeze-time responsive images. Every image under static/image gets resized
+WebP variants (animated WebP for GIFs) and an entry in the image manifest
+that HighlightRenderer.image builds srcset from.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+from typing import Tuple
+
+from PIL import Image, ImageSequence
+
+from utils import IMAGE_DIR, IMAGE_WIDTHS
+
+SOURCE_DIR = "static/image"
+SOURCE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif", ".webp"}
+
+
+def variant_widths(width: int) -> list:
+    return [w for w in IMAGE_WIDTHS if w < width] or [width]
+
+
+def _save_variant(im, path: str, width: int, height: int):
+    size = (width, height)
+    tmp = path + ".tmp"
+    if getattr(im, "is_animated", False):
+        frames = [
+            frame.convert("RGBA").resize(size, Image.LANCZOS)
+            for frame in ImageSequence.Iterator(im)
+        ]
+        frames[0].save(
+            tmp,
+            "WEBP",
+            save_all=True,
+            append_images=frames[1:],
+            duration=im.info.get("duration", 100),
+            loop=im.info.get("loop", 0),
+            quality=80,
+        )
+    else:
+        mode = "RGBA" if im.mode in ("RGBA", "LA", "P") else "RGB"
+        im.convert(mode).resize(size, Image.LANCZOS).save(
+            tmp, "WEBP", quality=80, method=6
+        )
+    os.replace(tmp, path)
+
+
+def _process(path: str) -> Tuple[str, dict]:
+    with open(path, "rb") as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:10]
+    name = os.path.splitext(os.path.basename(path))[0]
+    variants = []
+    with Image.open(path) as im:
+        width, height = im.size
+        for w in variant_widths(width):
+            filename = f"{name}.{digest}.{w}.webp"
+            out = os.path.join(IMAGE_DIR, filename)
+            # Named after the source digest, an existing file is up to date.
+            if not os.path.exists(out):
+                _save_variant(im, out, w, max(1, round(height * w / width)))
+            variants.append({"width": w, "url": f"/images/{filename}"})
+    return "/" + path.replace(os.sep, "/"), {
+        "width": width,
+        "height": height,
+        "variants": variants,
+    }
+
+
+def build_images(workers: int = 1) -> dict:
+    os.makedirs(IMAGE_DIR, exist_ok=True)
+    sources = sorted(
+        os.path.join(SOURCE_DIR, name)
+        for name in os.listdir(SOURCE_DIR)
+        if os.path.splitext(name)[1].lower() in SOURCE_EXTENSIONS
+    )
+    if workers > 1:
+        with multiprocessing.get_context("fork").Pool(workers) as pool:
+            manifest = dict(pool.map(_process, sources))
+    else:
+        manifest = dict(map(_process, sources))
+
+    path = os.path.join(IMAGE_DIR, "manifest.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+    used = {v["url"].split("/")[-1] for e in manifest.values() for v in e["variants"]}
+    for name in os.listdir(IMAGE_DIR):
+        if name.endswith(".webp") and name not in used:
+            os.remove(os.path.join(IMAGE_DIR, name))
+    print(f"images: {len(used)} variants for {len(manifest)} sources")
+    return manifest
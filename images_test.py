@@ -0,0 +1,69 @@
+import json
+import pytest
+
+from PIL import Image
+
+import images
+import render
+import utils
+
+
+@pytest.fixture
+def image_site(tmp_path, monkeypatch):
+    (tmp_path / "static" / "image").mkdir(parents=True)
+    Image.new("RGB", (2000, 1000), "red").save(tmp_path / "static/image/wide.jpg")
+    Image.new("RGBA", (300, 300), "blue").save(tmp_path / "static/image/small.png")
+    frames = [Image.new("RGB", (600, 400), c) for c in ["red", "green", "blue"]]
+    frames[0].save(
+        tmp_path / "static/image/anim.gif",
+        save_all=True,
+        append_images=frames[1:],
+        duration=100,
+    )
+    out = tmp_path / "images"
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(images, "IMAGE_DIR", str(out))
+    monkeypatch.setattr(utils, "IMAGE_DIR", str(out))
+    return out
+
+
+def test_build_images_variants(image_site):
+    manifest = images.build_images()
+    wide = manifest["/static/image/wide.jpg"]
+    assert (wide["width"], wide["height"]) == (2000, 1000)
+    assert [v["width"] for v in wide["variants"]] == [480, 960, 1440]
+    assert [v["width"] for v in manifest["/static/image/small.png"]["variants"]] == [
+        300
+    ]
+    with Image.open(image_site / wide["variants"][0]["url"].split("/")[-1]) as im:
+        assert im.size == (480, 240)
+        assert im.format == "WEBP"
+    anim = manifest["/static/image/anim.gif"]["variants"][0]["url"].split("/")[-1]
+    with Image.open(image_site / anim) as im:
+        assert im.n_frames == 3
+    assert json.loads((image_site / "manifest.json").read_text()) == manifest
+
+
+def test_build_images_cached_by_source_hash(image_site):
+    images.build_images()
+    before = {p.name: p.stat().st_mtime_ns for p in image_site.glob("*.webp")}
+    images.build_images()
+    assert {p.name: p.stat().st_mtime_ns for p in image_site.glob("*.webp")} == before
+
+    Image.new("RGB", (2000, 1000), "green").save("static/image/wide.jpg")
+    images.build_images()
+    after = {p.name for p in image_site.glob("*.webp")}
+    assert len(after) == len(before)
+    assert after != set(before)
+
+
+def test_image_renders_srcset_from_manifest(image_site):
+    images.build_images()
+    result = render.HighlightRenderer().image(
+        "alt", "/static/image/wide.jpg", "Cap;;50"
+    )
+    assert 'srcset="/images/wide.' in result
+    assert "960w" in result
+    assert 'width="2000" height="1000"' in result
+    assert 'loading="lazy"' in result
+    assert 'sizes="(max-width: 768px) 90vw, 320px"' in result
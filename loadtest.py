@@ -0,0 +1,360 @@
+"""
+Load tests for the app. A weighted mix of URLs taken from PostsCache is
+requested by concurrent clients, either in-process through the WSGI interface
+or over HTTP against a running server (blog.sh -s or -w).
+
+    python loadtest.py                                  # in-process, default mix
+    python loadtest.py --url http://127.0.0.1:5000 -c 1,8,32 --duration 20
+    python loadtest.py --mix post=5,feed=1,sitemap=1 --save-baseline
+    python loadtest.py --compare                        # exit 1 on regressions
+
+Throughput, p50/p95/p99 latency and errors are reported per route kind and
+concurrency level, and written to loadtest_results.json.
+"""
+
+import argparse
+import http.client
+import itertools
+import json
+import math
+import platform
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import quote, urlsplit
+
+from app import app
+from utils import get_all_posts_with_metadata
+
+DEFAULT_MIX = {
+    "post": 50,
+    "tag": 15,
+    "category": 10,
+    "index": 10,
+    "feed": 5,
+    "sitemap": 5,
+    "search": 5,
+}
+# Worse than baseline by more than these fractions counts as a regression.
+LATENCY_THRESHOLD = 0.25
+THROUGHPUT_THRESHOLD = 0.20
+
+
+def route_urls() -> Dict[str, List[str]]:
+    """Route kind -> every URL of that kind the current posts produce."""
+    posts = get_all_posts_with_metadata()
+    size = app.config["POSTS_PER_PAGE"]
+
+    def listing(root: str, **kwargs) -> List[str]:
+        return [
+            root if page.number == 1 else f"{root}page/{page.number}/"
+            for page in posts.pages(size, **kwargs)
+        ]
+
+    words = sorted({w.lower() for p in posts for w in p.title.split() if len(w) > 3})
+    return {
+        "post": [f"/blog/post/{quote(p.path_title)}/" for p in posts],
+        "tag": [
+            url
+            for t in posts.by_tag
+            for url in listing(f"/blog/tag/{quote(t)}/", tag=t)
+        ],
+        "category": [
+            url
+            for c in posts.by_category
+            for url in listing(f"/blog/category/{quote(c)}/", category=c)
+        ],
+        "index": listing("/"),
+        "feed": ["/feed.xml"],
+        "sitemap": ["/sitemap.xml"],
+        "search": [f"/search/?q={quote(w)}" for w in words],
+    }
+
+
+def parse_mix(spec: str) -> Dict[str, int]:
+    """Parses "post=5,feed=1" into {"post": 5, "feed": 1}."""
+    mix = {}
+    for item in filter(None, spec.split(",")):
+        kind, _, weight = item.partition("=")
+        mix[kind.strip()] = int(weight)
+    return mix
+
+
+def schedule(
+    urls: Dict[str, List[str]], mix: Dict[str, int], n: int, seed: int = 0
+) -> List[Tuple[str, str]]:
+    """n (kind, url) requests drawn from the mix, the same for the same seed."""
+    rng = random.Random(seed)
+    kinds = [k for k in mix if mix[k] > 0 and urls.get(k)]
+    if not kinds:
+        raise ValueError("the mix has no route kind with URLs")
+    picks = rng.choices(kinds, [mix[k] for k in kinds], k=n)
+    return [(kind, rng.choice(urls[kind])) for kind in picks]
+
+
+class WSGIClient:
+    """Calls the app in-process through its WSGI interface."""
+
+    def __init__(self, headers: Dict[str, str]):
+        self.client = app.test_client()
+        self.headers = headers
+
+    def get(self, url: str) -> int:
+        response = self.client.get(url, headers=self.headers)
+        response.get_data()
+        response.close()
+        return response.status_code
+
+    def close(self):
+        pass
+
+
+class HTTPClient:
+    """One keep-alive connection to a running server."""
+
+    def __init__(self, base: str, headers: Dict[str, str]):
+        parts = urlsplit(base)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip("/")
+        self.headers = headers
+        self.connection = None
+
+    def get(self, url: str) -> int:
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(
+                self.host, self.port, timeout=30
+            )
+        try:
+            self.connection.request("GET", self.prefix + url, headers=self.headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.close()
+            raise
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+# (kind, seconds, status), status 0 when the request raised.
+Record = Tuple[str, float, int]
+
+
+def run_level(
+    make_client: Callable[[], object],
+    plan: List[Tuple[str, str]],
+    concurrency: int,
+    duration: Optional[float] = None,
+) -> Tuple[List[Record], float]:
+    """
+    Runs plan with concurrency clients, each taking the next request once its
+    previous one is answered. With a duration the plan is cycled until it's
+    over, otherwise it runs once. Returns the records and the wall time.
+    """
+    source = itertools.cycle(plan) if duration else iter(plan)
+    lock = threading.Lock()
+    records = []
+    deadline = None
+
+    def worker():
+        client = make_client()
+        local = []
+        try:
+            while deadline is None or time.perf_counter() < deadline:
+                with lock:
+                    request = next(source, None)
+                if request is None:
+                    break
+                kind, url = request
+                started = time.perf_counter()
+                try:
+                    status = client.get(url)
+                except Exception:
+                    status = 0
+                local.append((kind, time.perf_counter() - started, status))
+        finally:
+            client.close()
+            with lock:
+                records.extend(local)
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    started = time.perf_counter()
+    if duration:
+        deadline = started + duration
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records, time.perf_counter() - started
+
+
+def percentile(ordered: List[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+def summarize(records: List[Record], wall: float) -> dict:
+    latencies = sorted(seconds for _, seconds, _ in records)
+    statuses = {}
+    for _, _, status in records:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    errors = sum(1 for _, _, status in records if not 200 <= status < 400)
+    return {
+        "requests": len(records),
+        "errors": errors,
+        "throughput": len(records) / wall if wall else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000 if latencies else 0.0,
+        "p95_ms": percentile(latencies, 0.95) * 1000 if latencies else 0.0,
+        "p99_ms": percentile(latencies, 0.99) * 1000 if latencies else 0.0,
+        "statuses": statuses,
+    }
+
+
+def run(
+    make_client: Callable[[], object],
+    plan: List[Tuple[str, str]],
+    levels: List[int],
+    duration: Optional[float] = None,
+    warmup: int = 0,
+) -> Dict[str, dict]:
+    """Concurrency level -> {"total": summary, "routes": {kind: summary}}."""
+    if warmup:
+        run_level(make_client, plan[:warmup], 1)
+    results = {}
+    for concurrency in levels:
+        records, wall = run_level(make_client, plan, concurrency, duration)
+        by_kind = {}
+        for record in records:
+            by_kind.setdefault(record[0], []).append(record)
+        results[str(concurrency)] = level = {
+            "total": summarize(records, wall),
+            "routes": {k: summarize(r, wall) for k, r in sorted(by_kind.items())},
+        }
+        print(f"concurrency {concurrency}:", flush=True)
+        for name, s in [("total", level["total"]), *level["routes"].items()]:
+            print(
+                f"  {name:>10}: {s['requests']:6d} req {s['throughput']:8.1f}/s"
+                f"  p50 {s['p50_ms']:7.1f}  p95 {s['p95_ms']:7.1f}"
+                f"  p99 {s['p99_ms']:7.1f} ms  errors {s['errors']}",
+                flush=True,
+            )
+    return results
+
+
+def compare(results: dict, baseline: dict) -> List[str]:
+    """Regressions of results against baseline beyond the thresholds."""
+    regressions = []
+    for level, current in results["levels"].items():
+        previous = baseline["levels"].get(level)
+        if previous is None:
+            continue
+        for name, now in [("total", current["total"]), *current["routes"].items()]:
+            before = (
+                previous["total"] if name == "total" else previous["routes"].get(name)
+            )
+            if before is None:
+                continue
+            where = f"c={level} {name}"
+            if before["p95_ms"] and now["p95_ms"] > before["p95_ms"] * (
+                1 + LATENCY_THRESHOLD
+            ):
+                regressions.append(
+                    f"{where} p95: {before['p95_ms']:.1f} -> {now['p95_ms']:.1f} ms"
+                )
+            if name == "total" and now["throughput"] < before["throughput"] * (
+                1 - THROUGHPUT_THRESHOLD
+            ):
+                regressions.append(
+                    f"{where} throughput: {before['throughput']:.1f} -> "
+                    f"{now['throughput']:.1f}/s"
+                )
+            if now["errors"] > before["errors"]:
+                regressions.append(
+                    f"{where} errors: {before['errors']} -> {now['errors']}"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--url", help="base URL of a running server, in-process when omitted"
+    )
+    parser.add_argument(
+        "-c",
+        "--concurrency",
+        default="1,4,16",
+        help="comma separated concurrency levels",
+    )
+    parser.add_argument(
+        "--mix",
+        default=",".join(f"{k}={w}" for k, w in DEFAULT_MIX.items()),
+        help="route kind weights, e.g. post=5,feed=1",
+    )
+    parser.add_argument(
+        "-n", "--requests", type=int, default=2000, help="requests per level"
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        help="seconds per level, cycling the requests, instead of running them once",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=100,
+        help="untimed requests before the first level",
+    )
+    parser.add_argument("--accept-encoding", default="gzip")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="loadtest_results.json")
+    parser.add_argument("--baseline", default="loadtest_baseline.json")
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store the results as baseline"
+    )
+    parser.add_argument(
+        "--compare", action="store_true", help="exit 1 on regressions vs baseline"
+    )
+    args = parser.parse_args()
+
+    headers = {"Accept-Encoding": args.accept_encoding} if args.accept_encoding else {}
+    if args.url:
+        make_client = lambda: HTTPClient(args.url, headers)
+    else:
+        make_client = lambda: WSGIClient(headers)
+    mix = parse_mix(args.mix)
+    levels = [int(c) for c in args.concurrency.split(",")]
+    plan = schedule(route_urls(), mix, args.requests, args.seed)
+    results = {
+        "target": args.url or "wsgi",
+        "mix": mix,
+        "requests": args.requests,
+        "duration": args.duration,
+        "seed": args.seed,
+        "accept_encoding": args.accept_encoding,
+        "python": sys.version.split()[0],
+        "machine": platform.platform(),
+        "time": datetime.now().isoformat(timespec="seconds"),
+        "levels": run(make_client, plan, levels, args.duration, args.warmup),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=1)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.compare:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        setup = ("target", "mix", "requests", "duration", "seed", "accept_encoding")
+        if any(baseline.get(k) != results[k] for k in setup):
+            print("warning: baseline was measured with a different setup")
+        regressions = compare(results, baseline)
+        for line in regressions:
+            print("REGRESSION", line)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+from werkzeug.serving import make_server
+
+import loadtest
+from app import app
+
+
+def test_schedule_follows_mix_and_seed():
+    urls = {"post": ["/p/1", "/p/2"], "feed": ["/feed.xml"], "tag": []}
+    mix = {"post": 3, "feed": 1, "tag": 5, "search": 1}
+    plan = loadtest.schedule(urls, mix, 400, seed=1)
+    assert plan == loadtest.schedule(urls, mix, 400, seed=1)
+    kinds = [kind for kind, _ in plan]
+    assert set(kinds) == {"post", "feed"}
+    assert 250 < kinds.count("post") < 350
+    with pytest.raises(ValueError):
+        loadtest.schedule(urls, {"tag": 1}, 10)
+
+
+def test_parse_mix():
+    assert loadtest.parse_mix("post=5, feed=1,") == {"post": 5, "feed": 1}
+
+
+def test_percentile_nearest_rank():
+    ordered = [float(i) for i in range(1, 101)]
+    assert loadtest.percentile(ordered, 0.5) == 50
+    assert loadtest.percentile(ordered, 0.99) == 99
+    assert loadtest.percentile([7.0], 0.95) == 7
+
+
+def test_route_urls_cover_every_kind():
+    urls = loadtest.route_urls()
+    assert set(urls) == set(loadtest.DEFAULT_MIX)
+    assert "/blog/post/Mini-Rack/" in urls["post"]
+    assert urls["index"][0] == "/"
+
+
+def test_run_in_process():
+    plan = [("post", "/blog/post/Mini-Rack/"), ("feed", "/feed.xml")] * 5
+    plan.append(("post", "/blog/post/missing/"))
+    results = loadtest.run(lambda: loadtest.WSGIClient({}), plan, [1, 3])
+    for level in ("1", "3"):
+        total = results[level]["total"]
+        assert total["requests"] == 11
+        assert total["errors"] == 1
+        assert total["statuses"] == {"200": 10, "404": 1}
+        assert total["p50_ms"] <= total["p95_ms"] <= total["p99_ms"]
+        assert results[level]["routes"]["feed"]["requests"] == 5
+
+
+def test_run_over_http_with_duration():
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        base = f"http://127.0.0.1:{server.port}"
+        plan = [("sitemap", "/sitemap.xml")]
+        client = lambda: loadtest.HTTPClient(base, {"Accept-Encoding": "gzip"})
+        records, wall = loadtest.run_level(client, plan, 2, duration=0.5)
+    finally:
+        server.shutdown()
+        thread.join()
+    assert len(records) > 2
+    assert wall >= 0.5
+    assert {status for _, _, status in records} == {200}
+
+
+def test_compare_flags_regressions_beyond_thresholds():
+    def level(p95, throughput, errors=0):
+        summary = {"p95_ms": p95, "throughput": throughput, "errors": errors}
+        return {"total": summary, "routes": {"post": dict(summary)}}
+
+    baseline = {"levels": {"1": level(10, 100), "4": level(10, 100)}}
+    results = {"levels": {"1": level(12, 90), "4": level(20, 50, errors=2)}}
+    regressions = loadtest.compare(results, baseline)
+    assert all(r.startswith("c=4") for r in regressions)
+    assert len(regressions) == 5
@@ -0,0 +1,452 @@
+"""
+Freeze-time optimization of the HTML pages and their stylesheets, enabled by
+generate.py unless --no-optimize.
+
+Before freezing, the tags, classes, ids and attributes pages can contain are
+collected from every post rendered to HTML, plus every word of the templates,
+scripts and HTML-producing modules. Each local stylesheet gets a
+content-addressed copy without the rules none of those can match. While
+freezing, every page links the purged stylesheets instead. When the purged
+rules matching its own markup, or what its scripts may add, are a small share
+of those stylesheets, they are inlined and the stylesheets load without
+blocking rendering: nothing of the page paints unstyled while they load.
+Otherwise inlining would ship most rules twice, and the purged stylesheets
+stay render-blocking. Repeated inline SVGs are replaced by references to a single
+copy and the page is minified.
+
+Pages are rewritten as they are frozen rather than afterwards, so Frozen-Flask
+still only writes a page when its bytes change, and the parallel freeze
+workers optimize their share of the pages.
+"""
+
+import hashlib
+import os
+import re
+from collections import Counter, namedtuple
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils import write_if_changed
+
+# style/custom.css is purged into style/custom.purged.<digest>.css in the build.
+PURGED_SUFFIX = "purged"
+# Largest share of the purged stylesheets a page's critical rules are inlined at.
+CRITICAL_MAX_SHARE = 0.5
+# On every page, data-theme is set on <html> by color_theme.js.
+ALWAYS_USED = ("html", "body", "data-theme")
+# Whitespace around these tags never renders.
+BLOCK_TAGS = (
+    "!doctype|html|head|body|meta|link|title|base|div|header|main|section|"
+    "footer|nav|article|aside|ul|ol|li|dl|dt|dd|p|h[1-6]|table|thead|tbody|"
+    "tfoot|tr|td|th|figure|figcaption|details|summary|blockquote|br|hr|form|"
+    "noscript"
+)
+
+# A parsed stylesheet is a list of items:
+#   ("rule", [selector, ...], declarations)
+#   ("block", "@media ...", [item, ...])
+#   ("raw", text)  at-rules kept verbatim, like @keyframes and licenses
+Tokens = namedtuple("Tokens", ["tags", "classes", "ids", "attributes", "words"])
+# Bytes of a page, of the stylesheets blocking its first render, of the ones
+# preloaded without blocking it and of the CSS inlined, counted in html_after.
+Saved = namedtuple(
+    "Saved",
+    [
+        "html_before",
+        "html_after",
+        "css_before",
+        "css_after",
+        "preloaded_css",
+        "inline_css",
+    ],
+)
+
+_comment = re.compile(r"/\*.*?\*/", re.S)
+_space = re.compile(r"\s+")
+_word = re.compile(r"[\w-]+")
+_pseudo = re.compile(r"::?[\w-]+(\((?:[^()]|\([^()]*\))*\))?")
+_attribute_selector = re.compile(r"\[\s*([\w-]+)[^\]]*\]")
+_class_or_id = re.compile(r"([.#])(-?[_a-zA-Z][\w-]*)")
+_type_selector = re.compile(r"(?:^|[\s>+~])([a-zA-Z][\w-]*)")
+_html_tag = re.compile(r"<([a-zA-Z][\w-]*)([^>]*)>")
+_html_attribute = re.compile(
+    r"([\w-]+)(?:\s*=\s*(?:\"([^\"]*)\"|'([^']*)'|([^\s>]+)))?"
+)
+_stylesheet = re.compile(
+    r"<link\b[^>]*\brel=\"stylesheet\"[^>]*\bhref=\"(/static/style/[^\"]*)\"[^>]*>\s*"
+)
+_svg = re.compile(r"<svg\b([^>]*)>(.*?)</svg>", re.S)
+_body = re.compile(r"<body\b[^>]*>")
+_protected = re.compile(r"<(pre|textarea|script|style)\b.*?</\1\s*>", re.S | re.I)
+_html_comment = re.compile(r"<!--(?!\[if).*?-->", re.S)
+_around_block = re.compile(rf" ?(</?(?:{BLOCK_TAGS})\b[^>]*>) ?", re.I)
+
+
+def _matching_brace(css: str, start: int) -> int:
+    depth = 0
+    for i in range(start, len(css)):
+        if css[i] == "{":
+            depth += 1
+        elif css[i] == "}":
+            depth -= 1
+            if depth == 0:
+                return i
+    return len(css) - 1
+
+
+def split_selectors(prelude: str) -> List[str]:
+    """Splits a selector list on the commas outside parentheses and brackets."""
+    selectors, depth, start = [], 0, 0
+    for i, c in enumerate(prelude):
+        if c in "([":
+            depth += 1
+        elif c in ")]":
+            depth -= 1
+        elif c == "," and depth == 0:
+            selectors.append(prelude[start:i])
+            start = i + 1
+    selectors.append(prelude[start:])
+    return [s for s in (_space.sub(" ", s).strip() for s in selectors) if s]
+
+
+def _parse_block(css: str, i: int) -> Tuple[list, int]:
+    items = []
+    while True:
+        while i < len(css) and css[i].isspace():
+            i += 1
+        if i >= len(css):
+            return items, i
+        if css[i] == "}":
+            return items, i + 1
+        if css.startswith("/*!", i):
+            end = css.index("*/", i) + 2
+            items.append(("raw", css[i:end] + "\n"))
+            i = end
+            continue
+        brace = css.find("{", i)
+        semicolon = css.find(";", i)
+        if brace == -1 or (css[i] == "@" and -1 < semicolon < brace):
+            # @import, @charset or trailing garbage.
+            end = len(css) if semicolon == -1 else semicolon + 1
+            items.append(("raw", css[i:end].strip()))
+            i = end
+            continue
+        prelude = _space.sub(" ", css[i:brace]).strip()
+        if prelude.startswith("@"):
+            name = prelude[1:].split(" ", 1)[0].lower()
+            if name in ("media", "supports", "layer", "container"):
+                children, i = _parse_block(css, brace + 1)
+                items.append(("block", prelude, children))
+            else:
+                end = _matching_brace(css, brace)
+                items.append(("raw", prelude + _minify_css(css[brace : end + 1])))
+                i = end + 1
+            continue
+        end = css.find("}", brace)
+        end = len(css) if end == -1 else end
+        items.append(("rule", split_selectors(prelude), css[brace + 1 : end]))
+        i = end + 1
+
+
+def parse_css(css: str) -> list:
+    """Items of a stylesheet, comments other than /*! licenses */ dropped."""
+    css = _comment.sub(lambda m: m.group(0) if m.group(0)[2] == "!" else " ", css)
+    return _parse_block(css, 0)[0]
+
+
+def _minify_css(text: str) -> str:
+    text = _space.sub(" ", text).strip()
+    return re.sub(r" ?([;:{},]) ?", r"\1", text).replace(";}", "}").strip(";")
+
+
+def serialize(items: list) -> str:
+    out = []
+    for item in items:
+        if item[0] == "rule":
+            out.append(f"{','.join(item[1])}{{{_minify_css(item[2])}}}")
+        elif item[0] == "block":
+            out.append(f"{item[1]}{{{serialize(item[2])}}}")
+        else:
+            out.append(item[1])
+    return "".join(out)
+
+
+@lru_cache(maxsize=None)
+def requirements(selector: str) -> Tuple[Tuple[str, str], ...]:
+    """(kind, name) pairs an element tree must contain for selector to match."""
+    needs = []
+    # Pseudo-classes never rule a selector out, :not(.x) included.
+    selector = _pseudo.sub(" ", selector)
+    for name in _attribute_selector.findall(selector):
+        needs.append(("attributes", name.lower()))
+    selector = _attribute_selector.sub(" ", selector)
+    for kind, name in _class_or_id.findall(selector):
+        needs.append(("classes" if kind == "." else "ids", name))
+    selector = _class_or_id.sub(" ", selector)
+    for name in _type_selector.findall(selector):
+        needs.append(("tags", name.lower()))
+    return tuple(needs)
+
+
+def matches(selector: str, tokens: Tokens) -> bool:
+    return all(
+        name in getattr(tokens, kind) or name in tokens.words
+        for kind, name in requirements(selector)
+    )
+
+
+def purge(items: list, tokens: Tokens, keep_raw: bool = True) -> list:
+    """items without the selectors tokens can't match, nor the rules left empty."""
+    kept = []
+    for item in items:
+        if item[0] == "rule":
+            selectors = [s for s in item[1] if matches(s, tokens)]
+            if selectors:
+                kept.append(("rule", selectors, item[2]))
+        elif item[0] == "block":
+            children = purge(item[2], tokens, keep_raw)
+            if children:
+                kept.append(("block", item[1], children))
+        elif keep_raw:
+            kept.append(item)
+    return kept
+
+
+def collect_tokens(
+    html: Iterable[str] = (), text: Iterable[str] = (), always: Iterable[str] = ()
+) -> Tokens:
+    """
+    Tokens of the elements in html, plus every word of text (templates,
+    scripts) and always, which may end up anywhere in a page.
+    """
+    tokens = Tokens(set(), set(), set(), set(), set(always))
+    for page in html:
+        for tag, attributes in _html_tag.findall(page):
+            tokens.tags.add(tag.lower())
+            for name, *values in _html_attribute.findall(attributes):
+                name = name.lower()
+                tokens.attributes.add(name)
+                value = "".join(values)
+                if name == "class":
+                    tokens.classes.update(value.split())
+                elif name == "id":
+                    tokens.ids.add(value)
+    for source in text:
+        tokens.words.update(_word.findall(source))
+    return tokens
+
+
+def dedupe_svgs(html: str) -> str:
+    """Inline SVGs occurring more than once become <use> references to one copy."""
+    counts = Counter(m.group(0) for m in _svg.finditer(html))
+    ids = {}
+    definitions = []
+    for svg, count in counts.items():
+        if count > 1:
+            ids[svg] = f"svg-sprite-{len(ids)}"
+            definitions.append(f'<g id="{ids[svg]}">{_svg.match(svg).group(2)}</g>')
+    body = _body.search(html)
+    if not ids or body is None:
+        return html
+
+    def reference(m):
+        sprite = ids.get(m.group(0))
+        if sprite is None:
+            return m.group(0)
+        return f'<svg{m.group(1)}><use href="#{sprite}"/></svg>'
+
+    sprites = (
+        '<svg width="0" height="0" style="position:absolute" aria-hidden="true">'
+        f"<defs>{''.join(definitions)}</defs></svg>"
+    )
+    html = html[: body.end()] + sprites + html[body.end() :]
+    return html[: body.end()] + _svg.sub(reference, html[body.end() :])
+
+
+def minify_html(html: str) -> str:
+    """
+    Drops comments and collapses whitespace, removing it around block-level
+    tags. The contents of pre, textarea, script and style are left alone.
+    """
+    out = []
+    i = 0
+    for m in _protected.finditer(html):
+        out.append(_minify_text(html[i : m.start()]))
+        out.append(m.group(0))
+        i = m.end()
+    out.append(_minify_text(html[i:]))
+    # Whitespace next to the protected blocks, which are block-level bar textarea.
+    joined = []
+    for n, part in enumerate(out):
+        if n % 2 == 0:
+            if n > 0 and not out[n - 1].lower().startswith("<textarea"):
+                part = part.lstrip()
+            if n + 1 < len(out) and not out[n + 1].lower().startswith("<textarea"):
+                part = part.rstrip()
+        joined.append(part)
+    return "".join(joined).strip() + "\n"
+
+
+def _minify_text(text: str) -> str:
+    text = _space.sub(" ", _html_comment.sub("", text))
+    return _around_block.sub(r"\1", text)
+
+
+class Optimizer:
+    """
+    Purged copies of the stylesheets and the critical rules of each page, from
+    the stylesheets (name -> CSS, in cascade order), the tokens pages use and
+    the scripts whose words may become classes or ids once pages load. hrefs
+    maps the URLs pages link the stylesheets by to their names.
+    """
+
+    def __init__(
+        self,
+        stylesheets: Dict[str, str],
+        hrefs: Dict[str, str],
+        used: Tokens,
+        scripts: Iterable[str] = (),
+    ):
+        self.hrefs = hrefs
+        self.scripts = list(scripts)
+        self.items = {}
+        self.files = {}
+        self.original_sizes = {}
+        for name, css in stylesheets.items():
+            self.original_sizes[name] = len(css.encode())
+            self.items[name] = purge(parse_css(css), used)
+            data = serialize(self.items[name]).encode()
+            base, ext = os.path.splitext(name)
+            digest = hashlib.sha256(data).hexdigest()[:10]
+            self.files[name] = (f"{base}.{PURGED_SUFFIX}.{digest}{ext}", data)
+        self.digest = hashlib.sha256(
+            repr([sorted(self.files.values()), self.scripts]).encode()
+        ).hexdigest()
+        # URL -> Saved of the pages optimized.
+        self.pages = {}
+
+    def critical_css(self, html: str, sheets: Tuple[str, ...]) -> str:
+        """Rules of sheets matching the markup of html or what scripts add."""
+        tokens = collect_tokens([html], self.scripts, ALWAYS_USED)
+        items = [item for name in sheets for item in self.items[name]]
+        return serialize(purge(items, tokens, keep_raw=False))
+
+    def optimize(self, url: str, html: str) -> str:
+        """The optimized page, what it saves is recorded in pages under url."""
+        linked = [self.hrefs.get(m.group(1)) for m in _stylesheet.finditer(html)]
+        sheets = tuple(n for n in linked if n is not None)
+        purged = sum(len(self.files[n][1]) for n in sheets)
+        critical = self.critical_css(html, sheets) if sheets else ""
+        if len(critical.encode()) > CRITICAL_MAX_SHARE * purged:
+            critical = ""
+        optimized = minify_html(dedupe_svgs(self.link_stylesheets(html, critical)))
+        self.pages[url] = Saved(
+            len(html.encode()),
+            len(optimized.encode()),
+            sum(self.original_sizes[n] for n in sheets),
+            0 if critical else purged,
+            purged if critical else 0,
+            len(critical.encode()),
+        )
+        return optimized
+
+    def link_stylesheets(self, html: str, critical: str = "") -> str:
+        """
+        Replaces the links to the local stylesheets by links to the purged
+        ones. With critical rules, those are inlined and the purged
+        stylesheets loaded without blocking.
+        """
+        links = [m for m in _stylesheet.finditer(html) if m.group(1) in self.hrefs]
+        if not links:
+            return html
+        out = [html[: links[0].start()]]
+        if critical:
+            out.append(f"<style>{critical}</style>\n")
+        # Each in place of its link, the cascade order stays the same.
+        for i, link in enumerate(links):
+            if i:
+                out.append(html[links[i - 1].end() : link.start()])
+            href = f"/static/{self.files[self.hrefs[link.group(1)]][0]}"
+            if critical:
+                out.append(
+                    f'<link rel="preload" href="{href}" as="style" '
+                    "onload=\"this.onload=null;this.rel='stylesheet'\">"
+                    f'<noscript><link rel="stylesheet" href="{href}"></noscript>\n'
+                )
+            else:
+                out.append(link.group(0).replace(link.group(1), href))
+        out.append(html[links[-1].end() :])
+        return "".join(out)
+
+    def write(self, static_root: str) -> int:
+        """
+        Writes the purged stylesheets under static_root, removes the ones of
+        previous builds. Returns the number of files written.
+        """
+        written = 0
+        for filename, data in self.files.values():
+            path = os.path.join(static_root, filename)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            written += write_if_changed(path, data)
+        remove_purged(static_root, keep=[f for f, _ in self.files.values()])
+        return written
+
+
+def remove_purged(static_root: str, keep: Iterable[str] = ()):
+    """
+    Removes the purged stylesheets under static_root but keep. Not their
+    .gz/.zst siblings, compress_build drops those of removed files.
+    """
+    keep = {os.path.normpath(os.path.join(static_root, f)) for f in keep}
+    for path in Path(static_root).rglob(f"*.{PURGED_SUFFIX}.*.css"):
+        if os.path.normpath(path) not in keep:
+            path.unlink()
+
+
+def stylesheet_order(template_folder: str) -> List[str]:
+    """Local stylesheets the templates link, layout.html's first, in link order."""
+    names = sorted(os.listdir(template_folder), key=lambda n: n != "layout.html")
+    order = {}
+    for name in names:
+        with open(os.path.join(template_folder, name)) as f:
+            for sheet in re.findall(r"asset_url\('(style/[^']+\.css)'\)", f.read()):
+                order[sheet] = None
+    return list(order)
+
+
+def _read(paths: Iterable[str]) -> List[str]:
+    texts = []
+    for path in paths:
+        with open(path) as f:
+            texts.append(f.read())
+    return texts
+
+
+def build_optimizer(
+    static_folder: str,
+    template_folder: str,
+    hashed: Callable[[str], str],
+    pages_html: Iterable[str],
+    sources: Iterable[str],
+    scripts: Iterable[str] = (),
+) -> Optimizer:
+    """
+    pages_html is the HTML of every piece of content, sources the
+    HTML-producing modules whose words may end up in a page and scripts the
+    ones pages run. hashed gives the name a static file is linked by.
+    """
+    stylesheets = {}
+    for name in stylesheet_order(template_folder):
+        with open(os.path.join(static_folder, name)) as f:
+            stylesheets[name] = f.read()
+    templates = sorted(os.listdir(template_folder))
+    texts = _read([*sources, *(os.path.join(template_folder, n) for n in templates)])
+    script_texts = _read(scripts)
+    used = collect_tokens(pages_html, texts + script_texts, ALWAYS_USED)
+    hrefs = {"/static/" + hashed(name): name for name in stylesheets}
+    return Optimizer(stylesheets, hrefs, used, script_texts)
+
+
+# Set by generate.py while freezing, app.py then optimizes every HTML page.
+active: Optional[Optimizer] = None
@@ -0,0 +1,197 @@
+import os
+
+import optimize
+from optimize import Optimizer, collect_tokens
+
+CSS = """/*! license */
+@import url("fonts.css");
+/* dropped */
+.used, .unused { color: red; }
+a:hover:not(.unused) { color: blue }
+[data-theme="dark"] pre code { background: #000; }
+@media (max-width: 600px) {
+  .unused { display: none }
+  .used { display: block; }
+}
+@keyframes spin { from { opacity: 0 } to { opacity: 1 } }
+"""
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <link id="spectre" rel="stylesheet" href="/static/style/a.1.css">
+    <!-- a comment -->
+    <link rel="stylesheet" href="https://cdn.example.com/other.css">
+    <link rel="stylesheet" href="/static/style/b.2.css">
+    <script>
+        var  x = 1;
+    </script>
+</head>
+<body>
+    <header>   <a class="used"  href="#">link</a>   </header>
+    <pre>  keep
+   this  </pre>
+</body>
+</html>
+"""
+
+
+def test_parse_and_purge_keeps_matching_selectors():
+    items = optimize.parse_css(CSS)
+    used = collect_tokens(["<a class='used'>"], always=["data-theme"])
+    assert optimize.serialize(optimize.purge(items, used)) == (
+        "/*! license */\n"
+        '@import url("fonts.css");'
+        ".used{color:red}"
+        "a:hover:not(.unused){color:blue}"
+        "@media (max-width: 600px){.used{display:block}}"
+        "@keyframes spin{from{opacity:0}to{opacity:1}}"
+    )
+    used.tags.update(["pre", "code"])
+    assert '[data-theme="dark"] pre code' in optimize.serialize(
+        optimize.purge(items, used)
+    )
+
+
+def test_requirements_ignore_pseudo_classes():
+    assert optimize.requirements("ul li > a.btn:not(.active)::after") == (
+        ("classes", "btn"),
+        ("tags", "ul"),
+        ("tags", "li"),
+        ("tags", "a"),
+    )
+    assert optimize.requirements('[type="search"], #x') == (
+        ("attributes", "type"),
+        ("ids", "x"),
+    )
+
+
+def test_collect_tokens_reads_elements_and_words():
+    tokens = collect_tokens(
+        ['<div class="a  b" id=main data-x><svg viewBox="0 0 1 1"></svg></div>'],
+        ["el.classList.add('toggled')"],
+    )
+    assert tokens.tags == {"div", "svg"}
+    assert tokens.classes == {"a", "b"}
+    assert tokens.ids == {"main"}
+    assert tokens.attributes == {"class", "id", "data-x", "viewbox"}
+    assert "toggled" in tokens.words
+
+
+def test_minify_html_keeps_preformatted_text():
+    html = optimize.minify_html(PAGE)
+    assert "<!--" not in html
+    assert "<pre>  keep\n   this  </pre>" in html
+    assert "var  x = 1;" in html
+    assert '<header><a class="used" href="#">link</a></header>' in html
+    assert html.endswith("</body></html>\n")
+
+
+def test_dedupe_svgs_references_repeated_icons():
+    icon = '<svg viewBox="0 0 8 8"><path d="M0 0h8"/></svg>'
+    html = f"<body><h1>a {icon}</h1><h2>b {icon}</h2><svg><circle/></svg></body>"
+    deduped = optimize.dedupe_svgs(html)
+    assert deduped.count('<path d="M0 0h8"/>') == 1
+    assert (
+        deduped.count('<svg viewBox="0 0 8 8"><use href="#svg-sprite-0"/></svg>') == 2
+    )
+    assert '<g id="svg-sprite-0">' in deduped
+    assert "<svg><circle/></svg>" in deduped
+    assert optimize.dedupe_svgs("<body>" + icon) == "<body>" + icon
+
+
+# Rules only other pages use, the ones PAGE matches are a small share of a.css.
+ELSEWHERE = ".elsewhere{" + "color:red;" * 40 + "}"
+
+
+def make_optimizer():
+    script = "el.classList.add('toggled')"
+    return Optimizer(
+        {
+            "style/a.css": ".used{color:red}.unused{color:blue}.toggled{color:green}"
+            + ELSEWHERE,
+            "style/b.css": CSS + "pre{margin:0}",
+        },
+        {
+            "/static/style/a.1.css": "style/a.css",
+            "/static/style/b.2.css": "style/b.css",
+        },
+        collect_tokens(
+            [PAGE, "<code class='elsewhere'>"], [script], optimize.ALWAYS_USED
+        ),
+        [script],
+    )
+
+
+def test_optimizer_inlines_critical_css():
+    optimizer = make_optimizer()
+    a, b = (optimizer.files[n][0] for n in ["style/a.css", "style/b.css"])
+    assert a.startswith("style/a.purged.") and b.startswith("style/b.purged.")
+    html = optimizer.optimize("/p/", PAGE)
+    # Everything the page shows or its scripts add, but raw at-rules, which the
+    # full sheets still bring.
+    critical = (
+        ".used{color:red}.toggled{color:green}.used{color:red}"
+        "a:hover:not(.unused){color:blue}"
+        "@media (max-width: 600px){.used{display:block}}pre{margin:0}"
+    )
+    assert f"<style>{critical}</style>" in html
+    assert "/static/style/a.1.css" not in html
+    assert html.index(a) < html.index("other.css") < html.index(b)
+    assert f'<noscript><link rel="stylesheet" href="/static/{b}"></noscript>' in html
+    saved = optimizer.pages["/p/"]
+    assert saved.html_before == len(PAGE) and saved.html_after == len(html)
+    assert saved.css_before == len(CSS) + len(ELSEWHERE) + 69
+    assert saved.css_after == 0
+    assert saved.preloaded_css == sum(len(d) for _, d in optimizer.files.values())
+    assert saved.inline_css == len(critical)
+
+
+def test_optimizer_keeps_large_critical_css_blocking():
+    optimizer = make_optimizer()
+    page = PAGE.replace("<pre>", "<pre class='elsewhere'><code>")
+    html = optimizer.optimize("/q/", page)
+    assert "<style>" not in html and 'rel="preload"' not in html
+    a, b = (optimizer.files[n][0] for n in ["style/a.css", "style/b.css"])
+    assert f'<link id="spectre" rel="stylesheet" href="/static/{a}">' in html
+    assert f'<link rel="stylesheet" href="/static/{b}">' in html
+    saved = optimizer.pages["/q/"]
+    assert saved.css_after == sum(len(d) for _, d in optimizer.files.values())
+    assert saved.preloaded_css == saved.inline_css == 0
+
+
+def test_optimizer_critical_css_follows_the_page():
+    optimizer = make_optimizer()
+    html = optimizer.optimize("/q/", PAGE.replace("<pre>", "<pre><code>"))
+    assert '[data-theme="dark"] pre code{background:#000}' in html
+    assert '[data-theme="dark"]' not in optimizer.optimize("/p/", PAGE)
+
+
+def test_optimizer_leaves_pages_without_local_stylesheets():
+    optimizer = make_optimizer()
+    page = PAGE.replace("/static/style/", "https://cdn.example.com/")
+    html = optimizer.optimize("/p/", page)
+    assert "<style>" not in html
+    assert (
+        '<link id="spectre" rel="stylesheet" href="https://cdn.example.com/a.1.css">'
+        in html
+    )
+    assert optimizer.pages["/p/"] == (len(page), len(html), 0, 0, 0, 0)
+
+
+def test_optimizer_write_replaces_stale_sheets(tmp_path):
+    stale = tmp_path / "style" / "a.purged.0000000000.css"
+    stale.parent.mkdir()
+    stale.write_text("old")
+    optimizer = make_optimizer()
+    assert optimizer.write(str(tmp_path)) == 2
+    current = tmp_path / optimizer.files["style/a.css"][0]
+    (tmp_path / (str(current) + ".gz")).write_bytes(b"gz")
+    assert optimizer.write(str(tmp_path)) == 0
+    assert os.path.exists(str(current) + ".gz")
+    os.remove(str(current) + ".gz")
+    assert sorted(p.name for p in (tmp_path / "style").iterdir()) == sorted(
+        f.split("/")[1] for f, _ in optimizer.files.values()
+    )
+    optimize.remove_purged(str(tmp_path))
+    assert list((tmp_path / "style").iterdir()) == []
@@ -0,0 +1,178 @@
+"""
+Publishing build/, a git checkout of the deployed site.
+
+    python publish.py            # commit and push what changed since HEAD
+    python publish.py --dry-run  # only list the added/changed/removed files
+
+Every build ends by recording the git blob id of each output file in
+OUTPUT_MANIFEST, hashing only the files whose size or mtime moved, and
+generate.py leaves unchanged outputs untouched. Comparing that with the tree
+of the checkout's HEAD gives the exact delta, only those paths are staged.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+from collections import namedtuple
+from contextlib import suppress
+from typing import Dict, Tuple
+
+BUILD_DIR = "build"
+OUTPUT_MANIFEST = ".build_output.json"
+
+
+def blob_id(data: bytes) -> str:
+    """The object id git gives a file with these contents."""
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+class Delta(namedtuple("Delta", ["added", "changed", "removed"])):
+    """Sorted relative paths, per kind of change."""
+
+    def paths(self):
+        return self.added + self.changed + self.removed
+
+    def summary(self) -> str:
+        return (
+            f"{len(self.added)} added, {len(self.changed)} changed, "
+            f"{len(self.removed)} removed"
+        )
+
+
+def diff(old: Dict[str, str], new: Dict[str, str]) -> Delta:
+    """Delta between two path -> blob id maps."""
+    return Delta(
+        sorted(new.keys() - old.keys()),
+        sorted(p for p in new.keys() & old.keys() if new[p] != old[p]),
+        sorted(old.keys() - new.keys()),
+    )
+
+
+class OutputManifest:
+    """
+    Size, mtime and git blob id of every file of the last build, keyed by path
+    relative to the build directory. update() reuses an entry as long as its
+    file's size and mtime are unchanged.
+    """
+
+    def __init__(self, path: str = OUTPUT_MANIFEST):
+        self.path = path
+        self.files = {}
+        with suppress(OSError, ValueError):
+            with open(path, "r") as f:
+                self.files = json.load(f)
+
+    def update(self, root: str) -> Delta:
+        """Rescans root, returns what changed since the previous scan."""
+        previous = self.blob_ids()
+        files = {}
+        for directory, subdirectories, names in os.walk(root):
+            if directory == root and ".git" in subdirectories:
+                subdirectories.remove(".git")
+            for name in names:
+                path = os.path.join(directory, name)
+                relative = os.path.relpath(path, root).replace(os.sep, "/")
+                st = os.stat(path)
+                entry = self.files.get(relative)
+                if entry is None or entry[:2] != [st.st_size, st.st_mtime_ns]:
+                    with open(path, "rb") as f:
+                        entry = [st.st_size, st.st_mtime_ns, blob_id(f.read())]
+                files[relative] = entry
+        self.files = files
+        return diff(previous, self.blob_ids())
+
+    def blob_ids(self) -> Dict[str, str]:
+        return {path: entry[2] for path, entry in self.files.items()}
+
+    def save(self):
+        with open(self.path + ".tmp", "w") as f:
+            json.dump(self.files, f, indent=1, sort_keys=True)
+        os.replace(self.path + ".tmp", self.path)
+
+
+def git(root: str, *args: str, data: bytes = None) -> bytes:
+    return subprocess.run(
+        ["git", "--literal-pathspecs", *args],
+        cwd=root,
+        input=data,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+
+
+def published(root: str) -> Dict[str, Tuple[str, int]]:
+    """path -> (blob id, size) in the checkout's HEAD, empty before the first commit."""
+    try:
+        listing = subprocess.run(
+            ["git", "ls-tree", "-r", "-l", "-z", "HEAD"],
+            cwd=root,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        ).stdout
+    except subprocess.CalledProcessError:
+        return {}
+    files = {}
+    for line in filter(None, listing.split(b"\0")):
+        info, path = line.split(b"\t", 1)
+        _, kind, oid, size = info.split()
+        if kind == b"blob":
+            files[os.fsdecode(path)] = (oid.decode(), int(size))
+    return files
+
+
+def report(delta: Delta, head: Dict[str, Tuple[str, int]], manifest: OutputManifest):
+    sizes = {path: entry[0] for path, entry in manifest.files.items()}
+    change = sum(sizes[p] for p in delta.added + delta.changed) - sum(
+        head[p][1] for p in delta.changed + delta.removed
+    )
+    print(f"publish: {delta.summary()} ({change:+,} bytes)")
+    for marker, paths in zip("AMD", delta):
+        for path in paths:
+            if marker == "M":
+                print(f"  M {path} ({head[path][1]:,} -> {sizes[path]:,} bytes)")
+            else:
+                size = sizes[path] if marker == "A" else head[path][1]
+                print(f"  {marker} {path} ({size:,} bytes)")
+
+
+def publish(
+    root: str = BUILD_DIR, message: str = "update", dry_run: bool = False
+) -> Delta:
+    """Commits and pushes the files of root that differ from its HEAD, only those."""
+    manifest = OutputManifest()
+    manifest.update(root)
+    manifest.save()
+    head = published(root)
+    delta = diff({path: oid for path, (oid, _) in head.items()}, manifest.blob_ids())
+    report(delta, head, manifest)
+    if dry_run or not delta.paths():
+        return delta
+    pathspecs = b"\0".join(os.fsencode(p) for p in delta.paths())
+    git(
+        root,
+        "add",
+        "--all",
+        "--pathspec-from-file=-",
+        "--pathspec-file-nul",
+        data=pathspecs,
+    )
+    git(root, "commit", "--quiet", "-m", message)
+    git(root, "push", "--quiet")
+    return delta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--root", default=BUILD_DIR)
+    parser.add_argument("-m", "--message", default="update")
+    parser.add_argument(
+        "-n",
+        "--dry-run",
+        action="store_true",
+        help="only list what would be published",
+    )
+    args = parser.parse_args()
+    publish(args.root, args.message, args.dry_run)
@@ -0,0 +1,98 @@
+import os
+import subprocess
+
+import pytest
+
+import publish
+from utils import write_if_changed
+
+
+def run_git(cwd, *args):
+    return subprocess.run(
+        ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+    ).stdout
+
+
+@pytest.fixture
+def checkout(tmp_path, monkeypatch):
+    for key in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{key}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{key}_EMAIL", "test@example.com")
+    remote = tmp_path / "remote.git"
+    build = tmp_path / "build"
+    run_git(tmp_path, "init", "-q", "--bare", str(remote))
+    run_git(tmp_path, "init", "-q", str(build))
+    (build / "index.html").write_text("home")
+    (build / "blog").mkdir()
+    (build / "blog" / "a.html").write_text("a")
+    (build / "blog" / "b.html").write_text("b")
+    run_git(build, "add", ".")
+    run_git(build, "commit", "-q", "-m", "initial")
+    run_git(build, "remote", "add", "origin", str(remote))
+    run_git(build, "push", "-q", "-u", "origin", "HEAD")
+    monkeypatch.chdir(tmp_path)
+    return build
+
+
+def test_blob_id_matches_git(tmp_path):
+    (tmp_path / "f").write_bytes(b"some\0bytes")
+    expected = run_git(tmp_path, "hash-object", "f").strip()
+    assert publish.blob_id(b"some\0bytes") == expected
+
+
+def test_write_if_changed_keeps_mtime(tmp_path):
+    path = str(tmp_path / "f")
+    assert write_if_changed(path, b"data")
+    os.utime(path, ns=(0, 0))
+    assert not write_if_changed(path, b"data")
+    assert os.stat(path).st_mtime_ns == 0
+    assert write_if_changed(path, b"other")
+
+
+def test_output_manifest_hashes_only_touched_files(checkout, monkeypatch):
+    manifest = publish.OutputManifest()
+    delta = manifest.update(str(checkout))
+    assert delta.added == ["blog/a.html", "blog/b.html", "index.html"]
+    manifest.save()
+
+    (checkout / "blog" / "a.html").write_text("edited")
+    (checkout / "blog" / "b.html").unlink()
+    (checkout / "new.html").write_text("new")
+    hashed = []
+    monkeypatch.setattr(
+        publish, "blob_id", lambda data: hashed.append(data) or data.decode()
+    )
+    delta = publish.OutputManifest().update(str(checkout))
+    assert delta == (["new.html"], ["blog/a.html"], ["blog/b.html"])
+    assert sorted(hashed) == [b"edited", b"new"]
+
+
+def test_dry_run_lists_delta_without_staging(checkout, capsys):
+    (checkout / "index.html").write_text("home, edited")
+    (checkout / "blog" / "b.html").unlink()
+    delta = publish.publish(str(checkout), dry_run=True)
+    assert delta == ([], ["index.html"], ["blog/b.html"])
+    out = capsys.readouterr().out
+    assert "publish: 0 added, 1 changed, 1 removed (+7 bytes)" in out
+    assert "  M index.html (4 -> 12 bytes)" in out
+    assert run_git(checkout, "diff", "--cached", "--name-only") == ""
+
+
+def test_publish_commits_and_pushes_only_delta(checkout):
+    (checkout / "index.html").write_text("home, edited")
+    (checkout / "blog" / "b.html").unlink()
+    (checkout / "c.html").write_text("c")
+    publish.publish(str(checkout), message="update")
+    changed = run_git(checkout, "show", "--name-status", "--format=%s", "HEAD")
+    assert changed.split("\n")[0] == "update"
+    assert sorted(changed.split("\n")[2:-1]) == [
+        "A\tc.html",
+        "D\tblog/b.html",
+        "M\tindex.html",
+    ]
+    assert run_git(checkout, "status", "--porcelain") == ""
+    remote = checkout.parent / "remote.git"
+    assert run_git(remote, "rev-parse", "HEAD") == run_git(
+        checkout, "rev-parse", "HEAD"
+    )
+    assert publish.publish(str(checkout)).paths() == []
@@ -0,0 +1,258 @@
+"""
+Related posts. Each post is a sparse vector of three parts, each L2
+normalised: the TF-IDF weights of its KEYWORDS strongest body terms, its tags
+weighted by IDF, and its category. A pair scores the weighted sum of the three
+cosines. All pairs are scored at once with NumPy when PostsCache is built: the
+most common features (categories, popular tags) go through a dense matrix
+product, the rest produce their pairs from an inverted index. A feature shared
+by more than PAIR_DF_LIMIT posts only links the ones it weighs most, which
+bounds the work on large corpora.
+
+A new snapshot with few changed posts only rescores those and the posts
+linking to them, every other post merges its scores against the changed posts
+into its previous list. Those keep the scores of the snapshot that computed
+them, so they drift slightly as document frequencies shift, until more than
+RESCORE_SHARE of the posts change at once and everything is rescored.
+"""
+
+import math
+import re
+from collections import Counter
+from itertools import chain, count
+from typing import Collection, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from search import stem
+
+RELATED_K = 5
+# Body terms counted per post, the KEYWORDS with the highest TF-IDF are scored.
+TERMS_PER_POST = 64
+KEYWORDS = 16
+TEXT_WEIGHT = 1.0
+TAG_WEIGHT = 0.6
+CATEGORY_WEIGHT = 0.2
+# The most common features (categories, popular tags) are scored densely.
+DENSE_FEATURES = 64
+# Any other feature pairs up at most this many posts, the ones it weighs most.
+PAIR_DF_LIMIT = 32
+# Rows of the score matrix held at a time.
+BLOCK = 1024
+# Beyond this share of changed posts, a snapshot rescores every post.
+RESCORE_SHARE = 0.05
+
+_fenced = re.compile(r"^```.*?^```", re.M | re.S)
+_markup = re.compile(r"<[^>]+>|\]\([^)]*\)")
+_word = re.compile(r"[^\W\d_]{3,}")
+
+# (terms, counts) of one post.
+Terms = Tuple[Tuple[str, ...], Tuple[int, ...]]
+# path_title -> (path title, score) of its most related posts, best first.
+Related = Dict[str, List[Tuple[str, float]]]
+
+
+def post_terms(md: str) -> Terms:
+    """The TERMS_PER_POST most frequent stemmed words outside code and markup."""
+    text = _markup.sub(" ", _fenced.sub(" ", md)).lower()
+    counts = Counter(map(stem, _word.findall(text))).most_common(TERMS_PER_POST)
+    return tuple(t for t, _ in counts), tuple(c for _, c in counts)
+
+
+def _strongest(group, weight, limit: int):
+    """Indices of the at most limit highest weights of every group."""
+    order = np.lexsort((-weight, group))
+    grouped = group[order]
+    rank = np.arange(len(order)) - np.searchsorted(grouped, grouped)
+    return order[rank < limit]
+
+
+def _part(features: list, counts: Optional[list], idf: bool, keep: Optional[int]):
+    """(row, feature, weight) of one part, rows L2 normalised, feature ids local."""
+    n = len(features)
+    flat = list(chain.from_iterable(features))
+    ids = dict(zip(dict.fromkeys(flat), count()))
+    col = np.fromiter(map(ids.__getitem__, flat), np.int64, len(flat))
+    row = np.repeat(np.arange(n), np.fromiter(map(len, features), np.int64, n))
+    if counts is None:
+        weight = np.ones(len(flat))
+    else:
+        tf = np.fromiter(chain.from_iterable(counts), np.float64, len(flat))
+        weight = 1 + np.log(tf)
+    if idf:
+        weight *= np.log(n / np.bincount(col)[col])
+    if keep is not None:
+        strongest = _strongest(row, weight, keep)
+        row, col, weight = row[strongest], col[strongest], weight[strongest]
+    norms = np.sqrt(np.bincount(row, weight * weight, minlength=n))
+    nonzero = weight > 0
+    row, col = row[nonzero], col[nonzero]
+    return row, col, weight[nonzero] / norms[row], len(ids)
+
+
+def _features(posts: Sequence, terms: Dict[str, Terms]):
+    """COO arrays (row, feature, weight) of all parts, each scaled by its weight."""
+    text = [terms[p.path_title] for p in posts]
+    parts = (
+        (TEXT_WEIGHT, [t for t, _ in text], [c for _, c in text], True, KEYWORDS),
+        (TAG_WEIGHT, [tuple(dict.fromkeys(p.tags)) for p in posts], None, True, None),
+        (CATEGORY_WEIGHT, [(p.category,) for p in posts], None, False, None),
+    )
+    rows, cols, weights = [], [], []
+    offset = 0
+    for part_weight, features, counts, idf, keep in parts:
+        row, col, weight, size = _part(features, counts, idf, keep)
+        rows.append(row)
+        cols.append(col + offset)
+        weights.append(weight * math.sqrt(part_weight))
+        offset += size
+    return np.concatenate(rows), np.concatenate(cols), np.concatenate(weights)
+
+
+def _sparse_pairs(row, col, weight, n: int):
+    """Sorted unique left * n + right keys and summed products of shared features."""
+    order = np.argsort(col, kind="stable")
+    row, col, weight = row[order], col[order], weight[order]
+    starts = np.flatnonzero(np.r_[True, col[1:] != col[:-1]])
+    sizes = np.diff(np.r_[starts, len(col)])
+    # Every posting pairs up with each posting of the same feature.
+    per_posting = np.repeat(sizes, sizes)
+    first = np.repeat(starts, sizes)
+    left = np.repeat(np.arange(len(col)), per_posting)
+    within = np.arange(len(left)) - np.repeat(
+        np.cumsum(per_posting) - per_posting, per_posting
+    )
+    right = np.repeat(first, per_posting) + within
+    keys = row[left] * n + row[right]
+    values = weight[left] * weight[right]
+    order = np.argsort(keys)
+    keys, values = keys[order], values[order]
+    if not len(keys):
+        return keys, values
+    unique = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[unique], np.add.reduceat(values, unique)
+
+
+def _score_blocks(
+    posts: Sequence, terms: Dict[str, Terms], rows: np.ndarray
+) -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+    """
+    (block of rows, their scores against every post) for the sorted rows, at
+    most BLOCK at a time. A post scores 0 against itself.
+    """
+    n = len(posts)
+    row, col, weight = _features(posts, terms)
+    df = np.bincount(col)
+    dense_features = np.argsort(-df, kind="stable")[:DENSE_FEATURES]
+    dense_column = np.full(len(df), -1)
+    dense_column[dense_features] = np.arange(len(dense_features))
+    is_dense = dense_column[col] >= 0
+    dense = np.zeros((n, len(dense_features)), dtype=np.float32)
+    dense[row[is_dense], dense_column[col[is_dense]]] = weight[is_dense]
+    sparse = np.flatnonzero(~is_dense)
+    sparse = sparse[_strongest(col[sparse], weight[sparse], PAIR_DF_LIMIT)]
+    row, col, weight = row[sparse], col[sparse], weight[sparse]
+    # Only the features of rows pair up, and only their pairs are kept.
+    selected = np.zeros(n, dtype=bool)
+    selected[rows] = True
+    shared = np.zeros(len(df), dtype=bool)
+    shared[col[selected[row]]] = True
+    kept = shared[col]
+    keys, values = _sparse_pairs(row[kept], col[kept], weight[kept], n)
+    mine = selected[keys // n]
+    keys, values = keys[mine], values[mine]
+    for start in range(0, len(rows), BLOCK):
+        block = rows[start : start + BLOCK]
+        position = np.zeros(n, dtype=np.int64)
+        position[block] = np.arange(len(block))
+        scores = dense[block] @ dense.T
+        lo, hi = np.searchsorted(keys, [block[0] * n, (block[-1] + 1) * n])
+        scores[position[keys[lo:hi] // n], keys[lo:hi] % n] += values[lo:hi]
+        scores[np.arange(len(block)), block] = 0
+        yield block, scores
+
+
+def _top(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Columns and scores of the k highest scores of every row, best first."""
+    rows = np.arange(len(scores))
+    # k passes of argmax beat a partition for small k. Ties go to the lower
+    # index, the newer post.
+    best = np.empty((len(scores), k), dtype=np.int64)
+    best_scores = np.empty((len(scores), k), dtype=np.float32)
+    for i in range(k):
+        best[:, i] = scores.argmax(axis=1)
+        best_scores[:, i] = scores[rows, best[:, i]]
+        scores[rows, best[:, i]] = -1
+    return best, best_scores
+
+
+def scored_related(
+    posts: Sequence,
+    terms: Dict[str, Terms],
+    k: int = RELATED_K,
+    previous: Optional[Related] = None,
+    changed: Collection[str] = (),
+) -> Related:
+    """
+    The up to k most related posts of every post with their scores. Given the
+    previous result and the path titles changed since (edited, added or
+    removed), only the posts affected are rescored.
+    """
+    n = len(posts)
+    if n < 2:
+        return {p.path_title: [] for p in posts}
+    index = {p.path_title: i for i, p in enumerate(posts)}
+    if previous is None or len(changed) > RESCORE_SHARE * n:
+        rescored = np.arange(n)
+    else:
+        rescored = np.array(
+            [
+                i
+                for title, i in index.items()
+                if title in changed
+                or title not in previous
+                or any(r in changed for r, _ in previous[title])
+            ],
+            dtype=np.int64,
+        )
+        rescored.sort()
+    present = np.array(sorted(index[t] for t in changed if t in index), np.int64)
+    if len(rescored) == n:
+        present = present[:0]
+    rows = np.union1d(rescored, present)
+    titles = np.array([p.path_title for p in posts], dtype=object)
+    k = min(k, n - 1)
+    related = {}
+    # Scores of every post against the changed ones, columns in present order.
+    against = np.zeros((n, len(present)), dtype=np.float32)
+    for block, scores in _score_blocks(posts, terms, rows):
+        in_present = np.searchsorted(present, block)
+        found = in_present < len(present)
+        found[found] = present[in_present[found]] == block[found]
+        against[:, in_present[found]] = scores[found].T
+        wanted = np.isin(block, rescored)
+        best, best_scores = _top(scores[wanted], k)
+        for title, names, values in zip(
+            titles[block[wanted]], titles[best].tolist(), best_scores.tolist()
+        ):
+            related[title] = [(r, v) for r, v in zip(names, values) if v > 0]
+    # The others only change where a changed post now scores.
+    for i in np.flatnonzero((against > 0).any(axis=1)).tolist():
+        title = titles[i]
+        if title in related:
+            continue
+        candidates = previous[title] + [
+            (titles[c], float(v)) for c, v in zip(present, against[i]) if v > 0
+        ]
+        candidates.sort(key=lambda c: (-c[1], index[c[0]]))
+        related[title] = candidates[:k]
+    for title in index.keys() - related.keys():
+        related[title] = previous[title]
+    return related
+
+
+def related_posts(
+    posts: Sequence, terms: Dict[str, Terms], k: int = RELATED_K
+) -> Dict[str, List[str]]:
+    """path_title -> up to k most related path titles, best first."""
+    related = scored_related(posts, terms, k)
+    return {title: [r for r, _ in scores] for title, scores in related.items()}
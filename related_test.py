@@ -0,0 +1,138 @@
+from types import SimpleNamespace
+
+import related
+
+
+def make_posts(*posts):
+    """(path_title, tags, category, body) -> posts and their terms, newest first."""
+    parsed = [SimpleNamespace(path_title=p, tags=t, category=c) for p, t, c, _ in posts]
+    terms = {p: related.post_terms(body) for p, _, _, body in posts}
+    return parsed, terms
+
+
+def test_post_terms_skips_code_and_markup():
+    terms, counts = related.post_terms(
+        "Running kernels, more kernels. [link](http://example.com/ignored)\n"
+        "<img src=hidden.png>\n```python\nsecret = 1\n```\n"
+    )
+    assert dict(zip(terms, counts)) == {"kernel": 2, "run": 1, "more": 1, "link": 1}
+
+
+def test_related_posts_ranks_shared_text_and_tags():
+    posts, terms = make_posts(
+        (
+            "gpu",
+            ["cuda"],
+            "tech",
+            "Tuning cuda kernels on the gpu, kernels everywhere.",
+        ),
+        ("cake", ["food"], "life", "Baking a chocolate cake with butter."),
+        ("cuda", ["cuda"], "tech", "Writing cuda kernels for the gpu."),
+        ("bread", ["food"], "life", "Baking sourdough bread with butter."),
+        ("misc", [], "misc", "Nothing in common here."),
+    )
+    result = related.related_posts(posts, terms, k=2)
+    assert result["gpu"] == ["cuda"]
+    assert result["cake"] == ["bread"]
+    assert result["bread"] == ["cake"]
+    assert result["misc"] == []
+
+
+def test_related_posts_limits_k_and_prefers_newer_on_ties():
+    posts, terms = make_posts(
+        *((f"p{i}", ["same"], "tech", "Identical words here.") for i in range(6))
+    )
+    result = related.related_posts(posts, terms, k=3)
+    assert result["p0"] == ["p1", "p2", "p3"]
+    assert result["p5"] == ["p0", "p1", "p2"]
+    assert all(p not in result[p] for p in result)
+
+
+def test_related_posts_sparse_and_dense_paths_agree(monkeypatch):
+    posts, terms = make_posts(
+        *(
+            (
+                f"p{i}",
+                [f"t{i % 3}", f"u{i % 5}"],
+                f"c{i % 2}",
+                f"word{'abcd'[i % 4]} common",
+            )
+            for i in range(30)
+        )
+    )
+    dense = related.related_posts(posts, terms)
+    monkeypatch.setattr(related, "DENSE_FEATURES", 0)
+    monkeypatch.setattr(related, "PAIR_DF_LIMIT", 1000)
+    assert related.related_posts(posts, terms) == dense
+
+
+def corpus(n, edited=None):
+    """n posts in 3 categories, post edited (if any) shares no words."""
+    return make_posts(
+        *(
+            (
+                f"p{i}",
+                [f"t{i % 7}", f"u{i % 5}"],
+                f"c{i % 3}",
+                "edited words" if i == edited else f"word{i % 11} thing{i % 4} common",
+            )
+            for i in range(n)
+        )
+    )
+
+
+def names(scored):
+    """Path titles of a scored_related result or of one post's entry in it."""
+    if isinstance(scored, list):
+        return [r for r, _ in scored]
+    return {title: names(scores) for title, scores in scored.items()}
+
+
+def test_scored_related_rescores_only_affected_posts(monkeypatch):
+    posts, terms = corpus(60)
+    previous = related.scored_related(posts, terms)
+    posts, terms = corpus(60, edited=3)
+    scored_rows = []
+    score_blocks = related._score_blocks
+
+    def spy(posts, terms, rows):
+        scored_rows.append(rows.tolist())
+        return score_blocks(posts, terms, rows)
+
+    monkeypatch.setattr(related, "_score_blocks", spy)
+    updated = related.scored_related(posts, terms, previous=previous, changed={"p3"})
+    # The edited post and the ones it was related to.
+    linking = [i for i, p in enumerate(posts) if "p3" in names(previous)[p.path_title]]
+    assert linking and len(linking) < 20
+    assert scored_rows == [sorted({3, *linking})]
+    assert names(updated) == related.related_posts(posts, terms)
+
+
+def test_scored_related_drops_removed_posts():
+    posts, terms = corpus(60)
+    previous = related.scored_related(posts, terms)
+    del posts[3]
+    updated = related.scored_related(posts, terms, previous=previous, changed={"p3"})
+    assert "p3" not in updated
+    for title, scores in updated.items():
+        if "p3" in names(previous)[title]:
+            assert len(scores) == related.RELATED_K and "p3" not in names(scores)
+        else:
+            # Scores shift a little with document frequencies, until rescored.
+            assert scores == previous[title]
+
+
+def test_scored_related_rescores_everything_past_the_share(monkeypatch):
+    posts, terms = corpus(40)
+    previous = related.scored_related(posts, terms)
+    monkeypatch.setattr(related, "RESCORE_SHARE", 0.01)
+    scored_rows = []
+    score_blocks = related._score_blocks
+
+    def spy(posts, terms, rows):
+        scored_rows.append(len(rows))
+        return score_blocks(posts, terms, rows)
+
+    monkeypatch.setattr(related, "_score_blocks", spy)
+    related.scored_related(posts, terms, previous=previous, changed={"p1", "p2"})
+    assert scored_rows == [40]
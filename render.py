@@ -0,0 +1,107 @@
+"""
+Markdown to HTML rendering. Kept out of utils so that mistune and Pygments
+are only imported once something is actually rendered.
+"""
+
+import hashlib
+import mistune
+
+from functools import lru_cache
+from pygments import highlight
+from pygments.lexers import get_lexer_by_name
+from pygments.formatters import html
+
+import timing
+from utils import CONTENT_WIDTH, LRUCache, _md_plugins, get_image_manifest
+
+
+def wrap_code_in_details(code_block: str, summary: str) -> str:
+    return f"""<details class="code-block">
+    <summary class="code-summary">&nbsp;&nbsp;{summary}</summary>
+        {code_block}
+</details>"""
+
+
+_formatter = html.HtmlFormatter(style="solarized-light")
+_highlight_cache = LRUCache(8 * 1024 * 1024)
+
+
+@lru_cache(maxsize=None)
+def get_lexer(lang: str):
+    # Lexers keep no per-call state, one instance per language is enough.
+    return get_lexer_by_name("text" if lang == "ascii" else lang, stripall=True)
+
+
+class HighlightRenderer(mistune.HTMLRenderer):
+    def decorated_highlight(self, code: str, lang: str, summary: str) -> str:
+        key = (lang, summary, hashlib.sha256(code.encode("utf-8")).hexdigest())
+        cached = _highlight_cache.get(key)
+        if cached is not None:
+            return cached
+        with timing.phase("pygments"):
+            pygments_highlight = highlight(code, get_lexer(lang), _formatter)
+        # get everything between <pre>
+        i, j = (
+            pygments_highlight.find("<pre>") + len("<pre>"),
+            pygments_highlight.find("</pre>"),
+        )
+        code = pygments_highlight[i:j]
+        # add <code> element to correct place
+        i = len("<span></span>")
+        code = f"{code[:i]}<code{' style="line-height: 1;"' if lang == 'ascii' else ''}>{code[i:]}</code>"
+        code_block = f'''
+    <div class="highlight">
+        <pre class="code" data-lang="{lang}">{code}</pre>
+    </div>'''
+        if summary:
+            code_block = wrap_code_in_details(code_block, summary)
+        _highlight_cache.put(key, code_block)
+        return code_block
+
+    def block_code(self, code, info=None) -> str:
+        if info:
+            parts = info.strip().split(",")
+            lang = parts[0]
+            summary = parts[1] if len(parts) > 1 else None
+            return self.decorated_highlight(code, lang, summary)
+        return f"<pre><code>{mistune.escape(code)}</code></pre>"
+
+    def block_html(self, html) -> str:
+        return html
+
+    def heading(self, text, level):
+        tag = "h" + str(level)
+        tid = text.lower().replace(" ", "_")
+        link_icon = '<svg xmlns="http://www.w3.org/2000/svg" width="1em" height="1em" viewBox="0 0 8 8"><path fill="currentColor" d="M5.88.03a1.9 1.9 0 0 0-.53.09c-.27.1-.53.25-.75.47a.5.5 0 1 0 .69.69c.11-.11.24-.17.38-.22c.35-.12.78-.07 1.06.22c.39.39.39 1.04 0 1.44l-1.5 1.5c-.44.44-.8.48-1.06.47c-.26-.01-.41-.13-.41-.13a.5.5 0 1 0-.5.88s.34.22.84.25c.5.03 1.2-.16 1.81-.78l1.5-1.5A1.98 1.98 0 0 0 6.44.07C6.26.03 6.06.03 5.88.04zm-2 2.31c-.5-.02-1.19.15-1.78.75L.6 4.59a1.98 1.98 0 0 0 0 2.81c.56.56 1.36.72 2.06.47c.27-.1.53-.25.75-.47a.5.5 0 1 0-.69-.69c-.11.11-.24.17-.38.22c-.35.12-.78.07-1.06-.22c-.39-.39-.39-1.04 0-1.44l1.5-1.5c.4-.4.75-.45 1.03-.44c.28.01.47.09.47.09a.5.5 0 1 0 .44-.88s-.34-.2-.84-.22z"/></svg>'
+        link_anchor = f'<a class="hidden" tabindex="-1" href="#{tid}" style="font-size: .8rem">{link_icon}</a>'
+        return f'''<{tag} id="{tid}">{text}&nbsp;{link_anchor}</{tag}>\n'''
+
+    def image(self, alt, url, title=None):
+        """
+        title is repurposed to contain the following information separated by ;;
+            caption, percent_width
+        """
+        d = {}
+        if title:
+            d = {i: v for i, v in enumerate(title.split(";;"))}
+        caption = d.get(0, None)
+        percent_width = d.get(1, 100)
+        url = mistune.escape_url(url)
+        alt = mistune.escape(alt)
+        caption_html = (
+            f'<em class="text-gray">{mistune.escape(caption)}</em>' if caption else ""
+        )
+        entry = get_image_manifest()[0].get(url)
+        if entry is None:
+            return f'<p style="text-align: center"><img class="my-resp-img" src="{url}" alt="{alt}" style="width: {percent_width}%"/><br>{caption_html}</p>'
+        srcset = ", ".join(f'{v["url"]} {v["width"]}w' for v in entry["variants"])
+        try:
+            display_width = round(CONTENT_WIDTH * float(percent_width) / 100)
+        except ValueError:
+            display_width = CONTENT_WIDTH
+        sizes = f"(max-width: 768px) 90vw, {display_width}px"
+        return f'<p style="text-align: center"><img class="my-resp-img" src="{url}" srcset="{srcset}" sizes="{sizes}" width="{entry["width"]}" height="{entry["height"]}" loading="lazy" decoding="async" alt="{alt}" style="width: {percent_width}%; height: auto"/><br>{caption_html}</p>'
+
+
+def get_md_factory() -> "mistune.markdown.Markdown":
+    return mistune.create_markdown(renderer=HighlightRenderer(), plugins=_md_plugins)
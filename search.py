@@ -0,0 +1,224 @@
+"""
+Full-text search over posts. The index covers each post's title, subtitle,
+tags and rendered text, keeps term positions for phrase queries and ranks
+with BM25. The /search/ route queries it in memory, generate.py writes it as
+prefix shards that static/script/search.js fetches on the static site.
+"""
+
+import gc
+import html
+import json
+import math
+import os
+import re
+from functools import lru_cache
+from itertools import accumulate
+from typing import Iterable, List, Tuple
+
+from utils import PostsCache, render_markdown, write_if_changed
+
+SEARCH_INDEX_VERSION = 1
+# Shard files hold every term starting with the same SHARD_PREFIX characters.
+SHARD_PREFIX = 2
+# Added to a term's frequency per occurrence, so title and tag hits rank first.
+FIELD_WEIGHTS = {"title": 3, "subtitle": 2, "tags": 3, "text": 1}
+RESULTS_PER_PAGE = 10
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_word = re.compile(r"[^\W_]+")
+_html_tag = re.compile(r"<[^>]+>")
+_phrase = re.compile(r'"([^"]*)"')
+# Checked in order, first match wins. search.js has the same list.
+_suffixes = (
+    ("ies", "y"),
+    ("sses", "ss"),
+    ("ness", ""),
+    ("ing", ""),
+    ("ed", ""),
+    ("ly", ""),
+    ("s", ""),
+)
+
+
+@lru_cache(maxsize=65536)
+def stem(word: str) -> str:
+    """Strips one common English suffix, leaving at least three characters."""
+    for suffix, replacement in _suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= 3:
+            # "class", "status", "analysis" keep their s.
+            if suffix == "s" and word[-2] in "siu":
+                return word
+            stemmed = word[: -len(suffix)] + replacement
+            # "running" -> "run", "stopped" -> "stop".
+            if suffix in ("ing", "ed") and stemmed[-1] == stemmed[-2] not in "aeioulsz":
+                stemmed = stemmed[:-1]
+            return stemmed
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    return [stem(w) for w in _word.findall(text.lower())]
+
+
+def html_to_text(rendered: str) -> str:
+    return html.unescape(_html_tag.sub(" ", rendered))
+
+
+def shard_name(term: str) -> str:
+    """File name of the shard holding term, safe for any alphabet."""
+    return "".join(
+        c if c.isascii() and c.isalnum() else f"_{ord(c):x}"
+        for c in term[:SHARD_PREFIX]
+    )
+
+
+class SearchIndex:
+    """
+    docs are (path_title, title, subtitle, tags, date, text) tuples. Postings
+    map a term to flat [doc, weighted tf, position, ...] entries in doc order,
+    positions are delta encoded.
+    """
+
+    def __init__(self, docs: Iterable[Tuple[str, str, str, List[str], str, str]]):
+        self.docs = []
+        self.lengths = []
+        self.postings = {}
+        self.stems = {}
+        # Indexing allocates millions of small lists that never form cycles,
+        # pausing the collector meanwhile cuts build time by about a third.
+        paused = gc.isenabled()
+        gc.disable()
+        try:
+            for doc in docs:
+                self.add(*doc)
+        finally:
+            if paused:
+                gc.enable()
+        self.avg_length = sum(self.lengths) / len(self.lengths) if self.lengths else 1
+
+    def add(
+        self,
+        path_title: str,
+        title: str,
+        subtitle: str,
+        tags: List[str],
+        date: str,
+        text: str,
+    ):
+        doc_id = len(self.docs)
+        self.docs.append([path_title, title, subtitle, date])
+        stems = self.stems
+        entries = {}
+        last = {}
+        position = 0
+        fields = (title, subtitle, " ".join(tags), text)
+        for weight, value in zip(FIELD_WEIGHTS.values(), fields):
+            words = _word.findall(value.lower())
+            for word in set(words).difference(stems):
+                stems[word] = stem(word)
+            for term in map(stems.__getitem__, words):
+                entry = entries.get(term)
+                if entry is None:
+                    entries[term] = [doc_id, weight, position]
+                else:
+                    entry[1] += weight
+                    entry.append(position - last[term])
+                last[term] = position
+                position += 1
+            # Leave a gap so phrases never match across two fields.
+            position += 1
+        self.lengths.append(position)
+        for term, entry in entries.items():
+            postings = self.postings.get(term)
+            if postings is None:
+                self.postings[term] = [entry]
+            else:
+                postings.append(entry)
+
+    def search(self, query: str) -> List[Tuple[int, float]]:
+        """
+        (doc, score) for docs containing every query term and every quoted
+        phrase, best first. Ties keep doc order, which is newest first.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        postings = {}
+        for term in terms:
+            entries = self.postings.get(term)
+            if not entries:
+                return []
+            postings[term] = {e[0]: e for e in entries}
+        phrases = [p for p in map(tokenize, _phrase.findall(query)) if len(p) > 1]
+        smallest = min(postings.values(), key=len)
+        n = len(self.docs)
+        results = []
+        for doc in smallest:
+            if not all(doc in postings[t] for t in terms):
+                continue
+            if not all(self._has_phrase(postings, doc, p) for p in phrases):
+                continue
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[doc] / self.avg_length)
+            score = 0.0
+            for term in terms:
+                df = len(postings[term])
+                tf = postings[term][doc][1]
+                idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                score += idf * tf * (BM25_K1 + 1) / (tf + norm)
+            results.append((doc, score))
+        results.sort(key=lambda r: (-r[1], r[0]))
+        return results
+
+    @staticmethod
+    def _has_phrase(postings: dict, doc: int, phrase: List[str]) -> bool:
+        positions = [set(accumulate(postings[t][doc][2:])) for t in phrase]
+        return any(
+            all(start + i in positions[i] for i in range(1, len(phrase)))
+            for start in positions[0]
+        )
+
+    def page(self, query: str, page: int) -> Tuple[List[Tuple[int, float]], int]:
+        """One page of results and the total number of pages."""
+        results = self.search(query)
+        pages = max(1, math.ceil(len(results) / RESULTS_PER_PAGE))
+        start = (page - 1) * RESULTS_PER_PAGE
+        return results[start : start + RESULTS_PER_PAGE], pages
+
+    def write(self, directory: str) -> int:
+        """Writes docs.json plus one shard per term prefix, returns the shard count."""
+        shards = {}
+        for term, entries in self.postings.items():
+            shards.setdefault(shard_name(term), {})[term] = entries
+        os.makedirs(directory, exist_ok=True)
+        meta = {
+            "version": SEARCH_INDEX_VERSION,
+            "prefix": SHARD_PREFIX,
+            "k1": BM25_K1,
+            "b": BM25_B,
+            "per_page": RESULTS_PER_PAGE,
+            "docs": self.docs,
+            "lengths": self.lengths,
+            "avg_length": self.avg_length,
+        }
+        files = {"docs.json": meta}
+        files.update((f"{name}.json", shard) for name, shard in shards.items())
+        for name, data in files.items():
+            encoded = json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+            write_if_changed(os.path.join(directory, name), encoded.encode("utf-8"))
+        for name in os.listdir(directory):
+            if name.endswith(".json") and name not in files:
+                os.remove(os.path.join(directory, name))
+        return len(shards)
+
+
+def post_documents(posts: PostsCache):
+    for p in posts:
+        text = html_to_text(render_markdown(p.body()))
+        yield p.path_title, p.title, p.subtitle or "", p.tags, p.date, text
+
+
+@lru_cache(maxsize=1)
+def get_search_index(posts: PostsCache) -> SearchIndex:
+    """Built once per posts snapshot, doc ids are positions in posts.cache."""
+    return SearchIndex(post_documents(posts))
@@ -0,0 +1,79 @@
+import json
+import pytest
+
+import search
+
+
+@pytest.fixture
+def index():
+    return search.SearchIndex(
+        [
+            (
+                "a",
+                "Private Cloud",
+                "",
+                ["k8s"],
+                "2024-03-01",
+                "Running pods on a rack.",
+            ),
+            (
+                "b",
+                "Dark Mode",
+                "",
+                ["CSS"],
+                "2024-02-01",
+                "Cloud colors, private notes.",
+            ),
+            ("c", "Rust Tracing", "", ["Rust"], "2024-01-01", "Rays and classes."),
+        ]
+    )
+
+
+def test_tokenize_stems_and_lowercases():
+    assert search.tokenize("Running CLASSES, pods & analysis_x") == [
+        "run",
+        "class",
+        "pod",
+        "analysis",
+        "x",
+    ]
+    assert search.stem("stories") == "story"
+    assert search.stem("called") == "call"
+    assert search.stem("is") == "is"
+
+
+def test_search_requires_every_term_and_ranks_titles_first(index):
+    assert [d for d, _ in index.search("cloud")] == [0, 1]
+    assert [d for d, _ in index.search("private cloud")] == [0, 1]
+    assert index.search("cloud rust") == []
+    assert index.search("") == []
+    # Stemmed on both sides.
+    assert [d for d, _ in index.search("pod run")] == [0]
+
+
+def test_phrase_query_uses_positions(index):
+    assert [d for d, _ in index.search('"private cloud"')] == [0]
+    assert [d for d, _ in index.search('"cloud colors"')] == [1]
+    # Phrases do not span fields.
+    assert index.search('"tracing rust"') == []
+
+
+def test_page(index, monkeypatch):
+    monkeypatch.setattr(search, "RESULTS_PER_PAGE", 1)
+    assert index.page("cloud", 1) == (index.search("cloud")[:1], 2)
+    assert index.page("cloud", 2) == (index.search("cloud")[1:], 2)
+    assert index.page("cloud", 3) == ([], 2)
+
+
+def test_write_shards_by_prefix(index, tmp_path):
+    (tmp_path / "stale.json").write_text("{}")
+    shards = index.write(str(tmp_path))
+    files = {p.name for p in tmp_path.iterdir()}
+    assert "stale.json" not in files
+    assert len(files) == shards + 1
+    meta = json.loads((tmp_path / "docs.json").read_text())
+    assert meta["docs"][0] == ["a", "Private Cloud", "", "2024-03-01"]
+    shard = json.loads((tmp_path / f"{search.shard_name('cloud')}.json").read_text())
+    assert set(shard) == {t for t in index.postings if t.startswith("cl")}
+    assert shard["cloud"] == index.postings["cloud"]
+    assert search.shard_name("über") == "_fcb"
@@ -0,0 +1,278 @@
+"""
+Production serving. Every URL the freezer knows about is rendered up front by
+a pool of processes, then N workers are forked off a shared listening socket
+and answer those URLs from memory, sharing the pages copy-on-write. Anything
+else (search queries, redirects, 404s) falls through to the Flask app.
+
+SIGHUP re-renders everything and rotates in a new set of workers, the old ones
+finish their current request and exit. SIGTERM/SIGINT stop the server.
+"""
+
+import argparse
+import gc
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from typing import Dict
+from urllib.parse import unquote
+
+from werkzeug.serving import WSGIRequestHandler, make_server
+from werkzeug.wrappers import Request, Response
+
+from app import app
+from generate import freezer
+from utils import COMPRESSIBLE_MIMETYPES, available_encodings, compress
+
+# bodies maps a content encoding to the bytes, "identity" is always there.
+Rendered = namedtuple("Rendered", ["status", "headers", "mimetype", "bodies"])
+
+# Recomputed per response or per encoding when serving.
+_DROPPED_HEADERS = {"content-length", "content-encoding", "vary", "date"}
+
+
+def _render(url: str):
+    response = app.test_client().get(url)
+    if response.status_code != 200:
+        return url, None
+    data = response.get_data()
+    bodies = {"identity": data}
+    if (
+        response.mimetype in COMPRESSIBLE_MIMETYPES
+        and len(data) >= app.config["COMPRESS_MIN_SIZE"]
+    ):
+        for encoding in available_encodings():
+            compressed = compress(data, encoding)
+            if len(compressed) < len(data):
+                bodies[encoding] = compressed
+    headers = [(k, v) for k, v in response.headers if k.lower() not in _DROPPED_HEADERS]
+    return url, Rendered(response.status_code, headers, response.mimetype, bodies)
+
+
+def _default_signals():
+    # Pool.terminate() stops its workers with SIGTERM, which Master catches.
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP):
+        signal.signal(signum, signal.SIG_DFL)
+
+
+def prerender(workers: int = 1) -> Dict[str, Rendered]:
+    """Path -> Rendered for every URL the freezer would write."""
+    urls = list(dict.fromkeys(freezer.all_urls()))
+    if workers > 1:
+        ctx = multiprocessing.get_context("fork")
+        with ctx.Pool(workers, initializer=_default_signals) as pool:
+            chunksize = max(1, len(urls) // (workers * 4))
+            results = pool.map(_render, urls, chunksize=chunksize)
+    else:
+        results = map(_render, urls)
+    return {unquote(url): page for url, page in results if page is not None}
+
+
+class MemorySite:
+    """WSGI app answering pre-rendered pages, fallback gets everything else."""
+
+    def __init__(self, pages: Dict[str, Rendered], fallback):
+        self.pages = pages
+        self.fallback = fallback
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        page = None
+        if request.method in ("GET", "HEAD") and not request.query_string:
+            page = self.pages.get(request.path)
+        if page is None:
+            return self.fallback(environ, start_response)
+        encoding = None
+        if len(page.bodies) > 1:
+            encoding = request.accept_encodings.best_match(
+                [e for e in page.bodies if e != "identity"]
+            )
+        response = Response(
+            page.bodies[encoding or "identity"],
+            status=page.status,
+            headers=page.headers,
+            mimetype=page.mimetype,
+        )
+        if len(page.bodies) > 1:
+            response.vary.add("Accept-Encoding")
+        if encoding:
+            response.headers["Content-Encoding"] = encoding
+            etag, weak = response.get_etag()
+            if etag and not weak:
+                # Same resource, different bytes.
+                response.set_etag(etag, weak=True)
+        return response.make_conditional(request)(environ, start_response)
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def run_worker(sock: socket.socket, site: MemorySite, access_log: bool):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    host, port = sock.getsockname()[:2]
+    server = make_server(
+        host,
+        port,
+        site,
+        request_handler=None if access_log else QuietHandler,
+        fd=sock.fileno(),
+    )
+
+    def stop(signum, frame):
+        # shutdown() waits for serve_forever, which runs on this very thread.
+        threading.Thread(target=server.shutdown).start()
+
+    signal.signal(signal.SIGTERM, stop)
+    server.serve_forever()
+
+
+class Master:
+    """Owns the listening socket, the pre-rendered pages and the workers."""
+
+    def __init__(
+        self,
+        sock: socket.socket,
+        workers: int,
+        render_workers: int,
+        access_log: bool = False,
+    ):
+        self.sock = sock
+        self.workers = workers
+        self.render_workers = render_workers
+        self.access_log = access_log
+        self.pages = {}
+        # pid -> generation, only the current generation is respawned.
+        self.children = {}
+        self.generation = 0
+        self.rewarm = False
+        self.stopping = False
+
+    def warm(self):
+        started = time.perf_counter()
+        gc.unfreeze()
+        self.pages = {}
+        gc.collect()
+        self.pages = prerender(self.render_workers)
+        # Keeps the collector from writing to, and so copying, shared pages.
+        gc.freeze()
+        size = sum(len(b) for p in self.pages.values() for b in p.bodies.values())
+        print(
+            f"serve: {len(self.pages)} pages ({size / 2**20:.1f} MiB) "
+            f"pre-rendered in {time.perf_counter() - started:.1f}s",
+            flush=True,
+        )
+
+    def spawn(self):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(self.sock, MemorySite(self.pages, app), self.access_log)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = self.generation
+
+    def rotate(self):
+        old = list(self.children)
+        self.generation += 1
+        self.warm()
+        for _ in range(self.workers):
+            self.spawn()
+        for pid in old:
+            self.kill(pid)
+        print(f"serve: generation {self.generation} started", flush=True)
+
+    def kill(self, pid: int):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+
+    def reap(self):
+        while self.children:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                return
+            generation = self.children.pop(pid, None)
+            if generation == self.generation and not self.stopping:
+                print(f"serve: worker {pid} exited ({status}), respawning", flush=True)
+                self.spawn()
+
+    def run(self):
+        def request_rewarm(signum, frame):
+            self.rewarm = True
+
+        def request_stop(signum, frame):
+            self.stopping = True
+
+        signal.signal(signal.SIGHUP, request_rewarm)
+        signal.signal(signal.SIGTERM, request_stop)
+        signal.signal(signal.SIGINT, request_stop)
+        self.warm()
+        for _ in range(self.workers):
+            self.spawn()
+        host, port = self.sock.getsockname()[:2]
+        print(f"serve: {self.workers} workers on http://{host}:{port}/", flush=True)
+        while not self.stopping:
+            if self.rewarm:
+                self.rewarm = False
+                self.rotate()
+            self.reap()
+            time.sleep(0.2)
+        for pid in self.children:
+            self.kill(pid)
+        for pid in list(self.children):
+            os.waitpid(pid, 0)
+        self.children.clear()
+
+
+def listen(host: str, port: int) -> socket.socket:
+    sock = socket.create_server((host, port), backlog=1024)
+    # Workers poll the shared socket, the ones losing the race to accept()
+    # a connection must not block, or they'd miss a shutdown.
+    sock.setblocking(False)
+    sock.set_inheritable(True)
+    return sock
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("-p", "--port", type=int, default=8000)
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of serving processes",
+    )
+    parser.add_argument(
+        "--render-workers",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="number of processes pre-rendering pages at boot and on SIGHUP",
+    )
+    parser.add_argument("--pid-file", default=".serve.pid")
+    parser.add_argument("--access-log", action="store_true")
+    args = parser.parse_args()
+    with open(args.pid_file, "w") as f:
+        f.write(str(os.getpid()))
+    try:
+        Master(
+            listen(args.host, args.port),
+            args.workers,
+            args.render_workers,
+            args.access_log,
+        ).run()
+    finally:
+        os.remove(args.pid_file)
@@ -0,0 +1,53 @@
+import gzip
+import pytest
+from unittest.mock import patch
+from werkzeug.test import Client
+
+import serve
+from app import app
+
+
+@pytest.fixture(scope="module")
+def pages():
+    return serve.prerender()
+
+
+@pytest.fixture
+def client(pages):
+    return Client(serve.MemorySite(pages, app))
+
+
+def test_prerender_covers_frozen_routes(pages):
+    assert {"/", "/feed.xml", "/sitemap.xml", "/search/"} <= set(pages)
+    assert "/blog/post/Mini-Rack/" in pages
+    assert any(path.startswith("/static/") for path in pages)
+    page = pages["/"]
+    assert page.status == 200
+    assert gzip.decompress(page.bodies["gzip"]) == page.bodies["identity"]
+
+
+def test_pages_served_without_rendering(client, pages):
+    with patch("app.render_template", side_effect=AssertionError("rendered")):
+        response = client.get("/blog/post/Mini-Rack/")
+        assert response.status_code == 200
+        assert response.data == pages["/blog/post/Mini-Rack/"].bodies["identity"]
+        cached = client.get(
+            "/blog/post/Mini-Rack/",
+            headers={"If-None-Match": response.headers["ETag"]},
+        )
+        assert cached.status_code == 304
+
+
+def test_pages_negotiate_encoding(client):
+    response = client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert "Accept-Encoding" in response.headers["Vary"]
+    assert response.headers["ETag"].startswith("W/")
+    assert b"</html>" in gzip.decompress(response.data)
+    assert "Content-Encoding" not in client.get("/").headers
+
+
+def test_other_requests_fall_back_to_app(client):
+    assert client.get("/search/?q=rack").status_code == 200
+    assert client.get("/page/1/").status_code == 308
+    assert client.get("/blog/post/missing/").status_code == 404
@@ -1,37 +1,52 @@
 import init, { PlayerWASM } from '/static/wasm/cosmo/cosmo.js';
 await init();
-async function readScene(name) {
-    try {
-        const response = await fetch('/static/cosmo_scenes/' + name + '.cos');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
-        }
-        const text = await response.text();
-        return text.split('\n').map(line => line.trim());
-    } catch (error) {
-        console.error('Error fetching or reading the scene file (.cos):', error);
+// Scenes and meshes of every display on the page come in one gzip bundle,
+// written by cosmo.py. Meshes are indexed there and rebuilt into binary STL.
+async function readBundle(url) {
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`HTTP error! status: ${response.status}`);
     }
+    const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+    const buffer = await new Response(stream).arrayBuffer();
+    const headerLength = new DataView(buffer).getUint32(0, true);
+    const header = JSON.parse(new TextDecoder().decode(new Uint8Array(buffer, 4, headerLength)));
+    return { header: header, buffer: buffer, base: 4 + headerLength };
 }
 
-async function readSTL(name) {
-    try {
-        const response = await fetch('/static/cosmo_scenes/' + name + '.stl');
-        if (!response.ok) {
-            throw new Error(`HTTP error! status: ${response.status}`);
+function meshToSTL(bundle, mesh) {
+    const offset = bundle.base + mesh.offset;
+    const n = mesh.triangle_count;
+    const vertices = new Float32Array(bundle.buffer, offset + mesh.vertices, mesh.vertex_count * 3);
+    const normals = new Float32Array(bundle.buffer, offset + mesh.normals, n * 3);
+    const Indices = mesh.index_size === 2 ? Uint16Array : Uint32Array;
+    const indices = new Indices(bundle.buffer, offset + mesh.indices, n * 3);
+    const stl = new ArrayBuffer(84 + 50 * n);
+    const out = new DataView(stl);
+    out.setUint32(80, n, true);
+    for (let t = 0; t < n; ++t) {
+        let at = 84 + 50 * t;
+        for (let k = 0; k < 3; ++k, at += 4) {
+            out.setFloat32(at, normals[t * 3 + k], true);
+        }
+        for (let v = 0; v < 3; ++v) {
+            const i = indices[t * 3 + v];
+            for (let k = 0; k < 3; ++k, at += 4) {
+                out.setFloat32(at, vertices[i * 3 + k], true);
+            }
         }
-        const arrayBuffer = await response.arrayBuffer();
-        return new Uint8Array(arrayBuffer);
-    } catch (error) {
-        console.error('Error fetching or reading the STL file:', error);
     }
+    return new Uint8Array(stl);
 }
 
-async function readSTLs(names) {
-    var result = [];
-    for (const name of names) {
-        result.push(await readSTL(name));
-    }
-    return result;
+let bundlePromise = null;
+
+function readScene(name) {
+    return bundlePromise.then(bundle => bundle.header.scenes[name].split('\n').map(line => line.trim()));
+}
+
+function readSTLs(names) {
+    return bundlePromise.then(bundle => names.map(name => meshToSTL(bundle, bundle.header.meshes[name])));
 }
 
 function startCosmo(displayEle, player) {
@@ -72,6 +87,8 @@ function loadCosmo() {
         return;
     }
     console.log('loading cosmo...')
+    bundlePromise = readBundle(document.getElementById('cosmo-bundle').href);
+    bundlePromise.catch(error => console.error('Error fetching or reading the cosmo bundle:', error));
     let displayEles = document.getElementsByClassName('cosmo-display');
     for (let i = 0; i < displayEles.length; ++i) {
         prepareCosmo(displayEles[i]);
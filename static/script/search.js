@@ -0,0 +1,134 @@
+// Client side of search.py for the static site: fetches docs.json and only the
+// shards holding the query's terms, then matches and ranks like SearchIndex.search.
+
+const SEARCH_SUFFIXES = [["ies", "y"], ["sses", "ss"], ["ness", ""], ["ing", ""], ["ed", ""], ["ly", ""], ["s", ""]];
+
+function search_stem(word) {
+    for (const [suffix, replacement] of SEARCH_SUFFIXES) {
+        if (word.endsWith(suffix) && word.length - suffix.length >= 3) {
+            if (suffix === "s" && "siu".includes(word[word.length - 2])) return word;
+            let stemmed = word.slice(0, -suffix.length) + replacement;
+            // "running" -> "run", "stopped" -> "stop".
+            const last = stemmed[stemmed.length - 1];
+            if ((suffix === "ing" || suffix === "ed") && last === stemmed[stemmed.length - 2] && !"aeioulsz".includes(last)) {
+                stemmed = stemmed.slice(0, -1);
+            }
+            return stemmed;
+        }
+    }
+    return word;
+}
+
+function search_tokenize(text) {
+    return (text.toLowerCase().match(/[\p{L}\p{N}]+/gu) || []).map(search_stem);
+}
+
+function search_shard_name(term, prefix) {
+    return Array.from(term).slice(0, prefix).map(
+        c => /^[a-z0-9]$/.test(c) ? c : "_" + c.codePointAt(0).toString(16)
+    ).join("");
+}
+
+function search_positions(entry) {
+    // Positions after the doc id and weighted tf are delta encoded.
+    const positions = new Set();
+    let position = 0;
+    for (let i = 2; i < entry.length; i++) {
+        position += entry[i];
+        positions.add(position);
+    }
+    return positions;
+}
+
+function search_has_phrase(postings, doc, phrase) {
+    const positions = phrase.map(t => search_positions(postings[t].get(doc)));
+    for (const start of positions[0]) {
+        if (positions.every((p, i) => p.has(start + i))) return true;
+    }
+    return false;
+}
+
+async function search_query(root, query) {
+    const meta = await (await fetch(root + "docs.json")).json();
+    const terms = [...new Set(search_tokenize(query))];
+    if (terms.length === 0) return [meta, []];
+    const names = [...new Set(terms.map(t => search_shard_name(t, meta.prefix)))];
+    const shards = {};
+    await Promise.all(names.map(async name => {
+        const response = await fetch(root + name + ".json");
+        shards[name] = response.ok ? await response.json() : {};
+    }));
+    const postings = {};
+    for (const term of terms) {
+        const entries = shards[search_shard_name(term, meta.prefix)][term];
+        if (!entries) return [meta, []];
+        postings[term] = new Map(entries.map(e => [e[0], e]));
+    }
+    const phrases = [...query.matchAll(/"([^"]*)"/g)].map(m => search_tokenize(m[1])).filter(p => p.length > 1);
+    const n = meta.docs.length;
+    const results = [];
+    for (const doc of postings[terms[0]].keys()) {
+        if (!terms.every(t => postings[t].has(doc))) continue;
+        if (!phrases.every(p => search_has_phrase(postings, doc, p))) continue;
+        const norm = meta.k1 * (1 - meta.b + meta.b * meta.lengths[doc] / meta.avg_length);
+        let score = 0;
+        for (const term of terms) {
+            const df = postings[term].size;
+            const tf = postings[term].get(doc)[1];
+            const idf = Math.log(1 + (n - df + 0.5) / (df + 0.5));
+            score += idf * tf * (meta.k1 + 1) / (tf + norm);
+        }
+        results.push([doc, score]);
+    }
+    results.sort((a, b) => b[1] - a[1] || a[0] - b[0]);
+    return [meta, results];
+}
+
+function search_page_link(query, page, rel, text) {
+    const link = document.createElement("a");
+    link.rel = rel;
+    link.href = "?q=" + encodeURIComponent(query) + "&page=" + page;
+    link.textContent = text;
+    return link;
+}
+
+async function search_render(container, query, page) {
+    const [meta, results] = await search_query(container.dataset.index, query);
+    const pages = Math.max(1, Math.ceil(results.length / meta.per_page));
+    if (results.length === 0) {
+        const empty = document.createElement("p");
+        empty.append("No posts match ", Object.assign(document.createElement("em"), { textContent: query }), ".");
+        container.append(empty);
+        return;
+    }
+    const list = document.createElement("ul");
+    for (const [doc] of results.slice((page - 1) * meta.per_page, page * meta.per_page)) {
+        const [path_title, title, subtitle, date] = meta.docs[doc];
+        const item = document.createElement("li");
+        const link = document.createElement("a");
+        link.href = "/blog/post/" + path_title + "/";
+        link.textContent = title + " " + subtitle;
+        const small = document.createElement("small");
+        small.className = "text-gray";
+        small.textContent = date.split(" ")[0];
+        item.append(link, " ", small);
+        list.append(item);
+    }
+    container.append(list);
+    if (pages > 1) {
+        const nav = document.createElement("p");
+        if (page > 1) nav.append(search_page_link(query, page - 1, "prev", "← previous"), " ");
+        nav.append(Object.assign(document.createElement("small"), { className: "text-gray", textContent: `page ${page} of ${pages}` }));
+        if (page < pages) nav.append(" ", search_page_link(query, page + 1, "next", "next →"));
+        container.append(nav);
+    }
+}
+
+document.addEventListener("DOMContentLoaded", function () {
+    const container = document.getElementById("search-results");
+    const params = new URLSearchParams(window.location.search);
+    const query = (params.get("q") || "").trim();
+    if (!container || container.dataset.served || !query) return;
+    document.getElementById("search-input").value = query;
+    search_render(container, query, Math.max(1, parseInt(params.get("page")) || 1));
+});
@@ -0,0 +1,129 @@
+"""
+Opt-in per-request phase timings. app.py starts a recording per request when
+BLOG_TIMING=1, code on the request path wraps its stages in phase() or
+@timed(), and the totals end up in a Server-Timing header and in the
+histograms served on /_metrics (with BLOG_METRICS=1). Without a recording a
+phase costs one ContextVar lookup.
+"""
+
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from typing import Dict, Optional
+
+# Upper bounds in seconds, Prometheus adds +Inf.
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar("phases", default=None)
+
+
+def start() -> Dict[str, float]:
+    """Starts recording phases in the current context."""
+    phases = {}
+    _phases.set(phases)
+    return phases
+
+
+def stop():
+    _phases.set(None)
+
+
+def add(name: str, seconds: float):
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+class phase:
+    """Times the with block as name. Phases nest, an outer one includes inner ones."""
+
+    __slots__ = ("name", "phases", "started")
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def __enter__(self):
+        self.phases = _phases.get()
+        if self.phases is not None:
+            self.started = time.perf_counter()
+
+    def __exit__(self, *exc):
+        if self.phases is not None:
+            elapsed = time.perf_counter() - self.started
+            self.phases[self.name] = self.phases.get(self.name, 0.0) + elapsed
+
+
+def timed(name: str):
+    """Decorator form of phase()."""
+
+    def decorator(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            phases = _phases.get()
+            if phases is None:
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                phases[name] = phases.get(name, 0.0) + elapsed
+
+        return wrapper
+
+    return decorator
+
+
+def server_timing(phases: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={s * 1000:.2f}" for name, s in phases.items())
+
+
+class Histograms:
+    """Cumulative latency histograms per (route, phase), in Prometheus terms."""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        # (route, phase) -> [count per bucket..., +Inf count, sum]
+        self.series = {}
+        self.lock = threading.Lock()
+
+    def observe(self, route: str, phases: Dict[str, float]):
+        with self.lock:
+            for name, seconds in phases.items():
+                series = self.series.get((route, name))
+                if series is None:
+                    series = self.series[(route, name)] = [0] * (
+                        len(self.buckets) + 1
+                    ) + [0.0]
+                for i, bound in enumerate(self.buckets):
+                    if seconds <= bound:
+                        series[i] += 1
+                series[-2] += 1
+                series[-1] += seconds
+
+    def clear(self):
+        with self.lock:
+            self.series.clear()
+
+    def prometheus(self) -> str:
+        lines = [
+            "# HELP blog_phase_seconds Time spent per request phase.",
+            "# TYPE blog_phase_seconds histogram",
+        ]
+        with self.lock:
+            for (route, name), series in sorted(self.series.items()):
+                labels = f'route="{route}",phase="{name}"'
+                bounds = [f"{b:g}" for b in self.buckets] + ["+Inf"]
+                for bound, count in zip(bounds, series):
+                    lines.append(
+                        f'blog_phase_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines.append(f"blog_phase_seconds_sum{{{labels}}} {series[-1]:.6f}")
+                lines.append(f"blog_phase_seconds_count{{{labels}}} {series[-2]}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Histograms()
+# Set to a dict by generate.py --timings, collects path -> phases per frozen page.
+pages: Optional[Dict[str, Dict[str, float]]] = None
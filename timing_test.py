@@ -0,0 +1,41 @@
+import timing
+
+
+def test_phases_only_recorded_while_started():
+    @timing.timed("work")
+    def work():
+        with timing.phase("inner"):
+            pass
+        return 1
+
+    assert work() == 1
+    phases = timing.start()
+    try:
+        work()
+        work()
+        timing.add("extra", 0.5)
+    finally:
+        timing.stop()
+    work()
+    assert set(phases) == {"work", "inner", "extra"}
+    assert phases["work"] >= phases["inner"]
+    assert phases["extra"] == 0.5
+
+
+def test_server_timing_header():
+    header = timing.server_timing({"markdown": 0.0123, "total": 0.02})
+    assert header == "markdown;dur=12.30, total;dur=20.00"
+
+
+def test_histograms_prometheus_format():
+    metrics = timing.Histograms(buckets=(0.01, 0.1))
+    metrics.observe("post", {"total": 0.005})
+    metrics.observe("post", {"total": 0.05})
+    metrics.observe("post", {"total": 1.0})
+    text = metrics.prometheus()
+    assert "# TYPE blog_phase_seconds histogram" in text
+    assert 'blog_phase_seconds_bucket{route="post",phase="total",le="0.01"} 1' in text
+    assert 'blog_phase_seconds_bucket{route="post",phase="total",le="0.1"} 2' in text
+    assert 'blog_phase_seconds_bucket{route="post",phase="total",le="+Inf"} 3' in text
+    assert 'blog_phase_seconds_count{route="post",phase="total"} 3' in text
+    assert 'blog_phase_seconds_sum{route="post",phase="total"} 1.055000' in text
@@ -1,31 +1,68 @@
 import os
+import re
+import subprocess
 import sys
-import mistune
 import time
+import hashlib
+import threading
+import gzip
+import json
+import logging
 
 from datetime import datetime
-from collections import namedtuple, Counter
+from collections import namedtuple, Counter, OrderedDict
 from flask.helpers import url_for
-from pygments import highlight
-from pygments.lexers import get_lexer_by_name
-from pygments.formatters import html
-from typing import List, Tuple, Optional
-from dataclasses import dataclass
+from typing import Dict, FrozenSet, List, Tuple, Optional
+from contextlib import suppress
+from dataclasses import dataclass, field, fields, replace
+from functools import lru_cache
 
+import zstandard
 
-@dataclass
+import timing
+
+
+class PostSource:
+    """Where a post's markdown body starts on disk, read back on demand."""
+
+    __slots__ = ("path", "offset")
+
+    def __init__(self, path: str, offset: int):
+        self.path = path
+        self.offset = offset
+
+    def read(self) -> str:
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            return f.read().decode("utf-8")
+
+
+@dataclass(slots=True)
 class ParsedPost:
+    """
+    Posts loaded by PostsCache only hold their front matter, content is None
+    and body() reads the markdown from source when the post is rendered.
+    """
+
     title: str
     subtitle: str
     path_title: str
     date: str
     tags: list
     category: str
-    content: str
+    content: Optional[str]
     enable_cosmo: bool
     thumbnail: Optional[str]
     prev: Optional[str]
     next: Optional[str]
+    # Path titles of the most related posts, set per snapshot like prev/next.
+    related: list = field(default_factory=list)
+    source: Optional[PostSource] = field(default=None, repr=False, compare=False)
+
+    def body(self) -> str:
+        if self.content is not None:
+            return self.content
+        return self.source.read()
 
 
 _post_metadata_template = """---
@@ -38,75 +75,204 @@ thumbnail:
 """
 
 
-def wrap_code_in_details(code_block: str, summary: str) -> str:
-    return f"""<details class="code-block">
-    <summary class="code-summary">&nbsp;&nbsp;{summary}</summary>
-        {code_block}
-</details>"""
+class LRUCache:
+    """Thread-safe string LRU capped at max_bytes, with hit/miss/eviction counters."""
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key) -> Optional[str]:
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value: str):
+        with self.lock:
+            if key in self.entries:
+                return
+            self.entries[key] = value
+            # Counted in characters, close enough for mostly-ASCII HTML.
+            self.size += len(value)
+            while self.size > self.max_bytes and len(self.entries) > 1:
+                _, old = self.entries.popitem(last=False)
+                self.size -= len(old)
+                self.evictions += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+            }
+
+
+# Written by images.py at freeze time.
+IMAGE_DIR = os.environ.get("BLOG_IMAGE_DIR", ".cache/images")
+IMAGE_WIDTHS = (480, 960, 1440)
+# Width of the post column on desktop, for the sizes attribute.
+CONTENT_WIDTH = 640
+_image_manifest = (None, {}, "")
+
+
+def get_image_manifest() -> Tuple[dict, str]:
+    """The image manifest and a digest of it, reloaded when the file changes."""
+    global _image_manifest
+    path = os.path.join(IMAGE_DIR, "manifest.json")
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except OSError:
+        return {}, ""
+    if _image_manifest[0] != mtime:
+        with open(path, "rb") as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()[:16]
+        _image_manifest = (mtime, json.loads(data), digest)
+    return _image_manifest[1], _image_manifest[2]
+
+
+# Bump whenever HighlightRenderer output changes, so cached HTML is discarded.
+RENDERER_VERSION = "1"
+_md_plugins = ["strikethrough", "footnotes", "math"]
+
+
+def renderer_version() -> str:
+    """Everything besides the markdown source that rendered HTML depends on."""
+    return f"{RENDERER_VERSION}:{','.join(_md_plugins)}:{get_image_manifest()[1]}"
+
+
+# What HighlightRenderer and the math plugin leave in rendered HTML, per page
+# feature that layout.html loads assets for. Code blocks escape quotes, so
+# these never match inside one.
+FEATURE_MARKERS = {
+    "code": ('<div class="highlight">',),
+    "details": ('<details class="code-block">',),
+    "math": ('<div class="math">', '<span class="math">'),
+    "cosmo": ('class="cosmo-display"',),
+    "image": ("<img ",),
+}
+
+
+@lru_cache(maxsize=256)
+def page_features(html: str) -> FrozenSet[str]:
+    """
+    Features rendered HTML uses. Read off the output rather than recorded
+    while rendering, so pages served from the render cache get them too.
+    """
+    return frozenset(
+        feature
+        for feature, markers in FEATURE_MARKERS.items()
+        if any(marker in html for marker in markers)
+    )
 
 
-class HighlightRenderer(mistune.HTMLRenderer):
-    def decorated_highlight(self, code: str, lang: str, summary: str) -> str:
-        lexer = get_lexer_by_name("text" if lang == "ascii" else lang, stripall=True)
-        formatter = html.HtmlFormatter(style="solarized-light")
-        pygments_highlight = highlight(code, lexer, formatter)
-        # get everything between <pre>
-        i, j = (
-            pygments_highlight.find("<pre>") + len("<pre>"),
-            pygments_highlight.find("</pre>"),
-        )
-        code = pygments_highlight[i:j]
-        # add <code> element to correct place
-        i = len("<span></span>")
-        code = f"{code[:i]}<code{' style="line-height: 1;"' if lang == 'ascii' else ''}>{code[i:]}</code>"
-        code_block = f'''
-    <div class="highlight">
-        <pre class="code" data-lang="{lang}">{code}</pre>
-    </div>'''
-        if summary:
-            return wrap_code_in_details(code_block, summary)
-        return code_block
-
-    def block_code(self, code, info=None) -> str:
-        if info:
-            parts = info.strip().split(",")
-            lang = parts[0]
-            summary = parts[1] if len(parts) > 1 else None
-            return self.decorated_highlight(code, lang, summary)
-        return f"<pre><code>{mistune.escape(code)}</code></pre>"
-
-    def block_html(self, html) -> str:
+class RenderCache:
+    """
+    Rendered HTML keyed by a hash of the markdown source and renderer config.
+    An in-process LRU capped at max_bytes sits in front of an optional
+    diskcache directory, so restarted or forked workers start warm.
+    """
+
+    def __init__(self, max_bytes: int, directory: Optional[str] = None):
+        self.lru = LRUCache(max_bytes)
+        self.directory = directory
+        self.disk_hits = 0
+        self._disk = None
+        self._disk_pid = None
+
+    @staticmethod
+    def key(md: str) -> str:
+        h = hashlib.sha256(f"{renderer_version()}\n".encode())
+        h.update(md.encode("utf-8"))
+        return h.hexdigest()
+
+    def disk(self) -> Optional["diskcache.Cache"]:
+        if not self.directory:
+            return None
+        # sqlite handles must not be shared across fork, reopen in the child.
+        if self._disk_pid != os.getpid():
+            import diskcache
+
+            self._disk = diskcache.Cache(self.directory)
+            self._disk_pid = os.getpid()
+        return self._disk
+
+    def get(self, key: str) -> Optional[str]:
+        html = self.lru.get(key)
+        if html is not None:
+            return html
+        disk = self.disk()
+        html = disk.get(key) if disk is not None else None
+        if html is not None:
+            with self.lru.lock:
+                # Served from disk after all, don't count it as a miss.
+                self.lru.misses -= 1
+                self.disk_hits += 1
+            self.lru.put(key, html)
         return html
 
-    def heading(self, text, level):
-        tag = "h" + str(level)
-        tid = text.lower().replace(" ", "_")
-        link_icon = '<svg xmlns="http://www.w3.org/2000/svg" width="1em" height="1em" viewBox="0 0 8 8"><path fill="currentColor" d="M5.88.03a1.9 1.9 0 0 0-.53.09c-.27.1-.53.25-.75.47a.5.5 0 1 0 .69.69c.11-.11.24-.17.38-.22c.35-.12.78-.07 1.06.22c.39.39.39 1.04 0 1.44l-1.5 1.5c-.44.44-.8.48-1.06.47c-.26-.01-.41-.13-.41-.13a.5.5 0 1 0-.5.88s.34.22.84.25c.5.03 1.2-.16 1.81-.78l1.5-1.5A1.98 1.98 0 0 0 6.44.07C6.26.03 6.06.03 5.88.04zm-2 2.31c-.5-.02-1.19.15-1.78.75L.6 4.59a1.98 1.98 0 0 0 0 2.81c.56.56 1.36.72 2.06.47c.27-.1.53-.25.75-.47a.5.5 0 1 0-.69-.69c-.11.11-.24.17-.38.22c-.35.12-.78.07-1.06-.22c-.39-.39-.39-1.04 0-1.44l1.5-1.5c.4-.4.75-.45 1.03-.44c.28.01.47.09.47.09a.5.5 0 1 0 .44-.88s-.34-.2-.84-.22z"/></svg>'
-        link_anchor = f'<a class="hidden" tabindex="-1" href="#{tid}" style="font-size: .8rem">{link_icon}</a>'
-        return f'''<{tag} id="{tid}">{text}&nbsp;{link_anchor}</{tag}>\n'''
+    def put(self, key: str, html: str):
+        self.lru.put(key, html)
+        disk = self.disk()
+        if disk is not None:
+            disk.set(key, html)
+
+    @timing.timed("markdown")
+    def render(self, md: str) -> str:
+        key = self.key(md)
+        html = self.get(key)
+        if html is None:
+            from render import get_md_factory
+
+            html = get_md_factory()(md)
+            self.put(key, html)
+        return html
 
-    def image(self, alt, url, title=None):
-        """
-        title is repurposed to contain the following information separated by ;;
-            caption, percent_width
-        """
-        d = {}
-        if title:
-            d = {i: v for i, v in enumerate(title.split(";;"))}
-        caption = d.get(0, None)
-        percent_width = d.get(1, 100)
-        url = mistune.escape_url(url)
-        alt = mistune.escape(alt)
-        caption_html = (
-            f'<em class="text-gray">{mistune.escape(caption)}</em>' if caption else ""
-        )
-        return f'<p style="text-align: center"><img class="my-resp-img" src="{url}" alt="{alt}" style="width: {percent_width}%"/><br>{caption_html}</p>'
+    def stats(self) -> dict:
+        return {**self.lru.stats(), "disk_hits": self.disk_hits}
 
 
-def get_md_factory() -> "mistune.markdown.Markdown":
-    return mistune.create_markdown(
-        renderer=HighlightRenderer(), plugins=["strikethrough", "footnotes", "math"]
-    )
+_render_cache = None
+_render_cache_lock = threading.Lock()
+
+
+def get_render_cache() -> RenderCache:
+    """
+    BLOG_RENDER_CACHE_MB caps the in-process tier, BLOG_RENDER_CACHE_DIR points
+    the persistent tier somewhere else (empty string disables it).
+    """
+    global _render_cache
+    if _render_cache is None:
+        with _render_cache_lock:
+            if _render_cache is None:
+                _render_cache = RenderCache(
+                    int(os.environ.get("BLOG_RENDER_CACHE_MB", "64")) * 1024 * 1024,
+                    os.environ.get("BLOG_RENDER_CACHE_DIR", ".cache/render"),
+                )
+    return _render_cache
+
+
+def render_markdown(md: str) -> str:
+    return get_render_cache().render(md)
 
 
 def get_local_content(folder: str, path_title: str) -> str:
@@ -114,21 +280,204 @@ def get_local_content(folder: str, path_title: str) -> str:
         return f.read()
 
 
+# One page of a listing, number counts from 1.
+Page = namedtuple("Page", ["number", "count", "posts"])
+
+# Written next to the posts so a fresh process can skip re-reading them,
+# BLOG_POSTS_INDEX="" disables it. Bump the version when the format changes.
+POSTS_INDEX = os.environ.get("BLOG_POSTS_INDEX", "posts/.index.json")
+POSTS_INDEX_VERSION = 4
+
+
+def post_stamps() -> Dict[str, Tuple[int, int]]:
+    """(mtime_ns, size) of every post file, keyed by path title."""
+    stamps = {}
+    for path in os.listdir("posts"):
+        if path.endswith(".md"):
+            st = os.stat("posts/" + path)
+            stamps[path[:-3]] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+
 class PostsCache:
-    def __init__(self):
+    """
+    An immutable snapshot of all posts. Passing the previous snapshot reuses
+    the parsed posts and body terms whose file mtime and size are unchanged, so
+    only added or edited files are re-read, and only the related posts they
+    affect are rescored. Posts are never mutated once
+    published, prev/next and related links are set on per-snapshot copies.
+    """
+
+    def __init__(
+        self,
+        previous: Optional["PostsCache"] = None,
+        stamps: Optional[Dict[str, Tuple[int, int]]] = None,
+    ):
+        from related import post_terms, scored_related
+
+        self.stamps = post_stamps() if stamps is None else stamps
+        # When posts/ last changed in ns, its own mtime moves when a post is
+        # deleted. Kept in the saved snapshot, so every process agrees on it.
+        self.modified = max(
+            [os.stat("posts").st_mtime_ns, *(m for m, _ in self.stamps.values())]
+        )
+        self.parsed = {}
+        self.terms = {}
+        changed = set(previous.stamps) - set(self.stamps) if previous else set()
+        for path_title, stamp in self.stamps.items():
+            if previous and previous.stamps.get(path_title) == stamp:
+                self.parsed[path_title] = previous.parsed[path_title]
+                terms = previous.terms.get(path_title)
+            else:
+                changed.add(path_title)
+                self.parsed[path_title] = load_post_header(
+                    path_title, f"posts/{path_title}.md"
+                )
+                terms = None
+            if terms is None:
+                terms = post_terms(self.parsed[path_title].body())
+            self.terms[path_title] = terms
+        ordered = sorted(self.parsed.values(), key=lambda p: p.date, reverse=True)
+        if previous is not None and not changed:
+            self.related = previous.related
+        else:
+            self.related = scored_related(
+                ordered,
+                self.terms,
+                previous=previous.related if previous else None,
+                changed=changed,
+            )
         self.cache = []
-        for path in os.listdir("posts"):
-            if not path.endswith(".md"):
-                continue
-            with open("posts/" + path, "r") as f:
-                self.cache.append(parse_post_metadata(path[:-3], f.read()))
-        self.cache.sort(key=lambda p: p.date, reverse=True)
-        for i in range(len(self.cache)):
-            if i > 0:
-                self.cache[i].next = self.cache[i - 1].path_title
-            if i < len(self.cache) - 1:
-                self.cache[i].prev = self.cache[i + 1].path_title
+        for i, p in enumerate(ordered):
+            self.cache.append(
+                replace(
+                    p,
+                    next=ordered[i - 1].path_title if i > 0 else None,
+                    prev=ordered[i + 1].path_title if i < len(ordered) - 1 else None,
+                    related=[r for r, _ in self.related[p.path_title]],
+                )
+            )
         self.path_to_post = {p.path_title: p for p in self.cache}
+        # Inverted indexes, each list is in the same (date) order as the cache.
+        self.by_tag = {}
+        self.by_category = {}
+        for p in self.cache:
+            for t in p.tags:
+                self.by_tag.setdefault(t, []).append(p)
+            self.by_category.setdefault(p.category, []).append(p)
+        self.tags = sorted(self.by_tag)
+        self.top_tags = get_top_k_tags(self.cache, len(self.by_tag))
+        self._finish("scan")
+
+    def _finish(self, loaded_from: str):
+        self._pages = {}
+        # Changes whenever any post file does, used to derive page ETags.
+        self.version = hashlib.sha256(
+            repr(sorted(self.stamps.items())).encode()
+        ).hexdigest()[:16]
+        self.checked_at = time.monotonic()
+        self.loaded_from = loaded_from
+        self.load_seconds = 0.0
+
+    def save(self, path: str):
+        """Writes the snapshot for load(), atomically so readers never see half of it."""
+        posts = []
+        for p in self.cache:
+            post = {f.name: getattr(p, f.name) for f in fields(ParsedPost)}
+            del post["content"], post["source"]
+            post["offset"] = p.source.offset
+            posts.append(post)
+        data = {
+            "version": POSTS_INDEX_VERSION,
+            "stamps": self.stamps,
+            "posts": posts,
+            "by_tag": {t: [p.path_title for p in ps] for t, ps in self.by_tag.items()},
+            "by_category": {
+                c: [p.path_title for p in ps] for c, ps in self.by_category.items()
+            },
+            "tags": self.tags,
+            "top_tags": self.top_tags,
+            "terms": self.terms,
+            "related": self.related,
+            "modified": self.modified,
+        }
+        with suppress(OSError):
+            with open(path + ".tmp", "w") as f:
+                json.dump(data, f, separators=(",", ":"))
+            os.replace(path + ".tmp", path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional["PostsCache"]:
+        """
+        The snapshot saved at path, or None if it is missing. Its stamps tell
+        whether posts changed since.
+        """
+        try:
+            with open(path, "rb") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != POSTS_INDEX_VERSION:
+            return None
+        self = cls.__new__(cls)
+        self.stamps = {k: tuple(v) for k, v in data["stamps"].items()}
+        self.cache = []
+        for post in data["posts"]:
+            path_title = sys.intern(post["path_title"])
+            source = PostSource(f"posts/{path_title}.md", post.pop("offset"))
+            post["path_title"] = path_title
+            post["category"] = sys.intern(post["category"])
+            post["tags"] = [sys.intern(t) for t in post["tags"]]
+            self.cache.append(ParsedPost(**post, content=None, source=source))
+        self.path_to_post = {p.path_title: p for p in self.cache}
+        self.parsed = self.path_to_post
+        self.terms = {k: (tuple(t), tuple(c)) for k, (t, c) in data["terms"].items()}
+        self.related = {
+            k: [(r, score) for r, score in v] for k, v in data["related"].items()
+        }
+        self.by_tag = {
+            t: [self.path_to_post[k] for k in keys]
+            for t, keys in data["by_tag"].items()
+        }
+        self.by_category = {
+            c: [self.path_to_post[k] for k in keys]
+            for c, keys in data["by_category"].items()
+        }
+        self.tags = data["tags"]
+        self.top_tags = data["top_tags"]
+        self.modified = data["modified"]
+        self._finish("snapshot")
+        return self
+
+    def pages(
+        self, size: int, tag: Optional[str] = None, category: Optional[str] = None
+    ) -> List[Page]:
+        """
+        The posts with tag, in category, or all of them, split into pages of
+        size posts. Computed once per listing, there is always at least one
+        (possibly empty) page.
+        """
+        key = (size, tag, category)
+        pages = self._pages.get(key)
+        if pages is None:
+            if tag is not None:
+                members = self.by_tag.get(tag, [])
+            elif category is not None:
+                members = self.by_category.get(category, [])
+            else:
+                members = self.cache
+            count = max(1, -(-len(members) // size))
+            pages = [
+                Page(n + 1, count, members[n * size : (n + 1) * size])
+                for n in range(count)
+            ]
+            # Unknown tags and categories aren't kept, anyone can request them.
+            if members:
+                self._pages[key] = pages
+        return pages
+
+    def is_stale(self) -> bool:
+        return post_stamps() != self.stamps
 
     def __iter__(self) -> ParsedPost:
         for p in self.cache:
@@ -137,17 +486,68 @@ class PostsCache:
     def __getitem__(self, path_title: str) -> ParsedPost:
         return self.path_to_post[path_title]
 
+    def __contains__(self, path_title: str) -> bool:
+        return path_title in self.path_to_post
+
     def keys(self) -> List[str]:
         return [p.path_title for p in self.cache]
 
 
+def load_posts_cache(previous: Optional[PostsCache] = None) -> PostsCache:
+    """
+    A fresh process starts from the POSTS_INDEX snapshot. When posts changed
+    since it was written, posts/ is scanned from it, only those are re-read,
+    and the snapshot is rewritten.
+    """
+    started = time.perf_counter()
+    stamps = post_stamps()
+    cache = None
+    if previous is None and POSTS_INDEX:
+        cache = PostsCache.load(POSTS_INDEX)
+        if cache is not None and cache.stamps != stamps:
+            previous, cache = cache, None
+    if cache is None:
+        cache = PostsCache(previous, stamps)
+        if POSTS_INDEX:
+            cache.save(POSTS_INDEX)
+    cache.load_seconds = time.perf_counter() - started
+    return cache
+
+
 _all_post_metadata_cache = None
+_all_post_metadata_lock = threading.Lock()
+_log = logging.getLogger(__name__)
 
 
+@timing.timed("posts")
 def get_all_posts_with_metadata() -> PostsCache:
+    """
+    Returns the current snapshot. At most every BLOG_POSTS_RELOAD_INTERVAL
+    seconds (default 1, negative disables) posts/ is checked for changes and a
+    rebuilt snapshot is swapped in, readers keep whichever one they already got.
+    A post that fails to parse, e.g. half-saved, keeps the previous snapshot
+    until the next check.
+    """
     global _all_post_metadata_cache
-    if _all_post_metadata_cache is None:
-        _all_post_metadata_cache = PostsCache()
+    cache = _all_post_metadata_cache
+    if cache is not None:
+        interval = float(os.environ.get("BLOG_POSTS_RELOAD_INTERVAL", "1"))
+        if interval < 0 or time.monotonic() - cache.checked_at < interval:
+            return cache
+    with _all_post_metadata_lock:
+        if _all_post_metadata_cache is not cache:
+            # Another thread already refreshed it.
+            return _all_post_metadata_cache
+        if cache is None:
+            _all_post_metadata_cache = load_posts_cache()
+        elif cache.is_stale():
+            try:
+                _all_post_metadata_cache = load_posts_cache(previous=cache)
+            except (OSError, ValueError, TypeError) as e:
+                _log.warning("keeping the previous posts, reload failed: %s", e)
+                cache.checked_at = time.monotonic()
+        else:
+            cache.checked_at = time.monotonic()
     return _all_post_metadata_cache
 
 
@@ -168,6 +568,123 @@ def get_top_k_tags(posts: List[ParsedPost], K: int) -> List[str]:
     return [tag[0] for tag in sorted_tags[:K]]
 
 
+COMPRESSIBLE_EXTENSIONS = {
+    ".html",
+    ".xml",
+    ".css",
+    ".js",
+    ".json",
+    ".svg",
+    ".txt",
+    ".cos",
+    ".stl",
+    ".wasm",
+    ".webmanifest",
+}
+COMPRESSIBLE_MIMETYPES = {
+    "text/html",
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "application/wasm",
+    "image/svg+xml",
+}
+ENCODING_SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+# Responses are compressed on the request path, pre-built .zst files once per
+# build, where the slow levels pay off.
+ZSTD_LEVEL = 3
+ZSTD_PREBUILT_LEVEL = 19
+
+
+def available_encodings() -> List[str]:
+    """Content-Encodings we can produce, most preferred first."""
+    return ["zstd", "gzip"]
+
+
+def compress(data: bytes, encoding: str, prebuilt: bool = False) -> bytes:
+    if encoding == "zstd":
+        level = ZSTD_PREBUILT_LEVEL if prebuilt else ZSTD_LEVEL
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    # mtime=0 keeps the output reproducible across builds.
+    return gzip.compress(data, compresslevel=9, mtime=0)
+
+
+def write_if_changed(path: str, data: bytes) -> bool:
+    """
+    Writes data unless path already holds exactly it. Unchanged build outputs
+    keep their mtime, so neither the output manifest nor git rehash them.
+    """
+    with suppress(OSError):
+        if os.path.getsize(path) == len(data):
+            with open(path, "rb") as f:
+                if f.read() == data:
+                    return False
+    with open(path, "wb") as f:
+        f.write(data)
+    return True
+
+
+# Files under these static/ folders get content-hashed URLs.
+FINGERPRINTED_DIRS = ("style/", "script/", "favicon_io/")
+_hashed_name = re.compile(r"^(.*)\.([0-9a-f]{10})(\.[^./]+)$")
+
+
+class AssetManifest:
+    """
+    Maps static files to content-hashed names, style/custom.css becomes
+    style/custom.<digest>.css. Digests are cached by mtime and size, so an
+    edited asset gets a new name without a restart.
+    """
+
+    def __init__(self, folder: str):
+        self.folder = folder
+        self.digests = {}
+
+    def digest(self, filename: str) -> Optional[str]:
+        path = os.path.join(self.folder, filename)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        cached = self.digests.get(filename)
+        if cached is None or cached[0] != stamp:
+            with open(path, "rb") as f:
+                cached = (stamp, hashlib.sha256(f.read()).hexdigest()[:10])
+            self.digests[filename] = cached
+        return cached[1]
+
+    def hashed(self, filename: str) -> str:
+        if not filename.startswith(FINGERPRINTED_DIRS):
+            return filename
+        digest = self.digest(filename)
+        if digest is None:
+            return filename
+        base, ext = os.path.splitext(filename)
+        return f"{base}.{digest}{ext}"
+
+    def resolve(self, hashed: str) -> Optional[str]:
+        """The original filename, if hashed names its current content."""
+        m = _hashed_name.match(hashed)
+        if not m or not hashed.startswith(FINGERPRINTED_DIRS):
+            return None
+        original = m.group(1) + m.group(3)
+        return original if self.digest(original) == m.group(2) else None
+
+    def mapping(self) -> dict:
+        rtn = {}
+        for d in FINGERPRINTED_DIRS:
+            for root, _, files in os.walk(os.path.join(self.folder, d)):
+                for name in files:
+                    filename = os.path.relpath(os.path.join(root, name), self.folder)
+                    filename = filename.replace(os.sep, "/")
+                    rtn[filename] = self.hashed(filename)
+        return dict(sorted(rtn.items()))
+
+
 def gen_post_md(path_title: str) -> str:
     return "- [{}]({})".format(path_title, url_for("post", path_title=path_title))
 
@@ -177,27 +694,84 @@ def parse_attribute(line: str) -> Tuple[str, str]:
     return parts[0], ": ".join(parts[1:])
 
 
-def parse_post_metadata(path_title: str, md: str) -> ParsedPost:
-    parts = md.split("---\n")
-    metadata_str, content = parts[1], "---\n".join(parts[2:])
+_tag_item = re.compile(r"""\s*(?:"((?:[^"\\]|\\.)*)"|'((?:[^'\\]|\\.)*)')\s*([,\]])""")
+_tag_escape = re.compile(r"\\(.)")
+
+
+def parse_tags(value: str) -> List[str]:
+    """Parses a list of quoted strings like ["a", 'b'] in one pass, no eval."""
+    value = value.strip()
+    if not value.startswith("["):
+        raise ValueError(f"malformed tags: {value!r}")
+    tags, pos = [], 1
+    while value[pos:].strip() != "]":
+        m = _tag_item.match(value, pos)
+        if m is None:
+            raise ValueError(f"malformed tags: {value!r}")
+        tag = m.group(1) if m.group(1) is not None else m.group(2)
+        tags.append(sys.intern(_tag_escape.sub(r"\1", tag)))
+        pos = m.end()
+        if m.group(3) == "]":
+            if value[pos:].strip():
+                raise ValueError(f"malformed tags: {value!r}")
+            break
+    return tags
+
+
+def _post_from_front_matter(
+    path_title: str,
+    lines: List[str],
+    content: Optional[str],
+    source: Optional[PostSource] = None,
+) -> ParsedPost:
     metadata = {
         "content": content,
-        "path_title": path_title,
+        "path_title": sys.intern(path_title),
         "enable_cosmo": False,
         "thumbnail": None,
         "subtitle": None,
         "prev": None,
         "next": None,
+        "source": source,
     }
-    for line in metadata_str.strip().split("\n"):
+    for line in lines:
+        if not line.strip():
+            continue
         key, value = parse_attribute(line)
         if key == "tags":
-            metadata["tags"] = eval(value.strip())
+            metadata["tags"] = parse_tags(value)
+        elif key == "category":
+            metadata["category"] = sys.intern(value.strip())
         else:
             metadata[key] = value.strip()
     return ParsedPost(**metadata)
 
 
+def parse_post_metadata(path_title: str, md: str) -> ParsedPost:
+    parts = md.split("---\n", 2)
+    metadata_str, content = parts[1], parts[2]
+    return _post_from_front_matter(path_title, metadata_str.split("\n"), content)
+
+
+def load_post_header(path_title: str, path: str) -> ParsedPost:
+    """
+    Reads only the front matter of a post file, the body stays on disk and is
+    read by ParsedPost.body() when needed.
+    """
+    lines = []
+    with open(path, "rb") as f:
+        if f.readline() != b"---\n":
+            raise ValueError(f"{path}: missing front matter")
+        for line in f:
+            if line == b"---\n":
+                break
+            lines.append(line.decode("utf-8").rstrip("\n"))
+        else:
+            raise ValueError(f"{path}: unterminated front matter")
+        offset = f.tell()
+    return _post_from_front_matter(path_title, lines, None, PostSource(path, offset))
+
+
 def gen_new_post(title: str):
     path_title = title.replace(" ", "-")
     with open(f"posts/{path_title}.md", "w") as f:
@@ -220,17 +794,138 @@ if __name__ == "__main__":
 GitCommit = namedtuple("GitCommit", ["hash", "date", "message"])
 
 
-def get_git_commits(n: int) -> List[GitCommit]:
-    commits = []
-    for line in os.popen("git log --pretty=format:'%h - %cd - %s' -n {}".format(n)):
-        parts = line.strip().split(" - ")
-        commits.append(
-            GitCommit(
-                hash=parts[0],
-                date=datetime.strptime(parts[1], "%a %b %d %H:%M:%S %Y %z").strftime(
-                    "%Y-%m-%d %H:%M"
-                ),
-                message=parts[2],
-            )
+class GitMetadata:
+    """
+    Git history read once per HEAD. HEAD is resolved by reading .git directly,
+    so checking for new commits doesn't fork a process.
+    """
+
+    def __init__(self, root: str = "."):
+        self.root = root
+        self.head = None
+        self.commit_cache = []
+        self.commit_cache_n = 0
+        self.mtimes = None
+        self.time = None
+        self.lock = threading.Lock()
+
+    def git_dir(self) -> str:
+        path = os.path.join(self.root, ".git")
+        if os.path.isfile(path):
+            # Worktrees and submodules point at the real git dir.
+            with open(path, "r") as f:
+                path = os.path.join(self.root, f.read().strip()[len("gitdir: ") :])
+        return path
+
+    def current_head(self) -> Optional[str]:
+        try:
+            git_dir = self.git_dir()
+            with open(os.path.join(git_dir, "HEAD"), "r") as f:
+                head = f.read().strip()
+        except OSError:
+            return None
+        if not head.startswith("ref: "):
+            return head
+        ref = head[len("ref: ") :]
+        # A worktree has its own HEAD, branches live in the common git dir.
+        common_dir = git_dir
+        with suppress(OSError):
+            with open(os.path.join(git_dir, "commondir"), "r") as f:
+                common_dir = os.path.join(git_dir, f.read().strip())
+        for directory in dict.fromkeys([git_dir, common_dir]):
+            try:
+                with open(os.path.join(directory, ref), "r") as f:
+                    return f.read().strip()
+            except OSError:
+                pass
+            try:
+                with open(os.path.join(directory, "packed-refs"), "r") as f:
+                    for line in f:
+                        if line.rstrip().endswith(" " + ref):
+                            return line.split()[0]
+            except OSError:
+                pass
+        # Some other ref storage, ask git. An unborn branch has no commit yet.
+        return self.git("rev-parse", "--verify", "-q", "HEAD").strip() or None
+
+    def refresh(self) -> Optional[str]:
+        head = self.current_head()
+        if head != self.head:
+            self.head = head
+            self.commit_cache = []
+            self.commit_cache_n = 0
+            self.mtimes = None
+            self.time = None
+        return head
+
+    def version(self) -> Optional[str]:
+        """The current HEAD commit, for keying anything derived from history."""
+        with self.lock:
+            return self.refresh()
+
+    def head_time(self) -> Optional[int]:
+        """Commit time of HEAD in seconds since the epoch, read once per HEAD."""
+        with self.lock:
+            if self.refresh() is not None and self.time is None:
+                output = self.git("show", "-s", "--format=%ct", "HEAD").strip()
+                self.time = int(output) if output else None
+            return self.time
+
+    @timing.timed("git")
+    def git(self, *args: str) -> str:
+        result = subprocess.run(
+            ["git", "-c", "core.quotepath=off", *args],
+            cwd=self.root,
+            capture_output=True,
+            text=True,
         )
-    return commits
+        return result.stdout if result.returncode == 0 else ""
+
+    def commits(self, n: int) -> List[GitCommit]:
+        with self.lock:
+            self.refresh()
+            if n > self.commit_cache_n:
+                self.commit_cache = []
+                output = self.git("log", "--pretty=format:%h - %cd - %s", "-n", str(n))
+                for line in output.splitlines():
+                    parts = line.strip().split(" - ", 2)
+                    self.commit_cache.append(
+                        GitCommit(
+                            hash=parts[0],
+                            date=datetime.strptime(
+                                parts[1], "%a %b %d %H:%M:%S %Y %z"
+                            ).strftime("%Y-%m-%d %H:%M"),
+                            message=parts[2],
+                        )
+                    )
+                self.commit_cache_n = n
+            return self.commit_cache[:n]
+
+    def post_mtimes(self) -> Dict[str, datetime]:
+        """Last commit time of every file under posts/, from a single git log."""
+        with self.lock:
+            self.refresh()
+            if self.mtimes is None:
+                self.mtimes = {}
+                timestamp = None
+                output = self.git(
+                    "log", "--format=%x00%ct", "--name-only", "--", "posts"
+                )
+                for line in output.splitlines():
+                    if line.startswith("\0"):
+                        timestamp = datetime.fromtimestamp(int(line[1:]))
+                    elif line.startswith("posts/") and line.endswith(".md"):
+                        # Newest first, keep the first time a file shows up.
+                        self.mtimes.setdefault(line[len("posts/") : -3], timestamp)
+            return self.mtimes
+
+
+_git_metadata = GitMetadata()
+
+
+def get_git_metadata() -> GitMetadata:
+    return _git_metadata
+
+
+def get_git_commits(n: int) -> List[GitCommit]:
+    return _git_metadata.commits(n)
@@ -1,12 +1,19 @@
 import pytest
 from unittest.mock import mock_open, patch, MagicMock, call
 from datetime import datetime
+from dataclasses import replace
 import os
+import subprocess
+import sys
 import time
+import zstandard
 from flask import Flask
 
 import utils
-from utils import ParsedPost, HighlightRenderer
+import related
+import render
+from utils import ParsedPost
+from render import HighlightRenderer
 from app import app
 
 
@@ -71,6 +78,26 @@ def test_parse_post_metadata_invalid():
         utils.parse_post_metadata("invalid", invalid_metadata)
 
 
+def test_parse_tags():
+    assert utils.parse_tags('["a", \'b c\', "d\\"e",]') == ["a", "b c", 'd"e']
+    assert utils.parse_tags(" [ ] ") == []
+    for malformed in ["a", '["a" "b"]', '["a"] x', '["a"', '[__import__("os")]']:
+        with pytest.raises(ValueError):
+            utils.parse_tags(malformed)
+
+
+def test_load_post_header_reads_body_lazily(tmp_path, valid_metadata):
+    path = tmp_path / "test-post.md"
+    path.write_text(valid_metadata + "---\nafter a rule\n")
+    post = utils.load_post_header("test-post", str(path))
+    assert post.content is None
+    assert post.tags == ["python", "testing"]
+    parsed = utils.parse_post_metadata("test-post", path.read_text())
+    assert replace(parsed, content=None) == post
+    assert post.body() == "Test content here\n---\nafter a rule\n"
+    assert not hasattr(post, "__dict__")
+
+
 # Test HighlightRenderer
 def test_block_code_with_language():
     renderer = HighlightRenderer()
@@ -81,6 +108,17 @@ def test_block_code_with_language():
     assert "Hello, World!" in result
 
 
+def test_block_code_highlight_is_memoized():
+    renderer = HighlightRenderer()
+    code = 'x = "memoized"'
+    first = renderer.block_code(code, "python,Summary")
+    with patch("render.highlight") as mock_highlight:
+        assert renderer.block_code(code, "python,Summary") == first
+        mock_highlight.assert_not_called()
+    assert renderer.block_code(code, "python") != first
+    assert render.get_lexer("python") is render.get_lexer("python")
+
+
 def test_block_code_without_language():
     renderer = HighlightRenderer()
     code = 'print("Hello")'
@@ -114,41 +152,31 @@ def test_image_without_caption():
 
 
 # Test post management functions
-def test_get_all_posts_with_metadata(mock_posts_dir):
-    mock_data = """---
+@pytest.fixture
+def posts_dir(tmp_path, mock_posts_dir, monkeypatch):
+    (tmp_path / "posts").mkdir()
+    for i, name in enumerate(mock_posts_dir):
+        (tmp_path / "posts" / name).write_text(f"""---
 title: Test
-date: 2024-01-01 12:00:00
+date: 2024-01-0{i + 1} 12:00:00
 tags: []
 category: default
 ---
-content"""
+content""")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(utils, "_all_post_metadata_cache", None)
+    return tmp_path / "posts"
 
-    with (
-        patch("os.listdir", return_value=mock_posts_dir),
-        patch("builtins.open", mock_open(read_data=mock_data)),
-    ):
-        posts_cache = utils.get_all_posts_with_metadata()
-        posts = list(posts_cache)  # Convert to list
-        assert len(posts) == 2  # Only .md files
-        assert all(isinstance(p, ParsedPost) for p in posts)
 
+def test_get_all_posts_with_metadata(posts_dir):
+    posts_cache = utils.get_all_posts_with_metadata()
+    posts = list(posts_cache)  # Convert to list
+    assert len(posts) == 2  # Only .md files
+    assert all(isinstance(p, ParsedPost) for p in posts)
 
-def test_get_all_posts_caching(mock_posts_dir):
-    mock_data = """---
-title: Test
-date: 2024-01-01 12:00:00
-tags: []
-category: default
----
-content"""
 
-    with (
-        patch("os.listdir") as mock_listdir,
-        patch("builtins.open", mock_open(read_data=mock_data)),
-    ):
-        mock_listdir.return_value = mock_posts_dir
-        # Clear cache
-        utils._all_post_metadata_cache = None
+def test_get_all_posts_caching(posts_dir):
+    with patch("os.listdir", wraps=os.listdir) as mock_listdir:
         # First call
         posts1 = utils.get_all_posts_with_metadata()
         # Second call should use cache
@@ -156,6 +184,154 @@ content"""
 
         # Verify listdir was only called once (caching worked)
         assert mock_listdir.call_count == 1
+        assert posts1 is posts2
+
+
+def test_get_all_posts_reloads_changed_posts(posts_dir, monkeypatch):
+    monkeypatch.setenv("BLOG_POSTS_RELOAD_INTERVAL", "0")
+    posts1 = utils.get_all_posts_with_metadata()
+    assert utils.get_all_posts_with_metadata() is posts1
+
+    (posts_dir / "post2.md").write_text("""---
+title: Edited
+date: 2024-01-02 12:00:00
+tags: []
+category: default
+---
+new content""")
+    (posts_dir / "post3.md").write_text("""---
+title: Added
+date: 2024-01-03 12:00:00
+tags: []
+category: default
+---
+content""")
+    (posts_dir / "post1.md").unlink()
+    posts2 = utils.get_all_posts_with_metadata()
+    assert posts2 is not posts1
+    assert posts2.keys() == ["post3", "post2"]
+    assert posts2["post2"].title == "Edited"
+    assert posts2["post2"].next == "post3"
+    # The old snapshot is left untouched for readers still holding it
+    assert posts1.keys() == ["post2", "post1"]
+    assert posts1["post2"].next is None
+    assert posts1["post2"].title == "Test"
+
+
+def test_get_all_posts_keeps_snapshot_on_parse_error(posts_dir, monkeypatch, caplog):
+    monkeypatch.setenv("BLOG_POSTS_RELOAD_INTERVAL", "0")
+    posts1 = utils.get_all_posts_with_metadata()
+    (posts_dir / "post2.md").write_text("---\ntitle: Half\ntags: [\n")
+    checked_at = posts1.checked_at
+    assert utils.get_all_posts_with_metadata() is posts1
+    assert posts1.checked_at > checked_at
+    assert "reload failed" in caplog.text
+
+    (posts_dir / "post2.md").write_text("""---
+title: Saved
+date: 2024-01-02 12:00:00
+tags: []
+category: default
+---
+content""")
+    assert utils.get_all_posts_with_metadata()["post2"].title == "Saved"
+
+
+def test_posts_cache_reparses_only_changed_files(posts_dir):
+    posts1 = utils.PostsCache()
+    with patch("utils.load_post_header", wraps=utils.load_post_header) as parse:
+        posts2 = utils.PostsCache(previous=posts1)
+        assert parse.call_count == 0
+        (posts_dir / "post1.md").write_text(
+            (posts_dir / "post1.md").read_text() + "more"
+        )
+        utils.PostsCache(previous=posts2)
+        assert parse.call_count == 1
+
+
+def test_posts_cache_reuses_terms_of_unchanged_posts(posts_dir):
+    posts1 = utils.PostsCache()
+    with patch("related.post_terms", wraps=related.post_terms) as terms:
+        utils.PostsCache(previous=posts1)
+        assert terms.call_count == 0
+        (posts_dir / "post1.md").write_text(
+            (posts_dir / "post1.md").read_text() + " shared words"
+        )
+        (posts_dir / "post2.md").write_text(
+            (posts_dir / "post2.md").read_text() + " shared words"
+        )
+        posts2 = utils.PostsCache(previous=posts1)
+        assert terms.call_count == 2
+    assert posts2["post1"].related == ["post2"]
+    assert posts2["post2"].related == ["post1"]
+
+
+def test_posts_cache_tag_and_category_indexes(tmp_path, monkeypatch):
+    (tmp_path / "posts").mkdir()
+    for name, date, tags, category in [
+        ("a", "2024-01-01 00:00:00", '["x", "y"]', "tech"),
+        ("b", "2024-01-02 00:00:00", '["y"]', "life"),
+        ("c", "2024-01-03 00:00:00", '["y", "z"]', "tech"),
+    ]:
+        (tmp_path / "posts" / f"{name}.md").write_text(
+            f"---\ntitle: {name}\ndate: {date}\ntags: {tags}\ncategory: {category}\n---\n"
+        )
+    monkeypatch.chdir(tmp_path)
+    cache = utils.PostsCache()
+    assert [p.path_title for p in cache.by_tag["y"]] == ["c", "b", "a"]
+    assert [p.path_title for p in cache.by_category["tech"]] == ["c", "a"]
+    assert cache.tags == ["x", "y", "z"]
+    assert cache.top_tags[0] == "y"
+    assert cache.top_tags == utils.get_top_k_tags(cache, 3)
+
+
+def test_posts_cache_pages(posts_dir):
+    cache = utils.PostsCache()
+    pages = cache.pages(1)
+    assert [(p.number, p.count, p.posts) for p in pages] == [
+        (1, 2, [cache["post2"]]),
+        (2, 2, [cache["post1"]]),
+    ]
+    assert cache.pages(1) is pages
+    assert cache.pages(5, category="default")[0].posts == cache.cache
+    assert cache.pages(5, tag="missing") == [utils.Page(1, 1, [])]
+
+
+def test_posts_index_snapshot_round_trip(posts_dir, monkeypatch):
+    index = str(posts_dir / ".index.json")
+    monkeypatch.setattr(utils, "POSTS_INDEX", index)
+    scanned = utils.load_posts_cache()
+    assert scanned.loaded_from == "scan"
+    assert os.path.exists(index)
+
+    with patch("utils.load_post_header") as load:
+        loaded = utils.load_posts_cache()
+        load.assert_not_called()
+    assert loaded.loaded_from == "snapshot"
+    assert loaded.cache == scanned.cache
+    assert loaded.by_category.keys() == scanned.by_category.keys()
+    assert loaded.version == scanned.version
+    assert loaded["post2"].body() == "content"
+    assert loaded.terms == scanned.terms
+
+    (posts_dir / "post1.md").write_text(
+        (posts_dir / "post1.md").read_text() + " edited"
+    )
+    with patch("utils.load_post_header", wraps=utils.load_post_header) as load:
+        rescanned = utils.load_posts_cache()
+    assert rescanned.loaded_from == "scan"
+    # The stale snapshot still spares re-reading the unchanged posts.
+    assert [c.args[0] for c in load.call_args_list] == ["post1"]
+    assert rescanned.related == scanned.related
+    assert utils.load_posts_cache()["post1"].body() == "content edited"
+
+
+def test_app_import_defers_rendering_libraries():
+    code = "import sys, app; print(sorted({'mistune', 'pygments', 'diskcache', 'feedgenerator'} & set(sys.modules)))"
+    result = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == "[]"
 
 
 # Test tag handling
@@ -278,3 +454,175 @@ def test_parse_attribute_with_multiple_colons():
     key, value = utils.parse_attribute("time: 12:30:45")
     assert key == "time"
     assert value == "12:30:45"
+
+
+# Test rendered HTML cache
+def test_render_cache_hit_and_miss(tmp_path):
+    cache = utils.RenderCache(1024 * 1024, str(tmp_path))
+    html = cache.render("# Hello")
+    assert html == render.get_md_factory()("# Hello")
+    assert cache.render("# Hello") == html
+    stats = cache.stats()
+    assert stats["misses"] == 1
+    assert stats["hits"] == 1
+
+
+def test_render_cache_lru_eviction():
+    cache = utils.RenderCache(10)
+    cache.put("a", "x" * 6)
+    cache.put("b", "y" * 6)
+    assert cache.get("a") is None
+    assert cache.get("b") == "y" * 6
+    assert cache.stats()["evictions"] == 1
+
+
+def test_render_cache_disk_tier_warms_new_instance(tmp_path):
+    utils.RenderCache(1024, str(tmp_path)).render("some *text*")
+    cache = utils.RenderCache(1024, str(tmp_path))
+    cache.render("some *text*")
+    assert cache.stats()["disk_hits"] == 1
+    assert cache.stats()["misses"] == 0
+
+
+def test_render_cache_key_depends_on_renderer_version():
+    key = utils.RenderCache.key("text")
+    with patch("utils.RENDERER_VERSION", "changed"):
+        assert utils.RenderCache.key("text") != key
+
+
+# Test static asset fingerprinting
+def test_asset_manifest_hashed_and_resolve(tmp_path):
+    (tmp_path / "style").mkdir()
+    (tmp_path / "style" / "site.css").write_text("body {}")
+    (tmp_path / "image.png").write_bytes(b"png")
+    assets = utils.AssetManifest(str(tmp_path))
+
+    hashed = assets.hashed("style/site.css")
+    assert hashed.startswith("style/site.") and hashed.endswith(".css")
+    assert hashed != "style/site.css"
+    assert assets.resolve(hashed) == "style/site.css"
+    # Only fingerprinted folders get hashed names
+    assert assets.hashed("image.png") == "image.png"
+    assert assets.mapping() == {"style/site.css": hashed}
+
+    (tmp_path / "style" / "site.css").write_text("body { color: red }")
+    assert assets.hashed("style/site.css") != hashed
+    assert assets.resolve(hashed) is None
+
+
+# Test git metadata
+@pytest.fixture
+def git_repo(tmp_path):
+    git_dir = tmp_path / ".git"
+    (git_dir / "refs" / "heads").mkdir(parents=True)
+    (git_dir / "HEAD").write_text("ref: refs/heads/main\n")
+    (git_dir / "refs" / "heads" / "main").write_text("a" * 40 + "\n")
+    return tmp_path
+
+
+def test_git_metadata_reads_head_without_subprocess(git_repo):
+    git = utils.GitMetadata(str(git_repo))
+    with patch("subprocess.run") as run:
+        assert git.current_head() == "a" * 40
+        run.assert_not_called()
+    (git_repo / ".git" / "refs" / "heads" / "main").unlink()
+    (git_repo / ".git" / "packed-refs").write_text(
+        "# pack-refs with: peeled\n" + "b" * 40 + " refs/heads/main\n"
+    )
+    assert git.current_head() == "b" * 40
+
+
+def test_git_metadata_resolves_worktree_branches(tmp_path, monkeypatch):
+    for key in ("AUTHOR", "COMMITTER"):
+        monkeypatch.setenv(f"GIT_{key}_NAME", "test")
+        monkeypatch.setenv(f"GIT_{key}_EMAIL", "test@example.com")
+
+    def git(cwd, *args):
+        return subprocess.run(
+            ["git", *args], cwd=cwd, check=True, capture_output=True, text=True
+        ).stdout.strip()
+
+    main, tree = tmp_path / "main", tmp_path / "tree"
+    git(tmp_path, "init", "-q", str(main))
+    git(main, "commit", "-q", "--allow-empty", "-m", "first")
+    git(main, "worktree", "add", "-q", "-b", "side", str(tree))
+    metadata = utils.GitMetadata(str(tree))
+    assert metadata.current_head() == git(tree, "rev-parse", "HEAD")
+    git(tree, "commit", "-q", "--allow-empty", "-m", "second")
+    assert metadata.current_head() == git(tree, "rev-parse", "HEAD")
+
+
+def test_git_commits_cached_until_head_changes(git_repo):
+    git = utils.GitMetadata(str(git_repo))
+    log = MagicMock(
+        returncode=0,
+        stdout="abc1234 - Mon Jan 1 12:00:00 2024 +0000 - Fix - a bug\n"
+        "def5678 - Sun Dec 31 12:00:00 2023 +0000 - Initial\n",
+    )
+    with patch("subprocess.run", return_value=log) as run:
+        commits = git.commits(10)
+        assert git.commits(2) == commits
+        assert run.call_count == 1
+        assert commits[0] == utils.GitCommit(
+            "abc1234", "2024-01-01 12:00", "Fix - a bug"
+        )
+
+        (git_repo / ".git" / "refs" / "heads" / "main").write_text("c" * 40)
+        git.commits(10)
+        assert run.call_count == 2
+
+
+def test_git_post_mtimes_single_pass(git_repo):
+    git = utils.GitMetadata(str(git_repo))
+    log = MagicMock(
+        returncode=0,
+        stdout="\0" + "1704110400\n\nposts/a.md\nposts/b.md\n"
+        "\0" + "1704024000\n\nposts/a.md\nposts/c.md\nstatic/x.png\n",
+    )
+    with patch("subprocess.run", return_value=log) as run:
+        mtimes = git.post_mtimes()
+        git.post_mtimes()
+        assert run.call_count == 1
+    assert mtimes == {
+        "a": datetime.fromtimestamp(1704110400),
+        "b": datetime.fromtimestamp(1704110400),
+        "c": datetime.fromtimestamp(1704024000),
+    }
+
+
+def test_git_head_time_cached_until_head_changes(git_repo):
+    git = utils.GitMetadata(str(git_repo))
+    show = MagicMock(returncode=0, stdout="1704110400\n")
+    with patch("subprocess.run", return_value=show) as run:
+        assert git.head_time() == 1704110400
+        assert git.head_time() == 1704110400
+        assert run.call_count == 1
+        (git_repo / ".git" / "refs" / "heads" / "main").write_text("c" * 40)
+        git.head_time()
+        assert run.call_count == 2
+
+
+def test_compress_uses_slow_zstd_levels_only_when_prebuilt():
+    data = b"<p>hello</p>" * 1000
+    with patch("zstandard.ZstdCompressor", wraps=zstandard.ZstdCompressor) as zstd:
+        live = utils.compress(data, "zstd")
+        prebuilt = utils.compress(data, "zstd", prebuilt=True)
+    assert [c.kwargs["level"] for c in zstd.call_args_list] == [
+        utils.ZSTD_LEVEL,
+        utils.ZSTD_PREBUILT_LEVEL,
+    ]
+    assert zstandard.decompress(live) == zstandard.decompress(prebuilt) == data
+
+
+def test_page_features():
+    md = render.get_md_factory()
+    assert utils.page_features(md("plain *text*")) == frozenset()
+    assert utils.page_features(md("```python\nx = 1\n```")) == {"code"}
+    assert utils.page_features(md("```python,Show\nx = '<img '\n```")) == {
+        "code",
+        "details",
+    }
+    assert utils.page_features(md("inline $x^2$ math")) == {"math"}
+    assert utils.page_features(md("![alt](/static/a.png)")) == {"image"}
+    # Markers quoted inside code don't count.
+    assert utils.page_features(md('```html\n<div class="math">\n```')) == {"code"}